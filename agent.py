@@ -18,8 +18,9 @@ sys.path.insert(0, os.path.dirname(__file__))
 from bedrock_agentcore.runtime import BedrockAgentCoreApp
 
 # Import your pipeline
-from pipeline.orchestrator import process_dataframe_batch
-from config.reference import initialize_reference_data
+from pipeline.orchestrator import process_dataframe_batch, warmup_pipeline
+from pipeline.streaming import STREAM_FORMATS, stream_output_chunks, iterate_sync, parse_flag
+from pipeline.metrics import get_pipeline_metrics
 
 # Create AgentCore app
 app = BedrockAgentCoreApp()
@@ -31,7 +32,7 @@ def initialize():
     global _initialized
     if not _initialized:
         logger.info("🚀 Initializing Clio AI...")
-        initialize_reference_data()
+        warmup_pipeline()
         _initialized = True
         logger.info("✅ Ready to process!")
 
@@ -46,6 +47,17 @@ def invoke(payload: Dict[str, Any], context: Any = None) -> Dict[str, Any]:
         "input_csv": "vendor_name,vendor_url,product_name,product_url\\n...",
         "max_concurrent_rows": 20
     }
+    
+    Optional streaming mode (returns a stream of chunk events instead of one output_csv):
+    {
+        "stream": true,
+        "stream_format": "csv" | "ndjson",
+        "chunk_size": 10,
+        "ordered": true
+    }
+    
+    The response carries the batch's token and cost totals under "usage",
+    per model and per pipeline stage.
     """
     try:
         initialize()
@@ -74,6 +86,20 @@ def invoke(payload: Dict[str, Any], context: Any = None) -> Dict[str, Any]:
         
         logger.info(f"🔄 Processing {len(input_df)} rows...")
         
+        if parse_flag(effective.get('stream')):
+            stream_format = effective.get('stream_format', 'csv')
+            if stream_format not in STREAM_FORMATS:
+                return {'error': f'Invalid stream_format: {stream_format}', 'status': 'error'}
+            
+            # Returning a generator makes AgentCore stream each chunk as it is produced
+            return iterate_sync(stream_output_chunks(
+                input_df,
+                max_concurrent_rows=max_concurrent,
+                output_format=stream_format,
+                chunk_size=int(effective.get('chunk_size', 1)),
+                ordered=parse_flag(effective.get('ordered'), default=True)
+            ))
+        
         # Process
         output_df = process_dataframe_batch(input_df, max_concurrent_rows=max_concurrent)
         
@@ -85,6 +111,7 @@ def invoke(payload: Dict[str, Any], context: Any = None) -> Dict[str, Any]:
         return {
             'output_csv': output_csv,
             'rows_processed': len(output_df),
+            'usage': get_pipeline_metrics().get_usage(),
             'status': 'success'
         }
         
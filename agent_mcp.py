@@ -12,8 +12,8 @@ import pandas as pd
 from io import StringIO
 
 # Import your existing pipeline
-from pipeline.orchestrator import process_dataframe_batch
-from config.reference import initialize_reference_data
+from pipeline.orchestrator import process_dataframe_batch, warmup_pipeline
+from config.reference import get_taxonomy_index
 
 # Initialize MCP server
 mcp = FastMCP(
@@ -22,8 +22,9 @@ mcp = FastMCP(
     stateless_http=True
 )
 
-# Initialize reference data
-initialize_reference_data()
+# Compile the pipeline graph; reference data loads on first use, so tools
+# that only need the taxonomy never parse products.csv
+warmup_pipeline(load_reference=False)
 
 
 @mcp.tool()
@@ -118,17 +119,14 @@ def search_product_taxonomy(product_type: str) -> list:
         product_type: Type of product/software (e.g., "CRM Software", "Security Platform")
     
     Returns:
-        List of matching taxonomy categories
+        Up to 10 matching taxonomy categories, most relevant first
     """
-    from config.reference import get_product_attributes_list
+    # BM25 search over taxonomy names and definitions (loads taxonomy only)
+    index = get_taxonomy_index()
+    if index is None:
+        return []
     
-    attributes = get_product_attributes_list()
-    
-    # Simple keyword matching
-    product_type_lower = product_type.lower()
-    matches = [attr for attr in attributes if any(word in attr.lower() for word in product_type_lower.split())]
-    
-    return matches[:10]  # Top 10 matches
+    return [index.names[i] for i in index.search(product_type, top_k=10)]
 
 
 @mcp.tool()
@@ -0,0 +1,605 @@
+"""
+Benchmarks for prompt size, retrieval quality and latency
+Runs locally against the reference data; --live also calls Bedrock
+
+Usage:
+    python benchmark.py taxonomy [--top-k 30] [--live]
+    python benchmark.py attributes [--top-n 60] [--sample 500] [--live]
+    python benchmark.py products [--queries 500]
+    python benchmark.py startup [--repeat 5]
+    python benchmark.py matching [--sample 30]   (calls Bedrock)
+    python benchmark.py transport [--calls 500] [--concurrency 50] [--latency-ms 200]
+"""
+import sys
+import os
+import time
+import asyncio
+import argparse
+import statistics
+import subprocess
+import pandas as pd
+from pathlib import Path
+
+# Add current directory to path
+sys.path.insert(0, str(Path(__file__).parent))
+
+# Set data directory
+os.environ.setdefault('DATA_DIR', str(Path(__file__).parent / 'data'))
+
+from config.reference import (
+    initialize_reference_data,
+    get_taxonomy_list,
+    get_taxonomy_index,
+    get_products_dataframe,
+    get_product_attributes_list,
+    get_popular_product_attributes,
+    get_attribute_index,
+    get_product_name_index
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token for English text)"""
+    return max(1, len(text) // 4)
+
+
+def numbered_list(items) -> str:
+    """Format candidates the way the matching prompts do"""
+    return "\n".join(f"{i}. {item}" for i, item in enumerate(items, 1))
+
+
+def print_header(title: str):
+    print("\n" + "=" * 80)
+    print(title)
+    print("=" * 80)
+
+
+# =============================================================================
+# Taxonomy shortlist
+# =============================================================================
+
+def load_taxonomy_validation() -> pd.DataFrame:
+    path = Path(os.environ['DATA_DIR']) / 'taxonomy_validation.csv'
+    return pd.read_csv(path)
+
+
+async def _live_taxonomy_accuracy(cases: pd.DataFrame, top_k: int) -> dict:
+    """Run the real taxonomy node for every case, returning accuracy and latency"""
+    import pipeline.nodes as nodes
+    from pipeline.cache_manager import get_cache_manager
+    
+    nodes.TAXONOMY_TOP_K = top_k
+    get_cache_manager().clear()
+    
+    correct = 0
+    latencies = []
+    for case in cases.itertuples(index=False):
+        state = {
+            "row_id": "bench",
+            "vendor_name": "",
+            "vendor_url": "",
+            "product_name": case.product_name,
+            "product_url": "",
+            "software_type": case.software_type,
+            "errors": [],
+            "retry_count": 0
+        }
+        start = time.perf_counter()
+        result = await nodes.find_taxonomy_matches_node(state)
+        latencies.append(time.perf_counter() - start)
+        
+        names = [m.get("Taxonomy Name") for m in result["taxonomy_matches"]]
+        correct += case.expected_taxonomy in names
+    
+    return {
+        "accuracy": correct / len(cases),
+        "p50_latency_s": statistics.median(latencies),
+        "mean_latency_s": statistics.mean(latencies)
+    }
+
+
+def bench_taxonomy(top_k: int, live: bool):
+    print_header(f"TAXONOMY SHORTLIST (top_k={top_k})")
+    
+    initialize_reference_data()
+    taxonomy_list = get_taxonomy_list()
+    index = get_taxonomy_index()
+    if not taxonomy_list or index is None:
+        print("[ERROR] No taxonomy data loaded")
+        sys.exit(1)
+    
+    cases = load_taxonomy_validation()
+    full_tokens = estimate_tokens(numbered_list(taxonomy_list))
+    
+    shortlist_tokens = []
+    retrieval_us = []
+    recalled = 0
+    for case in cases.itertuples(index=False):
+        query = f"{case.product_name} {case.software_type}"
+        
+        start = time.perf_counter()
+        for _ in range(100):
+            candidates = index.shortlist(query, top_k)
+        retrieval_us.append((time.perf_counter() - start) / 100 * 1e6)
+        
+        shortlist_tokens.append(estimate_tokens(numbered_list(candidates)))
+        if case.expected_taxonomy in candidates:
+            recalled += 1
+        else:
+            print(f"   [MISS] {case.product_name} ({case.software_type})")
+    
+    mean_shortlist = statistics.mean(shortlist_tokens)
+    print(f"\nValidation cases:           {len(cases)}")
+    print(f"Taxonomy entries:           {len(taxonomy_list)}")
+    print(f"Candidate list tokens full: {full_tokens:,}")
+    print(f"Candidate list tokens top-k: {mean_shortlist:,.0f} (mean)")
+    print(f"Token reduction:            {1 - mean_shortlist / full_tokens:.1%}")
+    print(f"Recall@{top_k}:                 {recalled / len(cases):.1%}")
+    print(f"Retrieval latency:          {statistics.mean(retrieval_us):.1f}us (mean)")
+    
+    if live:
+        print("\nCalling Bedrock (full list vs shortlist)...")
+        full = asyncio.run(_live_taxonomy_accuracy(cases, 0))
+        shortlist = asyncio.run(_live_taxonomy_accuracy(cases, top_k))
+        print(f"   Full list: accuracy {full['accuracy']:.1%}, p50 {full['p50_latency_s']:.2f}s")
+        print(f"   Top-{top_k}:    accuracy {shortlist['accuracy']:.1%}, p50 {shortlist['p50_latency_s']:.2f}s")
+
+
+# =============================================================================
+# Attribute shortlist
+# =============================================================================
+
+def load_attribute_validation(sample: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Build an attribute validation set from products.csv
+    
+    Each sampled product's PRODUCT_ATTRIBUTES are the gold labels; the query
+    is its name and description, standing in for the name, type and features
+    the pipeline extracts.
+    """
+    products = get_products_dataframe()
+    products = products.dropna(subset=['PRODUCT_NAME', 'PRODUCT_ATTRIBUTES'])
+    products = products.sample(n=min(sample, len(products)), random_state=seed)
+    
+    return pd.DataFrame({
+        'product_name': products['PRODUCT_NAME'].astype(str),
+        'query': (
+            products['PRODUCT_NAME'].astype(str) + ' '
+            + products.get('PRODUCT_DESCRIPTION', pd.Series('', index=products.index)).fillna('').astype(str)
+        ),
+        'gold': products['PRODUCT_ATTRIBUTES'].astype(str).map(
+            lambda attrs: {a.strip() for a in attrs.split(',') if a.strip()}
+        )
+    })
+
+
+def _candidate_recall(cases: pd.DataFrame, candidates_for) -> dict:
+    """Share of cases with any gold attribute offered, and mean share of gold offered"""
+    any_hit = 0
+    coverage = []
+    tokens = []
+    for case in cases.itertuples(index=False):
+        candidates = candidates_for(case.query)
+        offered = case.gold.intersection(candidates)
+        any_hit += bool(offered)
+        coverage.append(len(offered) / len(case.gold))
+        tokens.append(estimate_tokens(numbered_list(candidates)))
+    return {
+        "any_recall": any_hit / len(cases),
+        "gold_coverage": statistics.mean(coverage),
+        "mean_tokens": statistics.mean(tokens)
+    }
+
+
+async def _live_attribute_accuracy(cases: pd.DataFrame, top_n: int) -> dict:
+    """Run the real attribute node, scoring picks that are in the gold set"""
+    import pipeline.nodes as nodes
+    from pipeline.cache_manager import get_cache_manager
+    
+    nodes.ATTRIBUTE_TOP_N = top_n
+    get_cache_manager().clear()
+    
+    precision = []
+    latencies = []
+    for case in cases.itertuples(index=False):
+        state = {
+            "row_id": "bench",
+            "vendor_name": "",
+            "vendor_url": "",
+            "product_name": case.product_name,
+            "product_url": "",
+            "software_type": case.query,
+            "errors": [],
+            "retry_count": 0
+        }
+        start = time.perf_counter()
+        result = await nodes.find_attribute_matches_node(state)
+        latencies.append(time.perf_counter() - start)
+        
+        picks = [m.get("Attribute Name") for m in result["attribute_matches"]]
+        precision.append(sum(p in case.gold for p in picks) / len(picks))
+    
+    return {
+        "precision": statistics.mean(precision),
+        "p50_latency_s": statistics.median(latencies)
+    }
+
+
+def bench_attributes(top_n: int, sample: int, live: bool):
+    print_header(f"ATTRIBUTE SHORTLIST (top_n={top_n}, sample={sample})")
+    
+    initialize_reference_data()
+    attributes = get_product_attributes_list()
+    index = get_attribute_index()
+    if not attributes or index is None:
+        print("[ERROR] No product attributes loaded (products.csv missing?)")
+        sys.exit(1)
+    
+    cases = load_attribute_validation(sample)
+    alphabetical = attributes[:200]
+    fallback = get_popular_product_attributes(200)
+    
+    first = _candidate_recall(cases, lambda query: alphabetical)
+    popular = _candidate_recall(cases, lambda query: fallback)
+    
+    start = time.perf_counter()
+    shortlist = _candidate_recall(
+        cases,
+        lambda query: index.shortlist(query, top_n, fallback=fallback)
+    )
+    retrieval_us = (time.perf_counter() - start) / len(cases) * 1e6
+    
+    columns = (("first-200", first), ("popular-200", popular), (f"top-{top_n}", shortlist))
+    print(f"\nValidation products:   {len(cases)}")
+    print(f"Attributes available:  {len(attributes):,}")
+    print(f"{'':24}" + "".join(f"{label:>13}" for label, _ in columns))
+    print(f"{'List tokens (mean)':24}" + "".join(f"{r['mean_tokens']:>13,.0f}" for _, r in columns))
+    print(f"{'Any gold offered':24}" + "".join(f"{r['any_recall']:>13.1%}" for _, r in columns))
+    print(f"{'Gold coverage (mean)':24}" + "".join(f"{r['gold_coverage']:>13.1%}" for _, r in columns))
+    print(f"Retrieval latency:     {retrieval_us:.1f}us (mean, incl. prompt formatting)")
+    
+    if live:
+        print("\nCalling Bedrock (popular-200 vs shortlist)...")
+        live_cases = cases.head(50)
+        full = asyncio.run(_live_attribute_accuracy(live_cases, 0))
+        short = asyncio.run(_live_attribute_accuracy(live_cases, top_n))
+        print(f"   Popular-200: precision {full['precision']:.1%}, p50 {full['p50_latency_s']:.2f}s")
+        print(f"   Top-{top_n}:      precision {short['precision']:.1%}, p50 {short['p50_latency_s']:.2f}s")
+
+
+# =============================================================================
+# Product name search
+# =============================================================================
+
+def _pandas_name_scan(products: pd.DataFrame, query: str, limit: int) -> pd.DataFrame:
+    """The previous search: a case-insensitive regex scan over every name"""
+    return products[
+        products['PRODUCT_NAME'].str.contains(query, case=False, na=False)
+    ].head(limit)
+
+
+def bench_products(queries: int, seed: int = 42):
+    print_header(f"PRODUCT NAME SEARCH (queries={queries})")
+    
+    initialize_reference_data()
+    products = get_products_dataframe()
+    index = get_product_name_index()
+    if products.empty or index is None:
+        print("[ERROR] No products loaded (products.csv missing?)")
+        sys.exit(1)
+    
+    # Full names, first words (partial matches) and lowercased names
+    names = products['PRODUCT_NAME'].dropna().astype(str)
+    names = names.sample(n=min(queries, len(names)), random_state=seed).tolist()
+    workload = (
+        names
+        + [name.split()[0] for name in names if name.split()]
+        + [name.lower() for name in names]
+    )
+    
+    scan_us = []
+    index_us = []
+    scan_errors = 0
+    agreed = 0
+    for query in workload:
+        start = time.perf_counter()
+        try:
+            expected = _pandas_name_scan(products, query, 10)
+        except Exception:
+            expected = None
+            scan_errors += 1
+        scan_us.append((time.perf_counter() - start) * 1e6)
+        
+        start = time.perf_counter()
+        rows = index.search(query, 10)
+        index_us.append((time.perf_counter() - start) * 1e6)
+        
+        # Both return the exact name when it exists
+        if expected is not None and not expected.empty:
+            found = products['PRODUCT_NAME'].iloc[rows].str.casefold().tolist()
+            agreed += expected['PRODUCT_NAME'].str.casefold().isin(found).any()
+    
+    print(f"\nProducts indexed:      {len(index):,}")
+    print(f"Queries:               {len(workload):,} (full names, first words, lowercased)")
+    print(f"{'':24}{'pandas scan':>14}{'name index':>14}")
+    print(f"{'Latency p50 (us)':24}{statistics.median(scan_us):>14,.1f}{statistics.median(index_us):>14,.1f}")
+    print(f"{'Latency mean (us)':24}{statistics.mean(scan_us):>14,.1f}{statistics.mean(index_us):>14,.1f}")
+    print(f"Speedup (p50):         {statistics.median(scan_us) / statistics.median(index_us):,.0f}x")
+    print(f"Scan regex errors:     {scan_errors}")
+    print(f"Queries sharing a hit: {agreed / max(1, len(workload) - scan_errors):.1%}")
+
+
+# =============================================================================
+# Cold start
+# =============================================================================
+
+# Run in a fresh interpreter, as on a container cold start
+_STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+from config.reference import initialize_reference_data, get_reference_stats
+imported = time.perf_counter()
+initialize_reference_data(use_snapshot={use_snapshot})
+loaded = time.perf_counter()
+stats = get_reference_stats()
+print(imported - start, loaded - imported, stats["products_count"], stats["attributes_count"])
+"""
+
+
+def _cold_start(use_snapshot: bool) -> tuple:
+    script = _STARTUP_SCRIPT.format(root=str(Path(__file__).parent), use_snapshot=use_snapshot)
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True, text=True, check=True, env=os.environ.copy()
+    ).stdout.split()
+    process_s = time.perf_counter() - start
+    return float(output[0]), float(output[1]), process_s, int(output[2]), int(output[3])
+
+
+def bench_startup(repeat: int):
+    print_header(f"REFERENCE DATA COLD START (repeat={repeat})")
+    
+    from config.snapshot import get_snapshot_dir, load_snapshot
+    data_dir = os.environ['DATA_DIR']
+    snapshot_dir = get_snapshot_dir(data_dir)
+    if load_snapshot(snapshot_dir, data_dir) is None:
+        print(f"[ERROR] No current snapshot at {snapshot_dir}; run: python -m config.snapshot")
+        sys.exit(1)
+    
+    results = {}
+    for label, use_snapshot in (("CSV", False), ("snapshot", True)):
+        runs = [_cold_start(use_snapshot) for _ in range(repeat)]
+        results[label] = runs
+        print(f"   {label:9} products={runs[0][3]:,} attributes={runs[0][4]:,}")
+    
+    print(f"\n{'':24}{'CSV':>12}{'snapshot':>12}")
+    for name, column in (("Imports p50 (ms)", 0), ("Load p50 (ms)", 1), ("Process p50 (ms)", 2)):
+        csv_ms = statistics.median(run[column] for run in results["CSV"]) * 1000
+        snap_ms = statistics.median(run[column] for run in results["snapshot"]) * 1000
+        print(f"{name:24}{csv_ms:>12,.1f}{snap_ms:>12,.1f}")
+    
+    csv_load = statistics.median(run[1] for run in results["CSV"])
+    snap_load = statistics.median(run[1] for run in results["snapshot"])
+    print(f"Load speedup:          {csv_load / snap_load:.1f}x")
+
+
+# =============================================================================
+# Combined vs split matching
+# =============================================================================
+
+async def _run_matching(cases: pd.DataFrame, combined: bool) -> dict:
+    """Run the matching stage for every case, one tracked row per case"""
+    import pipeline.nodes as nodes
+    from pipeline.orchestrator import parallel_matching_node
+    from pipeline.metrics import get_pipeline_metrics, track_row
+    from pipeline.cache_manager import get_cache_manager
+    from pipeline.bedrock_client import get_llm_manager
+    
+    nodes.COMBINED_MATCHING = combined
+    get_cache_manager().clear()
+    get_llm_manager().clear_cache()
+    metrics = get_pipeline_metrics()
+    metrics.reset()
+    
+    correct = 0
+    for case in cases.itertuples(index=False):
+        state = {
+            "row_id": "bench",
+            "vendor_name": "",
+            "vendor_url": "",
+            "product_name": case.product_name,
+            "product_url": "",
+            "software_type": case.software_type,
+            "errors": [],
+            "retry_count": 0
+        }
+        with track_row():
+            result = await parallel_matching_node(state)
+        names = [m.get("Taxonomy Name") for m in result.get("taxonomy_matches", [])]
+        correct += case.expected_taxonomy in names
+    
+    summary = metrics.get_summary()
+    summary["accuracy"] = correct / len(cases)
+    return summary
+
+
+def bench_matching(sample: int):
+    print_header(f"COMBINED VS SPLIT MATCHING (sample={sample}, live)")
+    
+    initialize_reference_data()
+    cases = load_taxonomy_validation().head(sample)
+    
+    split = asyncio.run(_run_matching(cases, combined=False))
+    combined = asyncio.run(_run_matching(cases, combined=True))
+    
+    print(f"\n{'':24}{'split':>12}{'combined':>12}")
+    for label, key, fmt in (
+        ("LLM calls per row", "calls_per_row", ",.2f"),
+        ("Tokens per row", "tokens_per_row", ",.0f"),
+        ("Row latency p50 (ms)", "row_latency_p50_ms", ",.0f"),
+        ("Row latency p95 (ms)", "row_latency_p95_ms", ",.0f"),
+        ("Taxonomy accuracy", "accuracy", ".1%")
+    ):
+        print(f"{label:24}{split[key]:>12{fmt}}{combined[key]:>12{fmt}}")
+
+
+# =============================================================================
+# Thread-pool vs async Bedrock transport (local mock endpoint)
+# =============================================================================
+
+def _serve_mock_bedrock(port_queue, latency_ms: float):
+    """Minimal InvokeModel endpoint: checks for a SigV4 header, sleeps, answers"""
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes; don't let the body wait for an ACK
+        disable_nagle_algorithm = True
+        
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not self.headers.get("Authorization", "").startswith("AWS4-HMAC-SHA256"):
+                status, body = 403, {"message": "Missing Authentication Token"}
+            else:
+                time.sleep(latency_ms / 1000)
+                status = 200
+                body = {
+                    "content": [{"type": "text", "text": '{"ok": true}'}],
+                    "usage": {"input_tokens": 100, "output_tokens": 10}
+                }
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        
+        def log_message(self, *args):
+            pass
+    
+    ThreadingHTTPServer.daemon_threads = True
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+async def _run_transport(kind: str, endpoint_url: str, calls: int, concurrency: int) -> dict:
+    """Send calls distinct requests through one transport and time them"""
+    import threading
+    from pipeline.bedrock_client import BedrockLLMManager
+    
+    manager = BedrockLLMManager(
+        max_concurrent=concurrency,
+        initial_concurrent=concurrency,
+        retry_budget_ratio=None,
+        transport=kind,
+        endpoint_url=endpoint_url,
+        cache_enabled=False
+    )
+    latencies = []
+    peak_threads = threading.active_count()
+    
+    async def one(i: int):
+        nonlocal peak_threads
+        start = time.perf_counter()
+        result = await manager.call_async(f"benchmark request {i}", model="haiku", use_cache=False)
+        latencies.append(time.perf_counter() - start)
+        peak_threads = max(peak_threads, threading.active_count())
+        return result is not None
+    
+    # Warm up connections before timing
+    await asyncio.gather(*(one(-i) for i in range(1, concurrency + 1)))
+    latencies.clear()
+    
+    start = time.perf_counter()
+    ok = sum(await asyncio.gather(*(one(i) for i in range(calls))))
+    elapsed = time.perf_counter() - start
+    
+    return {
+        "ok": ok,
+        "throughput": calls / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000,
+        "threads": peak_threads
+    }
+
+
+def bench_transport(calls: int, concurrency: int, latency_ms: float):
+    print_header(f"BEDROCK TRANSPORT (calls={calls}, concurrency={concurrency}, mock latency={latency_ms:.0f}ms)")
+    
+    import multiprocessing
+    
+    # The mock only checks that requests are signed
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(name, "benchmark")
+    
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve_mock_bedrock, args=(port_queue, latency_ms), daemon=True)
+    server.start()
+    endpoint_url = f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+    
+    try:
+        results = {kind: asyncio.run(_run_transport(kind, endpoint_url, calls, concurrency)) for kind in ("threads", "async")}
+    finally:
+        server.terminate()
+    
+    print(f"\n{'':24}{'threads':>12}{'async':>12}")
+    for label, key, fmt in (
+        ("Successful calls", "ok", ",d"),
+        ("Throughput (calls/s)", "throughput", ",.1f"),
+        ("Latency p50 (ms)", "p50_ms", ",.1f"),
+        ("Latency p95 (ms)", "p95_ms", ",.1f"),
+        ("Peak process threads", "threads", ",d")
+    ):
+        print(f"{label:24}{results['threads'][key]:>12{fmt}}{results['async'][key]:>12{fmt}}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clio AI benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    
+    taxonomy = subparsers.add_parser("taxonomy", help="Taxonomy retrieval shortlist")
+    taxonomy.add_argument("--top-k", type=int, default=int(os.getenv("TAXONOMY_TOP_K", "30")))
+    taxonomy.add_argument("--live", action="store_true", help="Also measure LLM accuracy and latency")
+    
+    attributes = subparsers.add_parser("attributes", help="Attribute retrieval shortlist")
+    attributes.add_argument("--top-n", type=int, default=int(os.getenv("ATTRIBUTE_TOP_N", "60")))
+    attributes.add_argument("--sample", type=int, default=500, help="Validation products sampled from products.csv")
+    attributes.add_argument("--live", action="store_true", help="Also measure LLM precision and latency")
+    
+    products = subparsers.add_parser("products", help="Product name search vs pandas scan")
+    products.add_argument("--queries", type=int, default=500, help="Product names sampled as queries")
+    
+    startup = subparsers.add_parser("startup", help="Reference data cold start, CSV vs snapshot")
+    startup.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per mode")
+    
+    matching = subparsers.add_parser("matching", help="Combined vs split taxonomy/attribute calls (live)")
+    matching.add_argument("--sample", type=int, default=30, help="Validation cases to run")
+    
+    transport = subparsers.add_parser("transport", help="Thread-pool vs async Bedrock transport (local mock)")
+    transport.add_argument("--calls", type=int, default=500, help="Requests per transport")
+    transport.add_argument("--concurrency", type=int, default=50, help="Concurrency limit and pool size")
+    transport.add_argument("--latency-ms", type=float, default=200, help="Mock endpoint response time")
+    
+    args = parser.parse_args()
+    
+    if args.benchmark == "taxonomy":
+        bench_taxonomy(args.top_k, args.live)
+    elif args.benchmark == "attributes":
+        bench_attributes(args.top_n, args.sample, args.live)
+    elif args.benchmark == "products":
+        bench_products(args.queries)
+    elif args.benchmark == "startup":
+        bench_startup(args.repeat)
+    elif args.benchmark == "matching":
+        bench_matching(args.sample)
+    elif args.benchmark == "transport":
+        bench_transport(args.calls, args.concurrency, args.latency_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -99,6 +99,16 @@ Return ONLY JSON in this exact format:
 No markdown, no explanations, just the JSON object."""
 }
 
+# Output token ceiling per prompt, sized to its JSON schema with headroom.
+# Packed requests use the per-product ceiling times the pack size.
+PROMPT_MAX_TOKENS = {
+    "vendor_info": 512,
+    "product_info": 1024,
+    "taxonomy_match": 256,
+    "attribute_match": 256,
+    "combined_match": 512
+}
+
 
 def get_prompt(prompt_name: str, **kwargs) -> str:
     """
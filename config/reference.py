@@ -1,88 +1,299 @@
 """
-Reference data loader for products.csv and intents.csv
-Loads data once and provides lookup functions
+Reference data loader for products.csv, intents.csv and taxonomy.csv
+Loads each dataset once, on first use, and provides lookup functions
 """
 import os
+import time
 import logging
+import threading
+from collections import Counter
+import numpy as np
 import pandas as pd
-from typing import List, Optional
+from typing import Dict, FrozenSet, List, Optional, Sequence, Set, Tuple
+
+from .retrieval import BM25Index, NameResolver, ProductNameIndex, normalize_name
+from .snapshot import get_snapshot_dir, load_snapshot
 
 logger = logging.getLogger(__name__)
 
+TAXONOMY_LEVELS = ("Category", "Subcategory", "Granular Category")
+
 # Global reference data
 _products_df: Optional[pd.DataFrame] = None
 _intents_df: Optional[pd.DataFrame] = None
+_product_name_index: Optional[ProductNameIndex] = None
 _product_attributes: Optional[List[str]] = None
+_product_attribute_set: FrozenSet[str] = frozenset()
+_product_attribute_counts: Dict[str, int] = {}
+_attributes_by_popularity: List[str] = []
+_attribute_normalized_lookup: Dict[str, str] = {}
+_taxonomy_index: Optional[BM25Index] = None
+
+# Taxonomy, held as parallel arrays indexed by taxonomy id
+_taxonomy_names: Optional[List[str]] = None
+_taxonomy_definitions: List[str] = []
+_taxonomy_level_labels: Dict[str, List[str]] = {}
+_taxonomy_level_codes: Dict[str, np.ndarray] = {}
+_taxonomy_lookup: Dict[str, int] = {}
+_taxonomy_normalized_lookup: Dict[str, int] = {}
 
+# Retrieval indexes built from the reference data
+_attribute_index: Optional[BM25Index] = None
+_taxonomy_resolver: Optional[NameResolver] = None
+_attribute_resolver: Optional[NameResolver] = None
 
-def initialize_reference_data():
+
+def _load_taxonomy(data_dir: str):
     """
-    Load reference data from CSV files
-    Called once during Lambda cold start
+    Parse taxonomy.csv into compact arrays and lookup indexes
+    
+    Names are built as "Category > Subcategory > Granular Category". Each
+    hierarchy level is stored as categorical codes into a label list.
     """
-    global _products_df, _intents_df, _product_attributes
+    global _taxonomy_names, _taxonomy_definitions
+    global _taxonomy_level_labels, _taxonomy_level_codes
+    global _taxonomy_lookup, _taxonomy_normalized_lookup
     
-    if _products_df is not None:
-        logger.info("Reference data already loaded")
+    taxonomy_path = os.path.join(data_dir, 'taxonomy.csv')
+    if not os.path.exists(taxonomy_path):
+        logger.warning(f"Taxonomy file not found: {taxonomy_path}")
+        _taxonomy_names = []
         return
     
-    try:
-        data_dir = os.environ.get('DATA_DIR', '/app/data')
-        
-        # Load products.csv
-        products_path = os.path.join(data_dir, 'products.csv')
-        if os.path.exists(products_path):
-            _products_df = pd.read_csv(products_path)
-            logger.info(f"Loaded {len(_products_df)} products from {products_path}")
-        else:
-            logger.warning(f"Products file not found: {products_path}")
-            _products_df = pd.DataFrame()
-        
-        # Load intents.csv
-        intents_path = os.path.join(data_dir, 'intents.csv')
-        if os.path.exists(intents_path):
-            _intents_df = pd.read_csv(intents_path)
-            logger.info(f"Loaded {len(_intents_df)} intents from {intents_path}")
-        else:
-            logger.warning(f"Intents file not found: {intents_path}")
-            _intents_df = pd.DataFrame()
-        
-        # Extract unique product attributes
-        if not _products_df.empty and 'PRODUCT_ATTRIBUTES' in _products_df.columns:
-            attributes_set = set()
-            for attrs in _products_df['PRODUCT_ATTRIBUTES'].dropna():
-                if pd.notna(attrs):
-                    for attr in str(attrs).split(','):
-                        attr = attr.strip()
-                        if attr:
-                            attributes_set.add(attr)
-            _product_attributes = sorted(list(attributes_set))
-            logger.info(f"Extracted {len(_product_attributes)} unique product attributes")
-        else:
-            _product_attributes = []
-            logger.warning("No product attributes found")
+    # The file carries a BOM and many trailing empty columns
+    taxonomy_df = pd.read_csv(
+        taxonomy_path,
+        encoding='utf-8-sig',
+        usecols=list(TAXONOMY_LEVELS) + ['Definition'],
+        dtype=str
+    )
+    taxonomy_df = taxonomy_df.apply(lambda col: col.str.strip())
+    taxonomy_df = taxonomy_df.dropna(subset=['Category'])
+    
+    levels = taxonomy_df[list(TAXONOMY_LEVELS)]
+    names = [
+        " > ".join(part for part in parts if isinstance(part, str) and part)
+        for parts in levels.itertuples(index=False, name=None)
+    ]
+    
+    level_labels = {}
+    level_codes = {}
+    for level in TAXONOMY_LEVELS:
+        categorical = pd.Categorical(taxonomy_df[level])
+        level_labels[level] = list(categorical.categories)
+        level_codes[level] = categorical.codes.astype(np.int16)
+    
+    lookup: Dict[str, int] = {}
+    normalized_lookup: Dict[str, int] = {}
+    for i, name in enumerate(names):
+        lookup.setdefault(name, i)
+        normalized_lookup.setdefault(normalize_name(name), i)
+    
+    _taxonomy_names = names
+    _taxonomy_definitions = taxonomy_df['Definition'].fillna('').tolist()
+    _taxonomy_level_labels = level_labels
+    _taxonomy_level_codes = level_codes
+    _taxonomy_lookup = lookup
+    _taxonomy_normalized_lookup = normalized_lookup
+    
+    logger.info(f"Loaded {len(names)} taxonomy entries from {taxonomy_path}")
+
+
+def _extract_product_attributes(products_df: pd.DataFrame) -> Tuple[List[str], np.ndarray]:
+    """
+    Count the comma-separated PRODUCT_ATTRIBUTES across all products
+    
+    Returns:
+        (sorted unique attributes, number of occurrences of each)
+    """
+    if products_df.empty or 'PRODUCT_ATTRIBUTES' not in products_df.columns:
+        return [], np.zeros(0, dtype=np.int64)
+    
+    counts: Counter = Counter()
+    for attrs in products_df['PRODUCT_ATTRIBUTES'].dropna():
+        for attr in str(attrs).split(','):
+            attr = attr.strip()
+            if attr:
+                counts[attr] += 1
+    
+    attributes = sorted(counts)
+    return attributes, np.array([counts[attr] for attr in attributes], dtype=np.int64)
+
+
+def _set_product_attributes(attributes: List[str], counts: Optional[Sequence[int]] = None):
+    """
+    Store the sorted attribute list with its set, counts and lookups
+    
+    Args:
+        attributes: Sorted unique attributes
+        counts: Occurrences of each attribute across products (optional)
+    """
+    global _product_attributes, _product_attribute_set, _attribute_normalized_lookup
+    global _product_attribute_counts, _attributes_by_popularity
+    
+    counts = np.zeros(len(attributes), dtype=np.int64) if counts is None else np.asarray(counts)
+    
+    normalized_lookup: Dict[str, str] = {}
+    for attr in attributes:
+        normalized_lookup.setdefault(normalize_name(attr), attr)
+    
+    # Most used first; ties stay alphabetical
+    popularity_order = np.argsort(-counts, kind="stable")
+    
+    _product_attributes = attributes
+    _product_attribute_set = frozenset(attributes)
+    _attribute_normalized_lookup = normalized_lookup
+    _product_attribute_counts = dict(zip(attributes, counts.tolist()))
+    _attributes_by_popularity = [attributes[i] for i in popularity_order]
+
+
+def _load_products(data_dir: str, use_snapshot: bool):
+    """Load products, their name index and the attributes with counts"""
+    global _products_df, _product_name_index
+    
+    if use_snapshot:
+        snapshot_dir = get_snapshot_dir(data_dir)
+        snapshot = load_snapshot(snapshot_dir, data_dir, tables=("products",))
+        if snapshot is not None:
+            _product_name_index = snapshot["product_name_index"]
+            _set_product_attributes(snapshot["product_attributes"], snapshot["product_attribute_counts"])
+            _products_df = snapshot["products"]
+            logger.info(
+                f"Loaded {len(_products_df)} products and {len(_product_attributes)} attributes "
+                f"from snapshot {snapshot_dir}"
+            )
+            return
+    
+    products_path = os.path.join(data_dir, 'products.csv')
+    if os.path.exists(products_path):
+        products_df = pd.read_csv(products_path)
+        logger.info(f"Loaded {len(products_df)} products from {products_path}")
+    else:
+        logger.warning(f"Products file not found: {products_path}")
+        products_df = pd.DataFrame()
+    
+    # Index product names for search
+    if 'PRODUCT_NAME' in products_df.columns:
+        _product_name_index = ProductNameIndex(products_df['PRODUCT_NAME'].tolist())
+        logger.info(f"Indexed {len(_product_name_index)} product names")
+    
+    # Extract unique product attributes with their frequencies
+    attributes, counts = _extract_product_attributes(products_df)
+    _set_product_attributes(attributes, counts)
+    if attributes:
+        logger.info(f"Extracted {len(attributes)} unique product attributes")
+    else:
+        logger.warning("No product attributes found")
+    
+    _products_df = products_df
+
+
+def _load_intents(data_dir: str, use_snapshot: bool):
+    """Load intents.csv (not used by the pipeline nodes)"""
+    global _intents_df
+    
+    if use_snapshot:
+        snapshot = load_snapshot(get_snapshot_dir(data_dir), data_dir, tables=("intents",))
+        if snapshot is not None:
+            _intents_df = snapshot["intents"]
+            logger.info(f"Loaded {len(_intents_df)} intents from snapshot")
+            return
+    
+    intents_path = os.path.join(data_dir, 'intents.csv')
+    if os.path.exists(intents_path):
+        _intents_df = pd.read_csv(intents_path)
+        logger.info(f"Loaded {len(_intents_df)} intents from {intents_path}")
+    else:
+        logger.warning(f"Intents file not found: {intents_path}")
+        _intents_df = pd.DataFrame()
+
+
+def _clear_products():
+    """Reset products to empty after a failed load"""
+    global _products_df, _product_name_index
+    _products_df = pd.DataFrame()
+    _product_name_index = None
+    _set_product_attributes([])
+
+
+def _clear_intents():
+    """Reset intents to empty after a failed load"""
+    global _intents_df
+    _intents_df = pd.DataFrame()
+
+
+def _clear_taxonomy():
+    """Reset taxonomy to empty after a failed load"""
+    global _taxonomy_names
+    _taxonomy_names = []
+
+
+# Each dataset loads independently on first access: (loader, reset on error)
+_DATASETS = {
+    "products": (_load_products, _clear_products),
+    "intents": (_load_intents, _clear_intents),
+    "taxonomy": (lambda data_dir, use_snapshot: _load_taxonomy(data_dir), _clear_taxonomy)
+}
+_dataset_locks = {name: threading.Lock() for name in _DATASETS}
+_loaded_datasets: Set[str] = set()
+
+
+def _ensure_loaded(dataset: str, use_snapshot: bool = True):
+    """
+    Load a dataset once, thread-safe
+    
+    Other threads asking for the same dataset wait for the first load; a
+    failed load leaves the dataset empty rather than retrying per call.
+    """
+    if dataset in _loaded_datasets:
+        return
+    
+    with _dataset_locks[dataset]:
+        if dataset in _loaded_datasets:
+            return
         
-        logger.info("Reference data initialization complete")
+        loader, clear = _DATASETS[dataset]
+        start = time.perf_counter()
+        try:
+            loader(os.environ.get('DATA_DIR', '/app/data'), use_snapshot)
+        except Exception as e:
+            logger.error(f"Error loading {dataset} reference data: {e}", exc_info=True)
+            clear()
         
-    except Exception as e:
-        logger.error(f"Error loading reference data: {e}", exc_info=True)
-        # Initialize with empty dataframes on error
-        _products_df = pd.DataFrame()
-        _intents_df = pd.DataFrame()
-        _product_attributes = []
+        _loaded_datasets.add(dataset)
+        logger.info(f"Reference dataset '{dataset}' ready in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+def initialize_reference_data(
+    datasets: Optional[Sequence[str]] = None,
+    use_snapshot: bool = True
+):
+    """
+    Load reference data ahead of the first request
+    
+    Datasets otherwise load lazily on first access, so this is only needed
+    to move the cost to startup.
+    
+    Args:
+        datasets: Datasets to load: "products", "intents", "taxonomy" (default: all)
+        use_snapshot: Map the prebuilt binary snapshot when it is current
+            (see config.snapshot) instead of parsing the CSVs
+    """
+    for dataset in datasets or _DATASETS:
+        _ensure_loaded(dataset, use_snapshot)
+    
+    logger.info("Reference data initialization complete")
 
 
 def get_products_dataframe() -> pd.DataFrame:
     """Get the products DataFrame"""
-    if _products_df is None:
-        initialize_reference_data()
+    _ensure_loaded("products")
     return _products_df
 
 
 def get_intents_dataframe() -> pd.DataFrame:
     """Get the intents DataFrame"""
-    if _intents_df is None:
-        initialize_reference_data()
+    _ensure_loaded("intents")
     return _intents_df
 
 
@@ -93,11 +304,191 @@ def get_product_attributes_list() -> List[str]:
     Returns:
         List of attribute strings
     """
-    if _product_attributes is None:
-        initialize_reference_data()
+    _ensure_loaded("products")
     return _product_attributes or []
 
 
+def get_product_attributes_set() -> FrozenSet[str]:
+    """
+    Get the product attributes as a set for O(1) membership checks
+    
+    Returns:
+        Frozen set of attribute strings
+    """
+    _ensure_loaded("products")
+    return _product_attribute_set
+
+
+def get_product_attribute_counts() -> Dict[str, int]:
+    """
+    Get how many times each attribute occurs across products
+    
+    Returns:
+        Dict of attribute -> occurrence count
+    """
+    _ensure_loaded("products")
+    return _product_attribute_counts
+
+
+def get_popular_product_attributes(limit: Optional[int] = None) -> List[str]:
+    """
+    Get product attributes ordered by popularity, most used first
+    
+    Args:
+        limit: Maximum attributes to return (all by default)
+        
+    Returns:
+        List of attribute strings
+    """
+    _ensure_loaded("products")
+    return _attributes_by_popularity[:limit]
+
+
+def find_product_attribute(name: str) -> Optional[str]:
+    """
+    Resolve a product attribute to its canonical form
+    
+    Tries an exact lookup, then a lookup ignoring case, whitespace and
+    surrounding punctuation. Both are O(1).
+    
+    Returns:
+        Canonical attribute name, or None if not found
+    """
+    if not name:
+        return None
+    
+    if name in get_product_attributes_set():
+        return name
+    return _attribute_normalized_lookup.get(normalize_name(name))
+
+
+def get_taxonomy_list() -> List[str]:
+    """
+    Get all taxonomy names in file order
+    
+    Returns:
+        List of "Category > Subcategory > Granular Category" strings
+    """
+    _ensure_loaded("taxonomy")
+    return _taxonomy_names or []
+
+
+def get_taxonomy_with_definitions() -> List[Dict[str, str]]:
+    """
+    Get taxonomy names with their definitions
+    
+    Returns:
+        List of {"name": ..., "definition": ...} dicts in file order
+    """
+    names = get_taxonomy_list()
+    return [
+        {"name": name, "definition": definition}
+        for name, definition in zip(names, _taxonomy_definitions)
+    ]
+
+
+def find_taxonomy(name: str) -> Optional[str]:
+    """
+    Resolve a taxonomy name to its canonical form
+    
+    Tries an exact lookup, then a lookup ignoring case, whitespace and
+    separator spacing. Both are O(1).
+    
+    Returns:
+        Canonical taxonomy name, or None if not found
+    """
+    names = get_taxonomy_list()
+    if not name or not names:
+        return None
+    
+    index = _taxonomy_lookup.get(name)
+    if index is None:
+        index = _taxonomy_normalized_lookup.get(normalize_name(name))
+    return names[index] if index is not None else None
+
+
+def get_taxonomy_hierarchy(name: str) -> Optional[Dict[str, str]]:
+    """
+    Get the hierarchy levels and definition of a taxonomy entry
+    
+    Returns:
+        Dict with Category, Subcategory, Granular Category and Definition,
+        or None if the name is unknown
+    """
+    canonical = find_taxonomy(name)
+    if canonical is None:
+        return None
+    
+    index = _taxonomy_lookup[canonical]
+    entry = {}
+    for level in TAXONOMY_LEVELS:
+        code = _taxonomy_level_codes[level][index]
+        entry[level] = _taxonomy_level_labels[level][code] if code >= 0 else ""
+    entry["Definition"] = _taxonomy_definitions[index]
+    return entry
+
+
+def get_taxonomy_index() -> Optional[BM25Index]:
+    """
+    Get the BM25 retrieval index over taxonomy names and definitions
+    
+    Built on first use. Returns None if no taxonomy data is loaded.
+    """
+    global _taxonomy_index
+    if _taxonomy_index is None:
+        entries = get_taxonomy_with_definitions()
+        if entries:
+            _taxonomy_index = BM25Index(
+                [entry["name"] for entry in entries],
+                [entry["definition"] for entry in entries]
+            )
+            logger.info(f"Built taxonomy retrieval index over {len(_taxonomy_index)} entries")
+    return _taxonomy_index
+
+
+def get_attribute_index() -> Optional[BM25Index]:
+    """
+    Get the BM25 retrieval index over product attributes
+    
+    Built on first use. Returns None if no attributes are loaded.
+    """
+    global _attribute_index
+    if _attribute_index is None:
+        attributes = get_product_attributes_list()
+        if attributes:
+            _attribute_index = BM25Index(attributes, name_weight=1)
+            logger.info(f"Built attribute retrieval index over {len(_attribute_index)} attributes")
+    return _attribute_index
+
+
+def get_taxonomy_resolver() -> Optional[NameResolver]:
+    """
+    Get the fuzzy name resolver for taxonomy names
+    
+    Built on first use. Returns None if no taxonomy data is loaded.
+    """
+    global _taxonomy_resolver
+    if _taxonomy_resolver is None:
+        names = get_taxonomy_list()
+        if names:
+            _taxonomy_resolver = NameResolver(names)
+    return _taxonomy_resolver
+
+
+def get_attribute_resolver() -> Optional[NameResolver]:
+    """
+    Get the fuzzy name resolver for product attributes
+    
+    Built on first use. Returns None if no attributes are loaded.
+    """
+    global _attribute_resolver
+    if _attribute_resolver is None:
+        attributes = get_product_attributes_list()
+        if attributes:
+            _attribute_resolver = NameResolver(attributes)
+    return _attribute_resolver
+
+
 def get_product_context(product_name: str, top_n: int = 5) -> str:
     """
     Get context about a product from reference data
@@ -109,14 +500,13 @@ def get_product_context(product_name: str, top_n: int = 5) -> str:
     Returns:
         Formatted string with product context
     """
-    if _products_df is None or _products_df.empty:
+    products_df = get_products_dataframe()
+    if products_df.empty:
         return ""
     
     try:
-        # Search for exact or partial matches
-        matches = _products_df[
-            _products_df['PRODUCT_NAME'].str.contains(product_name, case=False, na=False)
-        ].head(top_n)
+        # Search for exact, prefix or partial matches
+        matches = search_products_by_name(product_name, limit=top_n)
         
         if matches.empty:
             return ""
@@ -138,6 +528,9 @@ def search_products_by_name(product_name: str, limit: int = 10) -> pd.DataFrame:
     """
     Search products by name
     
+    Uses the product name index: exact matches first, then names starting
+    with the query, then names sharing the most words with it.
+    
     Args:
         product_name: Product name to search
         limit: Maximum results to return
@@ -145,25 +538,34 @@ def search_products_by_name(product_name: str, limit: int = 10) -> pd.DataFrame:
     Returns:
         DataFrame with matching products
     """
-    if _products_df is None or _products_df.empty:
+    products_df = get_products_dataframe()
+    if products_df.empty or _product_name_index is None:
         return pd.DataFrame()
     
     try:
-        matches = _products_df[
-            _products_df['PRODUCT_NAME'].str.contains(product_name, case=False, na=False)
-        ].head(limit)
-        return matches
+        rows = _product_name_index.search(product_name, limit)
+        return products_df.iloc[rows]
     except Exception as e:
         logger.error(f"Error searching products: {e}")
         return pd.DataFrame()
 
 
+def get_product_name_index() -> Optional[ProductNameIndex]:
+    """Get the product name search index (None if no products are loaded)"""
+    _ensure_loaded("products")
+    return _product_name_index
+
+
 def get_reference_stats() -> dict:
     """Get statistics about loaded reference data"""
     return {
         "products_count": len(_products_df) if _products_df is not None else 0,
         "intents_count": len(_intents_df) if _intents_df is not None else 0,
         "attributes_count": len(_product_attributes) if _product_attributes is not None else 0,
-        "products_loaded": _products_df is not None,
-        "intents_loaded": _intents_df is not None
+        "taxonomy_count": len(_taxonomy_names) if _taxonomy_names is not None else 0,
+        "taxonomy_categories": len(_taxonomy_level_labels.get("Category", [])),
+        "taxonomy_subcategories": len(_taxonomy_level_labels.get("Subcategory", [])),
+        "products_loaded": "products" in _loaded_datasets,
+        "intents_loaded": "intents" in _loaded_datasets,
+        "taxonomy_loaded": "taxonomy" in _loaded_datasets
     }
\ No newline at end of file
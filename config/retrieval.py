@@ -0,0 +1,405 @@
+"""
+In-process retrieval over reference data
+BM25 keyword index used to shortlist candidates before they are sent to the LLM,
+plus name indexes for resolving and searching reference names
+"""
+import bisect
+import logging
+import math
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Words that carry no signal for matching products to categories
+_STOPWORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "for", "from",
+    "in", "into", "is", "it", "its", "of", "on", "or", "such", "that", "the",
+    "their", "these", "this", "to", "used", "uses", "using", "which", "with",
+    "within", "n", "na"
+})
+
+
+def normalize_name(text: str) -> str:
+    """
+    Normalize a reference name for lookup
+    
+    Case-folds, collapses whitespace, normalizes spacing around ">" and
+    strips surrounding quotes and punctuation the LLM tends to add.
+    """
+    text = re.sub(r"\s*>\s*", " > ", str(text).casefold())
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" \t\n\"'`.,;:")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase alphanumeric tokens without stopwords
+    
+    Trailing plural "s" is stripped so "Applications" matches "Application".
+    """
+    tokens = []
+    for token in _TOKEN_RE.findall(str(text).lower()):
+        if token in _STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def initialisms(text: str) -> List[str]:
+    """
+    Derive 3-4 letter initialisms from runs of capitalized words
+    
+    Lets queries like "CRM Software" match "Customer Relationship Management
+    Applications". Lowercase connectives ("and", "of") are skipped.
+    """
+    result = []
+    for segment in re.split(r"[>/,()]", str(text)):
+        initials = [
+            word[0].lower()
+            for word in segment.split()
+            if word[:1].isupper() and word.lower() not in _STOPWORDS
+        ]
+        for size in (3, 4):
+            for start in range(len(initials) - size + 1):
+                result.append("".join(initials[start:start + size]))
+    return result
+
+
+class BM25Index:
+    """
+    BM25 index over a fixed list of documents
+    
+    Each term maps to NumPy arrays of document ids and precomputed BM25
+    weights, so a query costs one vectorized add per query term.
+    """
+    
+    def __init__(
+        self,
+        names: Sequence[str],
+        texts: Optional[Sequence[str]] = None,
+        name_weight: int = 2,
+        k1: float = 1.2,
+        b: float = 0.75
+    ):
+        """
+        Args:
+            names: Document names returned by search (e.g. taxonomy names)
+            texts: Optional extra text per document (e.g. definitions)
+            name_weight: How many times name tokens are counted relative to text tokens
+            k1: BM25 term frequency saturation
+            b: BM25 length normalization
+        """
+        self.names = list(names)
+        n_docs = len(self.names)
+        
+        doc_terms: List[Dict[str, int]] = []
+        doc_lengths = np.zeros(n_docs, dtype=np.float32)
+        for i, name in enumerate(self.names):
+            tokens = (tokenize(name) + initialisms(name)) * name_weight
+            if texts is not None and texts[i]:
+                tokens += tokenize(texts[i])
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            doc_terms.append(counts)
+            doc_lengths[i] = len(tokens)
+        
+        avg_length = float(doc_lengths.mean()) if n_docs else 0.0
+        
+        postings: Dict[str, List[tuple]] = {}
+        for doc_id, counts in enumerate(doc_terms):
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+        
+        self._postings: Dict[str, tuple] = {}
+        for term, entries in postings.items():
+            doc_ids = np.fromiter((d for d, _ in entries), dtype=np.int32, count=len(entries))
+            tfs = np.fromiter((tf for _, tf in entries), dtype=np.float32, count=len(entries))
+            idf = math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            norm = k1 * (1 - b + b * doc_lengths[doc_ids] / (avg_length or 1.0))
+            weights = idf * tfs * (k1 + 1) / (tfs + norm)
+            self._postings[term] = (doc_ids, weights.astype(np.float32))
+        
+        logger.debug(f"Built BM25 index over {n_docs} documents with {len(self._postings)} terms")
+    
+    def __len__(self) -> int:
+        return len(self.names)
+    
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for the query"""
+        scores = np.zeros(len(self.names), dtype=np.float32)
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if posting is not None:
+                doc_ids, weights = posting
+                scores[doc_ids] += weights
+        return scores
+    
+    def search(self, query: str, top_k: int = 10) -> List[int]:
+        """
+        Get ids of the top_k best matching documents, best first
+        
+        Only documents sharing at least one term with the query are returned.
+        """
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        return matched[np.argsort(-scores[matched], kind="stable")].tolist()
+    
+    def shortlist(
+        self,
+        query: str,
+        top_k: int,
+        min_hits: int = 5,
+        fallback: Optional[Sequence[str]] = None
+    ) -> List[str]:
+        """
+        Get the names of the top_k documents for the query
+        
+        When top_k is 0 or the query matches fewer than min_hits documents,
+        returns fallback (every name by default), so a weak query never hides
+        the right answer.
+        """
+        if fallback is None:
+            fallback = self.names
+        
+        if top_k <= 0:
+            return list(fallback)
+        if top_k >= len(self.names):
+            return list(self.names)
+        
+        hits = self.search(query, top_k)
+        if len(hits) < min(min_hits, top_k):
+            return list(fallback)
+        
+        return [self.names[i] for i in hits]
+
+
+def trigrams(text: str) -> List[str]:
+    """Character trigrams of a normalized name, padded at the edges"""
+    padded = f"  {text} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class NameResolver:
+    """
+    Resolve near-miss names to the best-scoring canonical name
+    
+    Names are indexed by character trigram. A lookup only touches the
+    postings of the query's trigrams and scores just the names found there
+    by Dice similarity (2 * shared / (query + candidate trigrams)), so its
+    cost follows the postings it reads rather than the number of names.
+    """
+    
+    def __init__(self, names: Sequence[str], min_score: float = 0.6):
+        """
+        Args:
+            names: Canonical names
+            min_score: Minimum Dice similarity to accept a fuzzy match
+        """
+        self.names = list(names)
+        self.min_score = min_score
+        
+        self._exact: Dict[str, int] = {}
+        postings: Dict[str, List[int]] = {}
+        gram_counts = np.zeros(len(self.names), dtype=np.float32)
+        
+        for i, name in enumerate(self.names):
+            normalized = normalize_name(name)
+            self._exact.setdefault(normalized, i)
+            grams = set(trigrams(normalized))
+            gram_counts[i] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        
+        self._gram_counts = gram_counts
+        self._postings = {
+            gram: np.array(ids, dtype=np.int32)
+            for gram, ids in postings.items()
+        }
+    
+    def resolve(self, text: str) -> Tuple[Optional[str], float]:
+        """
+        Find the canonical name closest to text
+        
+        Returns:
+            (name, confidence) where confidence is 1.0 for a normalized exact
+            match and the Dice similarity otherwise. name is None when the
+            best candidate scores below min_score.
+        """
+        if not text or not self.names:
+            return None, 0.0
+        
+        normalized = normalize_name(text)
+        index = self._exact.get(normalized)
+        if index is not None:
+            return self.names[index], 1.0
+        
+        grams = set(trigrams(normalized))
+        postings = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not postings:
+            return None, 0.0
+        
+        # Candidate ids come back sorted, so ties still go to the first name
+        candidates, shared = np.unique(np.concatenate(postings), return_counts=True)
+        scores = 2 * shared / (len(grams) + self._gram_counts[candidates])
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        
+        if score < self.min_score:
+            return None, score
+        return self.names[int(candidates[best])], score
+
+
+class ProductNameIndex:
+    """
+    Inverted index over product names for exact, prefix and token search
+    
+    Names are normalized once. Exact lookups hit a dict, prefix lookups
+    bisect a sorted copy of the names, and token lookups add up NumPy
+    postings, so no search scans the names or compiles a regex.
+    """
+    
+    def __init__(self, names: Sequence[str]):
+        """
+        Args:
+            names: Product names in row order (missing names may be None/NaN)
+        """
+        normalized = [
+            normalize_name(name) if isinstance(name, str) else ""
+            for name in names
+        ]
+        
+        postings: Dict[str, List[int]] = {}
+        for row, name in enumerate(normalized):
+            for token in set(_TOKEN_RE.findall(name)):
+                postings.setdefault(token, []).append(row)
+        
+        order = sorted(
+            (row for row, name in enumerate(normalized) if name),
+            key=lambda row: normalized[row]
+        )
+        self._set_state(normalized, order, {
+            token: np.array(rows, dtype=np.int32)
+            for token, rows in postings.items()
+        })
+        
+        logger.debug(f"Built product name index over {self._size} names with {len(self._postings)} tokens")
+    
+    @classmethod
+    def from_state(
+        cls,
+        normalized: List[str],
+        sorted_rows: Sequence[int],
+        postings: Dict[str, np.ndarray]
+    ) -> "ProductNameIndex":
+        """Rebuild an index from the output of export_state (see config.snapshot)"""
+        index = cls.__new__(cls)
+        index._set_state(normalized, sorted_rows, postings)
+        return index
+    
+    def export_state(self) -> Tuple[List[str], List[int], Dict[str, np.ndarray]]:
+        """Get (normalized names, rows in name order, token postings)"""
+        return self._normalized, self._sorted_rows, self._postings
+    
+    def _set_state(
+        self,
+        normalized: List[str],
+        sorted_rows: Sequence[int],
+        postings: Dict[str, np.ndarray]
+    ):
+        exact: Dict[str, List[int]] = {}
+        for row, name in enumerate(normalized):
+            if name:
+                exact.setdefault(name, []).append(row)
+        
+        # Names in name order, bucketed by length, so prefix search can walk
+        # the shortest names first and stop after limit matches
+        by_length: Dict[int, Tuple[List[str], List[int]]] = {}
+        for row in sorted_rows:
+            names, rows = by_length.setdefault(len(normalized[row]), ([], []))
+            names.append(normalized[row])
+            rows.append(row)
+        
+        self._size = len(normalized)
+        self._normalized = normalized
+        self._exact = exact
+        self._sorted_rows = list(sorted_rows)
+        self._by_length = by_length
+        self._lengths = sorted(by_length)
+        self._postings = postings
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def exact(self, query: str) -> List[int]:
+        """Rows whose normalized name equals the query"""
+        return list(self._exact.get(normalize_name(query), []))
+    
+    def prefix(self, query: str, limit: int = 10) -> List[int]:
+        """Rows whose normalized name starts with the query, shortest first (ties in name order)"""
+        normalized = normalize_name(query)
+        if not normalized or limit <= 0:
+            return []
+        
+        # In each length bucket the names with the prefix form one contiguous
+        # range; one bisect per length, stopping once limit rows are found
+        rows: List[int] = []
+        for length in self._lengths[bisect.bisect_left(self._lengths, len(normalized)):]:
+            names, bucket_rows = self._by_length[length]
+            start = bisect.bisect_left(names, normalized)
+            end = bisect.bisect_left(names, normalized + "\U0010ffff", start)
+            rows.extend(bucket_rows[start:min(end, start + limit - len(rows))])
+            if len(rows) >= limit:
+                break
+        return rows
+    
+    def token_overlap(self, query: str, limit: int = 10) -> List[int]:
+        """
+        Rows sharing the most tokens with the query, ties in row order
+        
+        Shared tokens are weighted by rarity, so a word every product name
+        contains does not outrank a distinctive one. Words in more than a
+        quarter of all names are skipped when the query has rarer ones.
+        """
+        postings = [
+            self._postings[token]
+            for token in set(_TOKEN_RE.findall(normalize_name(query)))
+            if token in self._postings
+        ]
+        if not postings or limit <= 0:
+            return []
+        
+        postings = [rows for rows in postings if len(rows) <= self._size // 4] or postings
+        scores = np.zeros(self._size, dtype=np.float32)
+        for rows in postings:
+            scores[rows] += math.log(1 + self._size / len(rows))
+        
+        # matched is in row order, so a stable sort keeps tied rows in row order
+        matched = np.unique(np.concatenate(postings))
+        return matched[np.argsort(-scores[matched], kind="stable")[:limit]].tolist()
+    
+    def search(self, query: str, limit: int = 10) -> List[int]:
+        """
+        Get up to limit rows for the query, best first
+        
+        Exact matches come first, then prefix matches, then rows ranked by
+        the number of tokens shared with the query.
+        """
+        if limit <= 0:
+            return []
+        
+        rows = self.exact(query)[:limit]
+        if len(rows) < limit:
+            rows += [row for row in self.prefix(query, limit) if row not in rows]
+        if len(rows) < limit:
+            rows += [row for row in self.token_overlap(query, limit + len(rows)) if row not in rows]
+        return rows[:limit]
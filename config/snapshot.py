@@ -0,0 +1,279 @@
+"""
+Binary snapshot of the reference data for fast cold starts
+
+Parsing products.csv and intents.csv and rebuilding the attribute list and
+name index costs most of container startup. The snapshot stores the parsed
+tables and derived indexes as .npy arrays that are memory-mapped at startup.
+
+Build it once, e.g. in the container image:
+    python -m config.snapshot [--data-dir /app/data] [--output /app/data/snapshot]
+"""
+import os
+import sys
+import json
+import shutil
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .retrieval import ProductNameIndex
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 2
+SOURCE_FILES = ("products.csv", "intents.csv")
+TABLES = ("products", "intents")
+
+
+def get_snapshot_dir(data_dir: str) -> str:
+    """Snapshot location, REFERENCE_SNAPSHOT_DIR or <data_dir>/snapshot"""
+    return os.environ.get("REFERENCE_SNAPSHOT_DIR", os.path.join(data_dir, "snapshot"))
+
+
+def _source_fingerprint(data_dir: str) -> Dict[str, Optional[List[int]]]:
+    """Size and mtime of each source CSV (None when the file is absent)"""
+    fingerprint = {}
+    for name in SOURCE_FILES:
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint[name] = [stat.st_size, stat.st_mtime_ns]
+        else:
+            fingerprint[name] = None
+    return fingerprint
+
+
+def _pack_strings(values: Sequence[Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pack strings into one NUL-separated UTF-8 buffer
+    
+    Returns:
+        (buffer, valid mask); missing values are stored as ""
+    """
+    valid = np.array([isinstance(v, str) or pd.notna(v) for v in values], dtype=bool)
+    strings = [str(v) if ok else "" for v, ok in zip(values, valid)]
+    if any("\0" in value for value in strings):
+        raise ValueError("Cannot snapshot strings containing NUL characters")
+    
+    buffer = np.frombuffer("\0".join(strings).encode("utf-8"), dtype=np.uint8)
+    return buffer, valid
+
+
+def _unpack_strings(buffer: np.ndarray, valid: np.ndarray) -> List[Any]:
+    """Inverse of _pack_strings; invalid entries come back as NaN"""
+    if len(valid) == 0:
+        return []
+    values = buffer.tobytes().decode("utf-8").split("\0")
+    if not valid.all():
+        values = [v if ok else np.nan for v, ok in zip(values, valid.tolist())]
+    return values
+
+
+class _SnapshotWriter:
+    """Collects named arrays and writes them as .npy files plus a manifest"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.arrays: Dict[str, np.ndarray] = {}
+    
+    def add(self, name: str, array: np.ndarray) -> str:
+        self.arrays[name] = array
+        return name
+    
+    def add_strings(self, name: str, values: Sequence[Any]) -> Dict[str, str]:
+        buffer, valid = _pack_strings(values)
+        return {
+            "buffer": self.add(f"{name}.buffer", buffer),
+            "valid": self.add(f"{name}.valid", valid)
+        }
+    
+    def write(self, manifest: Dict[str, Any]):
+        staging = self.path + ".tmp"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        
+        for name, array in self.arrays.items():
+            np.save(os.path.join(staging, f"{name}.npy"), array, allow_pickle=False)
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(staging, self.path)
+
+
+def write_snapshot(
+    path: str,
+    data_dir: str,
+    tables: Dict[str, pd.DataFrame],
+    product_attributes: List[str],
+    product_attribute_counts: Sequence[int],
+    product_name_index: Optional[ProductNameIndex]
+):
+    """
+    Write parsed reference data to a snapshot directory
+    
+    Args:
+        path: Snapshot directory (replaced atomically)
+        data_dir: Directory of the source CSVs, fingerprinted for staleness
+        tables: DataFrames by table name ("products", "intents")
+        product_attributes: Sorted unique product attributes
+        product_attribute_counts: Occurrences of each attribute
+        product_name_index: Product name index, if products were loaded
+    """
+    writer = _SnapshotWriter(path)
+    manifest: Dict[str, Any] = {
+        "version": SNAPSHOT_VERSION,
+        "sources": _source_fingerprint(data_dir),
+        "tables": {},
+        "product_attributes": writer.add_strings("product_attributes", product_attributes),
+        "product_attribute_counts": writer.add(
+            "product_attribute_counts", np.asarray(product_attribute_counts, dtype=np.int64)
+        )
+    }
+    
+    for table, df in tables.items():
+        columns = []
+        for i, column in enumerate(df.columns):
+            values = df[column]
+            key = f"{table}.{i}"
+            if values.dtype.kind in "biuf":
+                columns.append({"name": column, "kind": "array", "array": writer.add(key, values.to_numpy())})
+            else:
+                columns.append({"name": column, "kind": "strings", **writer.add_strings(key, values.tolist())})
+        manifest["tables"][table] = {"rows": len(df), "columns": columns}
+    
+    if product_name_index is not None:
+        normalized, sorted_rows, postings = product_name_index.export_state()
+        tokens = sorted(postings)
+        offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum([len(postings[token]) for token in tokens], out=offsets[1:])
+        rows = np.concatenate([postings[token] for token in tokens]) if tokens else np.zeros(0, dtype=np.int32)
+        
+        manifest["product_name_index"] = {
+            "normalized": writer.add_strings("name_index.normalized", normalized),
+            "sorted_rows": writer.add("name_index.sorted_rows", np.asarray(sorted_rows, dtype=np.int32)),
+            "tokens": writer.add_strings("name_index.tokens", tokens),
+            "posting_offsets": writer.add("name_index.posting_offsets", offsets),
+            "posting_rows": writer.add("name_index.posting_rows", rows.astype(np.int32))
+        }
+    
+    writer.write(manifest)
+    logger.info(f"Wrote reference snapshot with {len(writer.arrays)} arrays to {path}")
+
+
+def load_snapshot(
+    path: str,
+    data_dir: str,
+    tables: Sequence[str] = TABLES
+) -> Optional[Dict[str, Any]]:
+    """
+    Memory-map a snapshot written by write_snapshot
+    
+    Args:
+        path: Snapshot directory
+        data_dir: Directory of the source CSVs
+        tables: Tables to load; "products" also loads the attributes,
+            their counts and the product name index
+    
+    Returns:
+        Dict keyed by table name, plus "product_attributes",
+        "product_attribute_counts" and "product_name_index" for products.
+        None if the snapshot is missing, from another version, or older
+        than the source CSVs
+    """
+    manifest_path = os.path.join(path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        
+        if manifest.get("version") != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring reference snapshot {path}: version {manifest.get('version')}")
+            return None
+        
+        # Only check sources that ship alongside the snapshot
+        current = _source_fingerprint(data_dir)
+        for name, fingerprint in current.items():
+            if fingerprint is not None and manifest["sources"].get(name) != fingerprint:
+                logger.warning(f"Ignoring stale reference snapshot {path}: {name} changed")
+                return None
+        
+        # Plain ndarray views over the mapping; slicing np.memmap is slow
+        def array(name: str) -> np.ndarray:
+            mapped = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+            return mapped.view(np.ndarray)
+        
+        def strings(entry: Dict[str, str]) -> List[Any]:
+            return _unpack_strings(array(entry["buffer"]), array(entry["valid"]))
+        
+        result: Dict[str, Any] = {}
+        for table in tables:
+            spec = manifest["tables"].get(table)
+            if spec is None:
+                result[table] = pd.DataFrame()
+                continue
+            result[table] = pd.DataFrame({
+                column["name"]: array(column["array"]) if column["kind"] == "array" else strings(column)
+                for column in spec["columns"]
+            })
+        
+        if "products" not in tables:
+            return result
+        
+        result["product_attributes"] = strings(manifest["product_attributes"])
+        result["product_attribute_counts"] = array(manifest["product_attribute_counts"])
+        
+        index_spec = manifest.get("product_name_index")
+        result["product_name_index"] = None
+        if index_spec is not None:
+            bounds = array(index_spec["posting_offsets"]).tolist()
+            rows = array(index_spec["posting_rows"])
+            postings = {
+                token: rows[bounds[i]:bounds[i + 1]]
+                for i, token in enumerate(strings(index_spec["tokens"]))
+            }
+            result["product_name_index"] = ProductNameIndex.from_state(
+                strings(index_spec["normalized"]),
+                array(index_spec["sorted_rows"]).tolist(),
+                postings
+            )
+        
+        return result
+    
+    except Exception as e:
+        logger.error(f"Error loading reference snapshot {path}: {e}", exc_info=True)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the reference data snapshot")
+    parser.add_argument("--data-dir", default=os.environ.get("DATA_DIR", "/app/data"))
+    parser.add_argument("--output", help="Snapshot directory (default: REFERENCE_SNAPSHOT_DIR or <data-dir>/snapshot)")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    os.environ["DATA_DIR"] = args.data_dir
+    
+    from . import reference
+    reference.initialize_reference_data(use_snapshot=False)
+    counts = reference.get_product_attribute_counts()
+    
+    write_snapshot(
+        args.output or get_snapshot_dir(args.data_dir),
+        args.data_dir,
+        {
+            "products": reference.get_products_dataframe(),
+            "intents": reference.get_intents_dataframe()
+        },
+        reference.get_product_attributes_list(),
+        [counts[attr] for attr in reference.get_product_attributes_list()],
+        reference.get_product_name_index()
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,11 +9,12 @@ sys.path.insert(0, os.path.dirname(__file__))
 import json
 import pandas as pd
 from io import StringIO
-from pipeline.orchestrator import process_dataframe_batch
-from config.reference import initialize_reference_data
+from pipeline.orchestrator import process_dataframe_batch, warmup_pipeline
+from pipeline.metrics import get_pipeline_metrics
+from pipeline.streaming import parse_flag
 
-# Initialize reference data on cold start
-initialize_reference_data()
+# Load the reference data the pipeline uses and compile its graph on cold start
+warmup_pipeline()
 
 def lambda_handler(event, context):
     """
@@ -31,6 +32,9 @@ def lambda_handler(event, context):
         "output_csv": "enriched CSV string",
         "rows_processed": 100
     }
+    
+    Streaming ("stream": true) is rejected: a plain Lambda response must be
+    JSON. Use the AgentCore entrypoint in agent.py to stream chunk events.
     """
     try:
         # Parse input
@@ -61,6 +65,12 @@ def lambda_handler(event, context):
                 'error': f'Missing required columns: {missing}'
             }
         
+        if parse_flag(event.get('stream')):
+            return {
+                'status': 'error',
+                'error': 'Streaming is not supported by this handler; use the AgentCore entrypoint'
+            }
+        
         # Process ALL rows with batching (this is your existing logic!)
         result_df = process_dataframe_batch(df, max_concurrent_rows=max_concurrent)
         
@@ -68,7 +78,8 @@ def lambda_handler(event, context):
         return {
             'status': 'success',
             'output_csv': result_df.to_csv(index=False),
-            'rows_processed': len(result_df)
+            'rows_processed': len(result_df),
+            'usage': get_pipeline_metrics().get_usage()
         }
         
     except Exception as e:
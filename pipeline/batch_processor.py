@@ -4,17 +4,36 @@ This file preserves your battle-tested parallel processing logic
 """
 import asyncio
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, AsyncIterator, Awaitable, Tuple, Optional
 import pandas as pd
 
+from .bedrock_client import close_loop_clients
+
 logger = logging.getLogger(__name__)
 
 
+# Sentinel passed through the worker queues to signal end of input
+_DONE = object()
+
+
+def iter_dataframe_rows(df: pd.DataFrame) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily yield DataFrame rows as dictionaries
+    
+    Unlike df.to_dict('records'), only one row dict exists at a time
+    """
+    columns = list(df.columns)
+    for values in df.itertuples(index=False, name=None):
+        yield dict(zip(columns, values))
+
+
 class BatchProcessor:
     """
     Process multiple rows in parallel with concurrency control
     
-    This implements Layer 2 parallelism: across-row processing
+    This implements Layer 2 parallelism: across-row processing.
+    A fixed pool of max_concurrent workers pulls rows from a bounded queue,
+    so memory stays flat regardless of input size.
     """
     
     def __init__(self, max_concurrent: int = 20, progress_bar: bool = False):
@@ -23,24 +42,91 @@ class BatchProcessor:
             max_concurrent: Maximum number of rows to process simultaneously
             progress_bar: Whether to show progress bar (disabled for Lambda)
         """
-        self.max_concurrent = max_concurrent
-        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_concurrent = max(1, max_concurrent)
         self.progress_bar = progress_bar
     
-    async def process_single_row_with_limit(
+    async def process_single_row(
         self,
         row: Dict[str, Any],
-        row_id: str
+        index: int
     ) -> Dict[str, Any]:
         """
-        Process single row with concurrency limit
+        Process single row, converting failures into an error row
+        """
+        # Import here to avoid circular dependency
+        from .orchestrator import run_pipeline_for_row
+        
+        try:
+            return await run_pipeline_for_row(row, f"row_{index}")
+        except Exception as e:
+            logger.error(f"Row {index} failed: {e}")
+            return {
+                "error": str(e),
+                "vendor_name": row.get("vendor_name", ""),
+                "product_name": row.get("product_name", "")
+            }
+    
+    async def process_rows(
+        self,
+        rows: Iterable[Dict[str, Any]]
+    ) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """
+        Process rows with a bounded worker pool, yielding results as they finish
+        
+        Rows are pulled lazily from the iterator, so at most max_concurrent rows
+        are queued, max_concurrent are in flight and max_concurrent results are
+        waiting to be consumed at any time.
         
-        The semaphore ensures max_concurrent rows are processed at once
+        Args:
+            rows: Iterable of row dictionaries
+            
+        Yields:
+            (row_index, result) tuples in completion order
         """
-        async with self.semaphore:
-            # Import here to avoid circular dependency
-            from .orchestrator import run_pipeline_for_row
-            return await run_pipeline_for_row(row, row_id)
+        input_queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrent)
+        output_queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrent)
+        
+        async def feed():
+            try:
+                for index, row in enumerate(rows):
+                    await input_queue.put((index, row))
+            finally:
+                # Always release the workers, even if the iterator fails
+                for _ in range(self.max_concurrent):
+                    await input_queue.put(_DONE)
+        
+        async def work():
+            while True:
+                item = await input_queue.get()
+                if item is _DONE:
+                    break
+                index, row = item
+                result = await self.process_single_row(row, index)
+                await output_queue.put((index, result))
+            await output_queue.put(_DONE)
+        
+        feeder = asyncio.create_task(feed())
+        workers = [asyncio.create_task(work()) for _ in range(self.max_concurrent)]
+        
+        logger.info(f"Started {len(workers)} workers")
+        
+        completed = 0
+        remaining = len(workers)
+        try:
+            while remaining:
+                item = await output_queue.get()
+                if item is _DONE:
+                    remaining -= 1
+                    continue
+                completed += 1
+                yield item
+            
+            # Surface errors raised by the row iterator
+            await feeder
+            logger.info(f"Worker pool finished: {completed} rows processed")
+        finally:
+            for task in [feeder, *workers]:
+                task.cancel()
     
     async def process_batch(
         self,
@@ -49,35 +135,14 @@ class BatchProcessor:
         """
         Process entire DataFrame in parallel
         
-        Creates tasks for all rows and executes them with concurrency control
+        Results are returned in input order
         """
-        rows = df.to_dict('records')
-        
-        # Create tasks for all rows
-        tasks = [
-            self.process_single_row_with_limit(row, f"row_{i}")
-            for i, row in enumerate(rows)
-        ]
+        results: List[Optional[Dict[str, Any]]] = [None] * len(df)
         
-        logger.info(f"Created {len(tasks)} tasks, executing with max_concurrent={self.max_concurrent}")
+        async for index, result in self.process_rows(iter_dataframe_rows(df)):
+            results[index] = result
         
-        # Execute all tasks
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Handle exceptions
-        processed_results = []
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                logger.error(f"Row {i} failed: {result}")
-                processed_results.append({
-                    "error": str(result),
-                    "vendor_name": rows[i].get("vendor_name", ""),
-                    "product_name": rows[i].get("product_name", "")
-                })
-            else:
-                processed_results.append(result)
-        
-        return processed_results
+        return results
     
     def process_batch_sync(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -85,15 +150,28 @@ class BatchProcessor:
         
         This allows the Lambda handler to call the async pipeline synchronously
         """
-        # Get or create event loop
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
         # Run async processing
-        results = loop.run_until_complete(self.process_batch(df))
+        results = run_coroutine_sync(self.process_batch(df))
         
         # Convert to DataFrame
-        return pd.DataFrame(results)
\ No newline at end of file
+        return pd.DataFrame(results)
+
+
+def run_coroutine_sync(coro: Awaitable[Any]) -> Any:
+    """Run a coroutine to completion from synchronous code"""
+    # Get or create event loop
+    owns_loop = False
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        owns_loop = True
+    
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        # Only a loop created here is known to be idle and not shared with
+        # the caller; a caller's loop keeps its clients until it closes them
+        if owns_loop:
+            loop.run_until_complete(close_loop_clients())
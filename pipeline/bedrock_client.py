@@ -2,41 +2,161 @@
 AWS Bedrock LLM Client with connection pooling and caching
 This file preserves your battle-tested Bedrock client implementation
 """
-import boto3
 import json
+import time
 import logging
 import asyncio
 import os
-from typing import Optional, Dict, Any
+from contextlib import aclosing
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
 import hashlib
 
+from .singleflight import SingleFlight
+from .concurrency import AdaptiveLimiter
+from .transport import create_transport
+from .retry import RetryPolicy, RetryBudget, classify_error, THROTTLED, RETRYABLE
+from .rate_limit import ModelRateLimiter, estimate_tokens, rate_limits_from_env
+from .metrics import get_pipeline_metrics
+from .json_stream import IncrementalJSONParser
+
 logger = logging.getLogger(__name__)
 
 
+class LRUResponseCache:
+    """
+    Least-recently-used cache bounded by entry count and resident bytes
+    
+    Entry sizes are measured once on insert, so resident bytes are tracked
+    in O(1) instead of re-measuring the whole cache.
+    """
+    
+    def __init__(self, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            max_entries: Maximum number of cached responses
+            max_bytes: Maximum total size of cached keys and responses
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @staticmethod
+    def _entry_size(key: str, value: str) -> int:
+        return len(key) + len(value.encode("utf-8"))
+    
+    def get(self, key: str) -> Optional[str]:
+        """Get a value and mark it as most recently used"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+    
+    def set(self, key: str, value: str):
+        """Insert or replace a value, evicting least recently used entries as needed"""
+        size = self._entry_size(key, value)
+        if size > self.max_bytes:
+            logger.debug(f"Response of {size} bytes exceeds cache budget, not caching")
+            return
+        
+        existing = self._entries.pop(key, None)
+        if existing is not None:
+            self.resident_bytes -= existing[1]
+        
+        self._entries[key] = (value, size)
+        self.resident_bytes += size
+        
+        while len(self._entries) > self.max_entries or self.resident_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.resident_bytes -= evicted_size
+            self.evictions += 1
+    
+    def clear(self):
+        """Remove all entries"""
+        self._entries.clear()
+        self.resident_bytes = 0
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
 class BedrockLLMManager:
     """
     Optimized Bedrock client with connection pooling
     
-    This implements Layer 3 parallelism: LLM connection pool (50 concurrent)
+    This implements Layer 3 parallelism: LLM connection pool (up to 50
+    concurrent). Requests go through a transport that owns a keep-alive
+    connection pool sized to the concurrency ceiling: boto3 on a dedicated
+    thread pool ("threads") or httpx with SigV4 on the event loop ("async").
+    The concurrency limit adapts to throttling (AIMD).
+    Throttling, 5xx and timeout errors are retried with jittered exponential
+    backoff within a per-call deadline and a shared retry budget; fatal
+    errors fail at once. Optional per-model RPM/TPM budgets pace calls
+    before they are sent. With streaming enabled, a response is cut off as
+    soon as its JSON answer closes.
     """
     
     def __init__(
         self,
         region_name: str = None,
         max_concurrent: int = 50,
-        cache_enabled: bool = True
+        initial_concurrent: int = 16,
+        max_retries: int = 4,
+        backoff_base_seconds: float = 0.5,
+        backoff_cap_seconds: float = 20.0,
+        deadline_seconds: Optional[float] = 120.0,
+        retry_budget_ratio: Optional[float] = 0.2,
+        latency_target_seconds: Optional[float] = None,
+        rate_limits: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+        connect_timeout_seconds: float = 5.0,
+        read_timeout_seconds: float = 90.0,
+        transport: str = "threads",
+        endpoint_url: Optional[str] = None,
+        streaming: bool = False,
+        cache_enabled: bool = True,
+        cache_max_entries: int = 1000,
+        cache_max_bytes: int = 64 * 1024 * 1024
     ):
         # Get region from environment
         if region_name is None:
             region_name = os.getenv("AWS_DEFAULT_REGION", "us-west-2")
         
-        self.client = boto3.client(
-            service_name="bedrock-runtime",
-            region_name=region_name
+        # One connection (and thread, for "threads") per call the limiter can admit
+        self.transport = create_transport(
+            transport,
+            region_name,
+            pool_connections=max_concurrent,
+            connect_timeout_seconds=connect_timeout_seconds,
+            read_timeout_seconds=read_timeout_seconds,
+            endpoint_url=endpoint_url
+        )
+        self.limiter = AdaptiveLimiter(
+            initial_limit=initial_concurrent,
+            max_limit=max_concurrent,
+            latency_target_seconds=latency_target_seconds
         )
-        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.retry_policy = RetryPolicy(
+            max_retries=max_retries,
+            backoff_base_seconds=backoff_base_seconds,
+            backoff_cap_seconds=backoff_cap_seconds,
+            deadline_seconds=deadline_seconds,
+            budget=RetryBudget(ratio=retry_budget_ratio) if retry_budget_ratio is not None else None
+        )
+        self.streaming = streaming
         self.cache_enabled = cache_enabled
-        self._cache: Dict[str, Any] = {}
+        self._single_flight = SingleFlight()
+        self._cache = LRUResponseCache(
+            max_entries=cache_max_entries,
+            max_bytes=cache_max_bytes
+        )
         
         # Model configs optimized for speed and cost
         self.model_configs = {
@@ -52,7 +172,16 @@ class BedrockLLMManager:
             }
         }
         
-        logger.info(f"Initialized Bedrock client in {region_name} with max_concurrent={max_concurrent}")
+        # Per-model RPM/TPM budgets, e.g. {"sonnet": {"requests_per_minute": 50, "tokens_per_minute": 200000}}
+        self.rate_limiters = {
+            model: ModelRateLimiter(model, **(rate_limits or {}).get(model, {}))
+            for model in self.model_configs
+        }
+        
+        logger.info(
+            f"Initialized Bedrock client in {region_name} with max_concurrent={max_concurrent}, "
+            f"transport={transport}, streaming={streaming}"
+        )
     
     def _get_cache_key(self, prompt: str, system_prompt: Optional[str], model: str) -> str:
         """Generate cache key from inputs"""
@@ -66,23 +195,18 @@ class BedrockLLMManager:
         return self._cache.get(cache_key)
     
     def _set_cache(self, cache_key: str, result: str):
-        """Store result in cache"""
+        """Store result in cache (LRU eviction by entry count and bytes)"""
         if self.cache_enabled:
-            self._cache[cache_key] = result
-            
-            # Simple cache size management
-            if len(self._cache) > 1000:
-                # Remove oldest 100 entries (FIFO approximation)
-                keys_to_remove = list(self._cache.keys())[:100]
-                for key in keys_to_remove:
-                    del self._cache[key]
+            self._cache.set(cache_key, result)
     
     async def call_async(
         self,
         prompt: str,
         system_prompt: Optional[str] = None,
         model: str = "sonnet",
-        use_cache: bool = True
+        use_cache: bool = True,
+        max_tokens: Optional[int] = None,
+        stage: Optional[str] = None
     ) -> Optional[str]:
         """
         Async LLM call with caching and connection pooling
@@ -92,6 +216,8 @@ class BedrockLLMManager:
             system_prompt: System instructions (optional)
             model: Model name ("sonnet" or "haiku")
             use_cache: Whether to use caching
+            max_tokens: Output ceiling for this prompt (default: the model's)
+            stage: Pipeline stage making the call, for usage accounting
             
         Returns:
             LLM response text
@@ -103,69 +229,215 @@ class BedrockLLMManager:
             if cached:
                 logger.debug(f"Cache hit for key: {cache_key[:16]}...")
                 return cached
+            
+            # Identical concurrent calls share one request
+            return await self._single_flight.do(
+                cache_key,
+                lambda: self._invoke(prompt, system_prompt, model, max_tokens, stage, cache_key)
+            )
         
-        # Acquire semaphore for connection pooling
-        async with self.semaphore:
-            try:
-                config = self.model_configs.get(model, self.model_configs["sonnet"])
-                
-                # Build prompt
-                if system_prompt:
-                    combined_prompt = f"""[SYSTEM INSTRUCTIONS]
+        return await self._invoke(prompt, system_prompt, model, max_tokens, stage)
+    
+    async def _invoke(
+        self,
+        prompt: str,
+        system_prompt: Optional[str],
+        model: str,
+        max_tokens: Optional[int] = None,
+        stage: Optional[str] = None,
+        cache_key: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Invoke the model and cache the result when a cache key is given
+        """
+        config = self.model_configs.get(model, self.model_configs["sonnet"])
+        
+        # Build prompt
+        if system_prompt:
+            combined_prompt = f"""[SYSTEM INSTRUCTIONS]
 {system_prompt}
 
 [USER QUERY]
 {prompt}
 """
-                else:
-                    combined_prompt = prompt
-                
-                payload = {
-                    "anthropic_version": "bedrock-2023-05-31",
-                    "max_tokens": config["max_tokens"],
-                    "temperature": config["temperature"],
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [{"type": "text", "text": combined_prompt}],
-                        }
-                    ],
+        else:
+            combined_prompt = prompt
+        
+        payload = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens or config["max_tokens"],
+            "temperature": config["temperature"],
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [{"type": "text", "text": combined_prompt}],
                 }
-                
-                # Run in executor to avoid blocking
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: self.client.invoke_model(
-                        modelId=config["model_id"],
-                        contentType="application/json",
-                        accept="application/json",
-                        body=json.dumps(payload),
-                    )
+            ],
+        }
+        body = json.dumps(payload)
+        metrics = get_pipeline_metrics()
+        rate_limiter = self.rate_limiters.get(model, self.rate_limiters["sonnet"])
+        estimated_input_tokens = estimate_tokens(combined_prompt)
+        
+        policy = self.retry_policy
+        deadline = policy.deadline()
+        if policy.budget is not None:
+            policy.budget.deposit()
+        
+        attempt = 0
+        while True:
+            # Wait for budget before taking a concurrency slot, but not past the deadline
+            try:
+                waited, reserved_tokens = await rate_limiter.acquire(
+                    estimated_input_tokens,
+                    timeout=policy.remaining(deadline)
                 )
+            except asyncio.TimeoutError as e:
+                metrics.record_failure(RETRYABLE)
+                logger.error(f"Bedrock call gave up waiting for rate budget after {attempt} attempt(s): {e}")
+                return None
+            if waited:
+                metrics.record_rate_limit_wait(waited)
+            
+            started = await self.limiter.acquire()
+            error: Optional[Exception] = None
+            error_class: Optional[str] = None
+            try:
+                # A worker thread cannot be cancelled; past the deadline we stop waiting for it
+                send = self._send_streaming if self.streaming else self._send
+                result, usage = await asyncio.wait_for(
+                    send(config["model_id"], body),
+                    timeout=policy.remaining(deadline)
+                )
+            
+            except Exception as e:
+                error = e
+                error_class = classify_error(e)
+            
+            finally:
+                self.limiter.release(
+                    started,
+                    throttled=error_class == THROTTLED,
+                    failed=error_class is not None and error_class != THROTTLED
+                )
+            
+            if error is not None:
+                rate_limiter.refund(reserved_tokens)
+                if error_class == THROTTLED:
+                    metrics.record_throttle(self.limiter.limit)
                 
-                response_body = json.loads(response["body"].read().decode("utf-8"))
-                result = response_body["content"][0]["text"].strip()
-                
-                # Cache result
-                if use_cache:
-                    self._set_cache(cache_key, result)
-                
-                return result
+                delay = policy.next_delay(attempt, error_class, deadline)
+                if delay is None:
+                    metrics.record_failure(error_class)
+                    logger.error(f"Bedrock call failed ({error_class}) after {attempt + 1} attempt(s): {error!r}")
+                    return None
                 
-            except Exception as e:
-                logger.error(f"Bedrock call failed: {str(e)}")
-                return None
+                logger.warning(
+                    f"Bedrock call failed ({error_class}): {error!r}; "
+                    f"retrying in {delay:.2f}s (attempt {attempt + 1})"
+                )
+                metrics.record_retry(error_class)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            
+            rate_limiter.record_usage(
+                reserved_tokens,
+                usage.get("input_tokens", 0),
+                usage.get("output_tokens", 0)
+            )
+            metrics.record_llm_call(
+                model,
+                usage.get("input_tokens", 0),
+                usage.get("output_tokens", 0),
+                stage=stage
+            )
+            metrics.record_concurrency_limit(self.limiter.limit)
+            
+            # Cache result
+            if cache_key is not None:
+                self._set_cache(cache_key, result)
+            
+            return result
+    
+    async def _send(self, model_id: str, body: str) -> Tuple[str, Dict[str, int]]:
+        """
+        Send one InvokeModel request
+        
+        Returns:
+            (response text, usage block)
+        """
+        raw = await self.transport.invoke(model_id, body)
+        response_body = json.loads(raw.decode("utf-8"))
+        return response_body["content"][0]["text"].strip(), response_body.get("usage", {})
+    
+    async def _send_streaming(self, model_id: str, body: str) -> Tuple[str, Dict[str, int]]:
+        """
+        Send one InvokeModelWithResponseStream request, stopping once the JSON closes
+        
+        Output tokens come from the final message_delta event; when the
+        stream is cut off before it, they are estimated from the text read.
+        
+        Returns:
+            (response text, usage block)
+        """
+        parser = IncrementalJSONParser()
+        usage: Dict[str, int] = {}
+        started = time.perf_counter()
+        time_to_first_token = None
+        time_to_json = None
+        finished = False
+        
+        async with aclosing(self.transport.invoke_stream(model_id, body)) as events:
+            async for event in events:
+                event_type = event.get("type")
+                if event_type == "content_block_delta":
+                    if time_to_first_token is None:
+                        time_to_first_token = time.perf_counter() - started
+                    if parser.feed(event.get("delta", {}).get("text", "")):
+                        time_to_json = time.perf_counter() - started
+                        break
+                elif event_type == "message_start":
+                    usage["input_tokens"] = event.get("message", {}).get("usage", {}).get("input_tokens", 0)
+                elif event_type == "message_delta":
+                    usage["output_tokens"] = event.get("usage", {}).get("output_tokens", 0)
+                elif event_type == "message_stop":
+                    finished = True
+        
+        if "output_tokens" not in usage:
+            usage["output_tokens"] = estimate_tokens(parser.text)
+        get_pipeline_metrics().record_stream(time_to_first_token, time_to_json, stopped_early=not finished)
+        
+        text = parser.json_text if parser.complete else parser.text
+        return text.strip(), usage
     
     def clear_cache(self):
         """Clear the LLM response cache"""
         self._cache.clear()
     
-    def get_cache_stats(self) -> Dict[str, int]:
+    def get_cache_stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
         return {
             "cache_size": len(self._cache),
-            "estimated_memory_mb": len(str(self._cache)) / (1024 * 1024)
+            "estimated_memory_mb": self._cache.resident_bytes / (1024 * 1024),
+            "max_entries": self._cache.max_entries,
+            "max_memory_mb": self._cache.max_bytes / (1024 * 1024),
+            "hits": self._cache.hits,
+            "misses": self._cache.misses,
+            "evictions": self._cache.evictions,
+            "coalesced_calls": self._single_flight.coalesced_count
+        }
+    
+    def get_transport_stats(self) -> Dict[str, Any]:
+        """Get connection pool saturation and executor queue depth"""
+        return self.transport.get_stats()
+    
+    def get_concurrency_stats(self) -> Dict[str, Any]:
+        """Get adaptive concurrency limiter, retry and per-model rate limit statistics"""
+        return {
+            **self.limiter.get_stats(),
+            "retry": self.retry_policy.get_stats(),
+            "rate_limits": {model: limiter.get_stats() for model, limiter in self.rate_limiters.items()}
         }
 
 
@@ -201,8 +473,34 @@ def get_llm_manager() -> BedrockLLMManager:
     """Get or create global LLM manager instance"""
     global _llm_manager
     if _llm_manager is None:
+        latency_target = os.getenv("LLM_LATENCY_TARGET_SECONDS")
         _llm_manager = BedrockLLMManager(
-            max_concurrent=50,
-            cache_enabled=True
+            max_concurrent=int(os.getenv("LLM_MAX_CONCURRENT", "50")),
+            initial_concurrent=int(os.getenv("LLM_INITIAL_CONCURRENT", "16")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+            backoff_base_seconds=float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5")),
+            backoff_cap_seconds=float(os.getenv("LLM_BACKOFF_CAP_SECONDS", "20")),
+            deadline_seconds=float(os.getenv("LLM_CALL_DEADLINE_SECONDS", "120")),
+            retry_budget_ratio=float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2")),
+            latency_target_seconds=float(latency_target) if latency_target else None,
+            rate_limits=rate_limits_from_env(("sonnet", "haiku")),
+            connect_timeout_seconds=float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5")),
+            read_timeout_seconds=float(os.getenv("LLM_READ_TIMEOUT_SECONDS", "90")),
+            transport=os.getenv("LLM_TRANSPORT", "threads"),
+            endpoint_url=os.getenv("BEDROCK_ENDPOINT_URL") or None,
+            streaming=os.getenv("LLM_STREAMING", "false").lower() == "true",
+            cache_enabled=True,
+            cache_max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000")),
+            cache_max_bytes=int(os.getenv("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024
         )
-    return _llm_manager
\ No newline at end of file
+    return _llm_manager
+
+async def close_loop_clients():
+    """
+    Close the global LLM manager's connections bound to the running event loop
+    
+    Call before closing a loop that made LLM calls; does nothing if the
+    manager was never created.
+    """
+    if _llm_manager is not None:
+        await _llm_manager.transport.aclose()
@@ -2,56 +2,296 @@
 Cache manager with TTL support
 This file preserves your battle-tested caching implementation
 """
+import asyncio
+import atexit
 import hashlib
 import json
-from typing import Optional, Dict, Any
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, Tuple, Callable, Awaitable
 from datetime import datetime, timedelta
 import logging
 
+from .singleflight import SingleFlight
+
 logger = logging.getLogger(__name__)
 
 
+class SQLiteCacheTier:
+    """
+    Persistent cache tier backed by a local SQLite file
+    
+    Survives restarts and redeploys that keep the file. Runs in WAL mode so
+    reads never block on the writer, and buffers writes so a batch of rows
+    costs one transaction instead of one per entry. Buffered writes are
+    flushed by a background thread, so set() never touches the database.
+    Every method here blocks; async callers run get() through
+    asyncio.to_thread (see CacheManager.get_async).
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 50,
+        flush_interval_seconds: float = 5.0
+    ):
+        """
+        Args:
+            path: SQLite database file path
+            batch_size: Pending writes that trigger a flush
+            flush_interval_seconds: Maximum age of pending writes before a flush
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires_at ON cache (expires_at)")
+        
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[str, float, float]] = {}
+        self._last_flush = time.monotonic()
+        self.write_count = 0
+        
+        purged = self.purge_expired()
+        logger.info(f"Opened persistent cache at {path} ({self.size()} entries, purged {purged} expired)")
+        
+        self._flush_requested = threading.Event()
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="cache-flush", daemon=True)
+        self._flusher.start()
+        
+        atexit.register(self.close)
+    
+    def _flush_loop(self):
+        """Flush pending writes when a batch fills up or the interval passes"""
+        while not self._closed.is_set():
+            self._flush_requested.wait(timeout=self.flush_interval_seconds)
+            self._flush_requested.clear()
+            if self._closed.is_set():
+                break
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"Background cache flush failed: {e}")
+    
+    def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """
+        Get cached value and its expiry (epoch seconds)
+        
+        Returns None if not found or expired
+        """
+        now = time.time()
+        
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                row = (pending[0], pending[2])
+            else:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+            
+            if row is None:
+                return None
+            
+            value, expires_at = row
+            if expires_at <= now:
+                self._pending.pop(key, None)
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+        
+        return json.loads(value), expires_at
+    
+    def set(self, key: str, value: Any, created_at: float, expires_at: float):
+        """Queue a value for the next batched write by the background thread"""
+        try:
+            serialized = json.dumps(value)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Value for {key[:16]}... is not JSON serializable, skipping disk tier: {e}")
+            return
+        
+        with self._lock:
+            self._pending[key] = (serialized, created_at, expires_at)
+            due = len(self._pending) >= self.batch_size
+        
+        if due:
+            self._flush_requested.set()
+    
+    def flush(self):
+        """Write all pending entries in a single transaction"""
+        with self._lock:
+            if not self._pending:
+                self._last_flush = time.monotonic()
+                return
+            
+            rows = [
+                (key, value, created_at, expires_at)
+                for key, (value, created_at, expires_at) in self._pending.items()
+            ]
+            try:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO cache (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._conn.execute("ROLLBACK")
+                logger.error(f"Persistent cache flush failed: {e}")
+                return
+            
+            self._pending.clear()
+            self._last_flush = time.monotonic()
+            self.write_count += len(rows)
+        
+        logger.debug(f"Flushed {len(rows)} entries to persistent cache")
+    
+    def purge_expired(self) -> int:
+        """Delete expired entries, returning how many were removed"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            return cursor.rowcount
+    
+    def size(self) -> int:
+        """Number of entries stored on disk (excluding pending writes)"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+    
+    def clear(self):
+        """Delete all entries"""
+        with self._lock:
+            self._pending.clear()
+            self._conn.execute("DELETE FROM cache")
+    
+    def close(self):
+        """Stop the background flush, write pending entries and close the database"""
+        self._closed.set()
+        self._flush_requested.set()
+        try:
+            self.flush()
+            with self._lock:
+                self._conn.close()
+        except sqlite3.ProgrammingError:
+            # Already closed
+            pass
+
+
 class CacheManager:
     """
-    In-memory cache with TTL support
+    In-memory cache with TTL support and an optional persistent tier
     
-    Provides significant cost savings by caching LLM responses
+    Provides significant cost savings by caching LLM responses. When a
+    SQLite tier is configured, lookups read through to disk on a memory
+    miss and writes go to both tiers.
     """
     
-    def __init__(self):
+    def __init__(self, disk_tier: Optional[SQLiteCacheTier] = None):
+        """
+        Args:
+            disk_tier: Optional persistent second tier
+        """
         self._cache: Dict[str, Dict[str, Any]] = {}
+        self.disk_tier = disk_tier
         self.hit_count = 0
         self.miss_count = 0
+        self.memory_hit_count = 0
+        self.disk_hit_count = 0
+        self._single_flight = SingleFlight()
     
     def _get_key(self, **kwargs) -> str:
         """Generate cache key from kwargs"""
         content = json.dumps(kwargs, sort_keys=True)
         return hashlib.md5(content.encode()).hexdigest()
     
-    def get(self, **kwargs) -> Optional[Any]:
-        """
-        Get cached value
-        
-        Returns None if not found or expired
-        """
-        key = self._get_key(**kwargs)
-        
+    def _get_memory(self, key: str) -> Optional[Any]:
+        """Look a key up in the memory tier, dropping it if expired"""
         if key in self._cache:
             entry = self._cache[key]
             
             # Check TTL
             if entry["expires_at"] > datetime.now():
                 self.hit_count += 1
+                self.memory_hit_count += 1
                 logger.debug(f"Cache hit: {key[:16]}...")
                 return entry["value"]
             else:
                 # Expired - remove it
                 del self._cache[key]
                 logger.debug(f"Cache expired: {key[:16]}...")
-        
-        self.miss_count += 1
         return None
     
+    def _promote(self, key: str, disk_entry: Optional[Tuple[Any, float]]) -> Optional[Any]:
+        """Count a disk lookup and copy a hit into the memory tier"""
+        if disk_entry is None:
+            self.miss_count += 1
+            return None
+        
+        value, expires_at = disk_entry
+        self._cache[key] = {
+            "value": value,
+            "expires_at": datetime.fromtimestamp(expires_at),
+            "created_at": datetime.now()
+        }
+        self.hit_count += 1
+        self.disk_hit_count += 1
+        logger.debug(f"Disk cache hit: {key[:16]}...")
+        return value
+    
+    def get(self, **kwargs) -> Optional[Any]:
+        """
+        Get cached value
+        
+        Blocks on the persistent tier after a memory miss; async code uses
+        get_async instead.
+        
+        Returns None if not found or expired
+        """
+        key = self._get_key(**kwargs)
+        value = self._get_memory(key)
+        if value is not None:
+            return value
+        
+        if self.disk_tier is None:
+            self.miss_count += 1
+            return None
+        return self._promote(key, self.disk_tier.get(key))
+    
+    async def get_async(self, **kwargs) -> Optional[Any]:
+        """
+        Get cached value without blocking the event loop
+        
+        Memory hits return at once; a memory miss reads the persistent tier
+        in a worker thread.
+        
+        Returns None if not found or expired
+        """
+        key = self._get_key(**kwargs)
+        value = self._get_memory(key)
+        if value is not None:
+            return value
+        
+        if self.disk_tier is None:
+            self.miss_count += 1
+            return None
+        return self._promote(key, await asyncio.to_thread(self.disk_tier.get, key))
+    
     def set(self, value: Any, ttl_seconds: int = 3600, **kwargs):
         """
         Set cached value with TTL
@@ -62,31 +302,101 @@ class CacheManager:
             **kwargs: Cache key components
         """
         key = self._get_key(**kwargs)
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=ttl_seconds)
         self._cache[key] = {
             "value": value,
-            "expires_at": datetime.now() + timedelta(seconds=ttl_seconds),
-            "created_at": datetime.now()
+            "expires_at": expires_at,
+            "created_at": now
         }
+        
+        # Write through to the persistent tier
+        if self.disk_tier is not None:
+            self.disk_tier.set(key, value, now.timestamp(), expires_at.timestamp())
+        
         logger.debug(f"Cached with TTL {ttl_seconds}s: {key[:16]}...")
     
+    async def get_or_compute(
+        self,
+        compute: Callable[[], Awaitable[Any]],
+        ttl_seconds: int = 3600,
+        **kwargs
+    ) -> Optional[Any]:
+        """
+        Get cached value, computing it once across concurrent callers on a miss
+        
+        Callers that miss while another caller is already computing the same
+        key await that computation instead of starting their own. Results of
+        None are returned to every waiter but not cached.
+        
+        Args:
+            compute: Coroutine function producing the value
+            ttl_seconds: Time-to-live in seconds
+            **kwargs: Cache key components
+        """
+        cached = await self.get_async(**kwargs)
+        if cached is not None:
+            return cached
+        
+        async def load():
+            value = await compute()
+            if value is not None:
+                self.set(value, ttl_seconds=ttl_seconds, **kwargs)
+            return value
+        
+        return await self._single_flight.do(self._get_key(**kwargs), load)
+    
     def clear(self):
         """Clear all cache"""
         self._cache.clear()
+        if self.disk_tier is not None:
+            self.disk_tier.clear()
         self.hit_count = 0
         self.miss_count = 0
+        self.memory_hit_count = 0
+        self.disk_hit_count = 0
         logger.info("Cache cleared")
     
+    def flush(self):
+        """Flush pending writes to the persistent tier"""
+        if self.disk_tier is not None:
+            self.disk_tier.flush()
+    
     def get_stats(self) -> Dict[str, Any]:
-        """Get cache statistics"""
+        """Get cache statistics, overall and per tier"""
         total = self.hit_count + self.miss_count
         hit_rate = (self.hit_count / total * 100) if total > 0 else 0
         
-        return {
+        memory_misses = total - self.memory_hit_count
+        memory_hit_rate = (self.memory_hit_count / total * 100) if total > 0 else 0
+        
+        stats = {
             "size": len(self._cache),
             "hits": self.hit_count,
             "misses": self.miss_count,
-            "hit_rate": f"{hit_rate:.2f}%"
+            "hit_rate": f"{hit_rate:.2f}%",
+            "coalesced": self._single_flight.coalesced_count,
+            "memory": {
+                "size": len(self._cache),
+                "hits": self.memory_hit_count,
+                "misses": memory_misses,
+                "hit_rate": f"{memory_hit_rate:.2f}%"
+            }
         }
+        
+        if self.disk_tier is not None:
+            # The disk tier only sees lookups that missed memory
+            disk_hit_rate = (self.disk_hit_count / memory_misses * 100) if memory_misses > 0 else 0
+            stats["disk"] = {
+                "path": self.disk_tier.path,
+                "size": self.disk_tier.size(),
+                "hits": self.disk_hit_count,
+                "misses": self.miss_count,
+                "hit_rate": f"{disk_hit_rate:.2f}%",
+                "writes": self.disk_tier.write_count
+            }
+        
+        return stats
 
 
 # Global cache instance
@@ -94,8 +404,23 @@ _cache_manager: Optional[CacheManager] = None
 
 
 def get_cache_manager() -> CacheManager:
-    """Get or create global cache manager"""
+    """
+    Get or create global cache manager
+    
+    Set CACHE_DB_PATH to enable the persistent SQLite tier
+    """
     global _cache_manager
     if _cache_manager is None:
-        _cache_manager = CacheManager()
+        disk_tier = None
+        db_path = os.environ.get("CACHE_DB_PATH")
+        if db_path:
+            try:
+                disk_tier = SQLiteCacheTier(
+                    db_path,
+                    batch_size=int(os.environ.get("CACHE_DB_BATCH_SIZE", "50")),
+                    flush_interval_seconds=float(os.environ.get("CACHE_DB_FLUSH_SECONDS", "5"))
+                )
+            except sqlite3.Error as e:
+                logger.error(f"Could not open persistent cache at {db_path}, using memory only: {e}")
+        _cache_manager = CacheManager(disk_tier=disk_tier)
     return _cache_manager
\ No newline at end of file
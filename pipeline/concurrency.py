@@ -0,0 +1,235 @@
+"""
+Adaptive concurrency limiting for LLM calls
+AIMD: the limit grows by one per window of healthy calls and halves on throttling
+"""
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit adjusted by additive increase / multiplicative decrease
+    
+    Every healthy call (success below the latency target) adds 1/limit, so the
+    limit grows by about one per round of calls. A throttled call or a call
+    slower than the latency target multiplies the limit by decrease_factor,
+    at most once per round: only calls started after the last decrease can
+    trigger the next one, so a burst of throttles from calls that were already
+    in flight counts as one signal. Other failures leave the limit unchanged.
+    
+    The limiter is not bound to an event loop. State is guarded by a thread
+    lock and waiters are woken on their own loop, so one instance serves
+    callers from any loop (e.g. successive run_coroutine_sync batches).
+    """
+    
+    def __init__(
+        self,
+        initial_limit: int = 16,
+        min_limit: int = 1,
+        max_limit: int = 50,
+        decrease_factor: float = 0.5,
+        latency_target_seconds: Optional[float] = None
+    ):
+        """
+        Args:
+            initial_limit: Concurrency limit to start from
+            min_limit: Lower bound for the limit
+            max_limit: Upper bound for the limit
+            decrease_factor: Multiplier applied to the limit on back-off
+            latency_target_seconds: Calls slower than this count as
+                congestion (None = only throttling backs off)
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_target_seconds = latency_target_seconds
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._lock = threading.Lock()
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+    
+    @property
+    def limit(self) -> int:
+        """Current number of calls allowed in flight"""
+        return int(self._limit)
+    
+    async def acquire(self) -> float:
+        """
+        Wait for a slot
+        
+        Returns:
+            Start time of the call, to be passed back to release()
+        """
+        with self._lock:
+            if self.in_flight < self.limit and not self._waiters:
+                self._take_slot()
+                return time.monotonic()
+            
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+        
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+                    granted = False
+                else:
+                    granted = future.done() and not future.cancelled()
+            # A slot handed over after cancellation is returned by _grant
+            if granted:
+                self._release_slot()
+            raise
+        
+        return time.monotonic()
+    
+    def release(self, started: float, throttled: bool = False, failed: bool = False):
+        """
+        Free a slot and adjust the limit from the call's outcome
+        
+        Args:
+            started: Value returned by acquire()
+            throttled: Whether the call was throttled by the service
+            failed: Whether the call failed for another reason
+        """
+        latency = time.monotonic() - started
+        slow = self.latency_target_seconds is not None and latency > self.latency_target_seconds
+        
+        with self._lock:
+            if throttled or slow:
+                if started >= self._last_decrease:
+                    self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+                    self._last_decrease = time.monotonic()
+                    self.decreases += 1
+                    logger.info(
+                        f"Concurrency limit decreased to {self.limit} "
+                        f"({'throttled' if throttled else f'latency {latency:.1f}s'})"
+                    )
+            elif not failed and self._limit < self.max_limit:
+                before = self.limit
+                self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+                if self.limit > before:
+                    self.increases += 1
+        
+        self._release_slot()
+    
+    def _take_slot(self):
+        # Caller holds the lock
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+    
+    def _release_slot(self):
+        with self._lock:
+            self.in_flight -= 1
+            # The limit may have grown, so wake as many waiters as fit
+            while self._waiters and self.in_flight < self.limit:
+                future = self._waiters.popleft()
+                if future.done():
+                    continue
+                self._take_slot()
+                future.get_loop().call_soon_threadsafe(self._grant, future)
+    
+    def _grant(self, future: asyncio.Future):
+        # Runs on the waiter's loop
+        if future.done():
+            self._release_slot()
+        else:
+            future.set_result(None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get limiter statistics"""
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "waiting": len(self._waiters),
+                "increases": self.increases,
+                "decreases": self.decreases
+            }
+
+
+def backoff_delay(attempt: int, base_seconds: float, cap_seconds: float) -> float:
+    """
+    Full-jitter exponential backoff
+    
+    Args:
+        attempt: Retry number, starting at 0
+        base_seconds: Delay ceiling of the first retry
+        cap_seconds: Maximum delay ceiling
+    
+    Returns:
+        Seconds to sleep, uniform in [0, min(cap, base * 2^attempt)]
+    """
+    return random.uniform(0, min(cap_seconds, base_seconds * 2 ** attempt))
+
+
+class InstrumentedExecutor(ThreadPoolExecutor):
+    """
+    Thread pool that tracks how much work is queued and running
+    
+    Each running task holds one HTTP connection, so running / pool size is
+    the connection pool saturation, and queued is work waiting for a thread.
+    """
+    
+    def __init__(self, max_workers: int, thread_name_prefix: str = ""):
+        super().__init__(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self.max_workers = max_workers
+        self._stats_lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.peak_queued = 0
+        self.peak_running = 0
+        self.completed = 0
+    
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        def run():
+            with self._stats_lock:
+                self.queued -= 1
+                self.running += 1
+                self.peak_running = max(self.peak_running, self.running)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.running -= 1
+                    self.completed += 1
+        
+        with self._stats_lock:
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+        
+        future = super().submit(run)
+        future.add_done_callback(self._on_done)
+        return future
+    
+    def _on_done(self, future: Future):
+        # Work cancelled while queued never reaches run()
+        if future.cancelled():
+            with self._stats_lock:
+                self.queued -= 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth and thread usage"""
+        with self._stats_lock:
+            return {
+                "workers": self.max_workers,
+                "running": self.running,
+                "queued": self.queued,
+                "peak_running": self.peak_running,
+                "peak_queued": self.peak_queued,
+                "completed": self.completed
+            }
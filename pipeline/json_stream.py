@@ -0,0 +1,103 @@
+"""
+Incremental JSON boundary detection for streamed LLM output
+Finds where the first top-level JSON object or array ends, so a streamed
+response can be cut off as soon as the answer is complete
+"""
+import re
+from typing import List, Optional
+
+# Characters that can change nesting or string state
+_STRUCTURAL = re.compile(r'[{}\[\]"\\]')
+
+
+class IncrementalJSONParser:
+    """
+    Tracks nesting depth of streamed text until the first JSON value closes
+    
+    Text before the opening brace (e.g. a ```json fence) is skipped. Braces
+    inside strings, including escaped quotes, are ignored. The value itself
+    is not parsed; callers json.loads json_text once complete is True.
+    """
+    
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._length = 0
+        self._start: Optional[int] = None
+        self._end: Optional[int] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._escape_at = -1
+    
+    @property
+    def complete(self) -> bool:
+        """Whether the first top-level value has closed"""
+        return self._end is not None
+    
+    @property
+    def text(self) -> str:
+        """All text fed so far"""
+        # Joined on demand; feed() only ever looks at the new chunk
+        if len(self._chunks) > 1:
+            self._chunks[:] = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+    
+    @property
+    def json_text(self) -> Optional[str]:
+        """The first complete top-level JSON value, or None"""
+        if self._end is None:
+            return None
+        return self.text[self._start:self._end]
+    
+    def feed(self, chunk: str) -> bool:
+        """
+        Add streamed text
+        
+        Args:
+            chunk: Next piece of the response
+        
+        Returns:
+            True once the first top-level value has closed
+        """
+        offset = self._length
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+        if self._end is not None:
+            return True
+        
+        # Positions are absolute, so state carries over chunk boundaries
+        for match in _STRUCTURAL.finditer(chunk):
+            char = match.group()
+            index = offset + match.start()
+            
+            if self._in_string:
+                if self._escape:
+                    # Only the character right after the backslash is escaped
+                    if index == self._escape_at + 1:
+                        self._escape = False
+                        continue
+                    self._escape = False
+                if char == "\\":
+                    self._escape = True
+                    self._escape_at = index
+                elif char == '"':
+                    self._in_string = False
+                continue
+            
+            if self._start is None:
+                if char in "{[":
+                    self._start = index
+                    self._depth = 1
+                continue
+            
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end = index + 1
+                    return True
+        
+        return False
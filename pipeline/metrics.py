@@ -0,0 +1,302 @@
+"""
+Pipeline metrics: LLM calls, token usage and cost, throttling and row latency
+Usage is attributed to the row being processed through a context variable,
+so concurrent rows on one event loop are accounted separately
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# On-demand Bedrock prices in USD per million tokens
+DEFAULT_MODEL_PRICES = {
+    "sonnet": {"input": 3.00, "output": 15.00},
+    "haiku": {"input": 0.25, "output": 1.25}
+}
+
+# Pipeline stages that get per-row token columns, so every row has the same columns
+ROW_USAGE_STAGES = ("vendor_info", "product_info", "taxonomy", "attributes", "combined_matching")
+
+# Stage of LLM calls made without one
+UNATTRIBUTED_STAGE = "other"
+
+
+def model_prices_from_env(defaults: Dict[str, Dict[str, float]] = DEFAULT_MODEL_PRICES) -> Dict[str, Dict[str, float]]:
+    """
+    Read per-model prices from LLM_PRICE_INPUT_<MODEL> and LLM_PRICE_OUTPUT_<MODEL>
+    
+    Args:
+        defaults: Prices used when a variable is unset, in USD per million tokens
+    
+    Returns:
+        {"sonnet": {"input": ..., "output": ...}, ...}
+    """
+    return {
+        model: {
+            "input": float(os.getenv(f"LLM_PRICE_INPUT_{model.upper()}", str(price["input"]))),
+            "output": float(os.getenv(f"LLM_PRICE_OUTPUT_{model.upper()}", str(price["output"])))
+        }
+        for model, price in defaults.items()
+    }
+
+
+def _add_usage(totals: Dict[str, Dict[str, Any]], key: str, input_tokens: int, output_tokens: int, cost: float):
+    """Add one call to a {key: {calls, input_tokens, output_tokens, cost_usd}} breakdown"""
+    entry = totals.get(key)
+    if entry is None:
+        entry = totals[key] = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+    entry["calls"] += 1
+    entry["input_tokens"] += input_tokens
+    entry["output_tokens"] += output_tokens
+    entry["cost_usd"] += cost
+
+
+def _rounded_usage(totals: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    return {key: {**entry, "cost_usd": round(entry["cost_usd"], 6)} for key, entry in totals.items()}
+
+
+class RowUsage:
+    """LLM calls, tokens and cost spent on one row, in total and per stage"""
+    
+    __slots__ = ("calls", "input_tokens", "output_tokens", "cost_usd", "by_stage")
+    
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+        self.by_stage: Dict[str, Dict[str, Any]] = {}
+    
+    def columns(self) -> Dict[str, Any]:
+        """
+        Flatten into metadata columns for the row result
+        
+        Only work done for this row is counted: results served from the
+        cache or computed by the batch planning stage cost the row nothing.
+        """
+        columns = {
+            "llm_calls": self.calls,
+            "llm_input_tokens": self.input_tokens,
+            "llm_output_tokens": self.output_tokens,
+            "llm_cost_usd": round(self.cost_usd, 6)
+        }
+        for stage in ROW_USAGE_STAGES:
+            usage = self.by_stage.get(stage, {})
+            columns[f"{stage}_input_tokens"] = usage.get("input_tokens", 0)
+            columns[f"{stage}_output_tokens"] = usage.get("output_tokens", 0)
+        return columns
+
+
+# Usage of the row whose pipeline is running in the current context
+_current_row: ContextVar[Optional[RowUsage]] = ContextVar("current_row_usage", default=None)
+
+
+def _percentile(values: List[float], percentile: float) -> float:
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(percentile / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+class PipelineMetrics:
+    """
+    Process-wide counters for LLM calls, tokens and row latency
+    
+    Calls made outside a row (e.g. the batch planning stage) count towards
+    the totals but not towards any single row. Cost is estimated from the
+    token counts and per-model prices.
+    """
+    
+    def __init__(self, prices: Optional[Dict[str, Dict[str, float]]] = None):
+        """
+        Args:
+            prices: USD per million input/output tokens by model name
+                (default: DEFAULT_MODEL_PRICES)
+        """
+        self.prices = prices if prices is not None else DEFAULT_MODEL_PRICES
+        self._lock = threading.Lock()
+        # Gauge, kept across measurement windows
+        self.concurrency_limit = 0
+        self.reset()
+    
+    def reset(self):
+        """Start a new measurement window (normally one batch)"""
+        with self._lock:
+            self.llm_calls = 0
+            self.input_tokens = 0
+            self.output_tokens = 0
+            self.calls_by_model: Dict[str, int] = {}
+            self.cost_usd = 0.0
+            self.usage_by_model: Dict[str, Dict[str, Any]] = {}
+            self.usage_by_stage: Dict[str, Dict[str, Any]] = {}
+            self.rows = 0
+            self.row_latencies: List[float] = []
+            self.throttles = 0
+            self.retries = 0
+            self.retries_by_reason: Dict[str, int] = {}
+            self.failures_by_reason: Dict[str, int] = {}
+            self.rate_limit_wait_seconds = 0.0
+            self.executor_peak_in_use = 0
+            self.executor_peak_queue_depth = 0
+            self.time_to_first_token: List[float] = []
+            self.time_to_json: List[float] = []
+            self.streams_stopped_early = 0
+    
+    def estimate_cost(self, model: str, input_tokens: int, output_tokens: int) -> float:
+        """Cost in USD of one call (0 for a model without a price)"""
+        price = self.prices.get(model)
+        if price is None:
+            return 0.0
+        return (input_tokens * price["input"] + output_tokens * price["output"]) / 1_000_000
+    
+    def record_llm_call(self, model: str, input_tokens: int, output_tokens: int, stage: Optional[str] = None):
+        """Record one completed model invocation and the pipeline stage that made it"""
+        stage = stage or UNATTRIBUTED_STAGE
+        cost = self.estimate_cost(model, input_tokens, output_tokens)
+        with self._lock:
+            self.llm_calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.calls_by_model[model] = self.calls_by_model.get(model, 0) + 1
+            self.cost_usd += cost
+            _add_usage(self.usage_by_model, model, input_tokens, output_tokens, cost)
+            _add_usage(self.usage_by_stage, stage, input_tokens, output_tokens, cost)
+        
+        row = _current_row.get()
+        if row is not None:
+            row.calls += 1
+            row.input_tokens += input_tokens
+            row.output_tokens += output_tokens
+            row.cost_usd += cost
+            _add_usage(row.by_stage, stage, input_tokens, output_tokens, cost)
+    
+    def record_throttle(self, concurrency_limit: int):
+        """Record one throttled invocation and the limit after backing off"""
+        with self._lock:
+            self.throttles += 1
+            self.concurrency_limit = concurrency_limit
+    
+    def record_retry(self, reason: str):
+        """Record one retried invocation and the class of error that caused it"""
+        with self._lock:
+            self.retries += 1
+            self.retries_by_reason[reason] = self.retries_by_reason.get(reason, 0) + 1
+    
+    def record_failure(self, reason: str):
+        """Record one invocation that failed after any retries"""
+        with self._lock:
+            self.failures_by_reason[reason] = self.failures_by_reason.get(reason, 0) + 1
+    
+    def record_rate_limit_wait(self, seconds: float):
+        """Record time a call waited for its model's RPM/TPM budget"""
+        with self._lock:
+            self.rate_limit_wait_seconds += seconds
+    
+    def record_executor_load(self, running: int, queued: int):
+        """Record LLM executor threads in use and calls queued for a thread"""
+        with self._lock:
+            self.executor_peak_in_use = max(self.executor_peak_in_use, running)
+            self.executor_peak_queue_depth = max(self.executor_peak_queue_depth, queued)
+    
+    def record_stream(self, time_to_first_token: Optional[float], time_to_json: Optional[float], stopped_early: bool):
+        """Record timings of one streamed invocation (None = never reached)"""
+        with self._lock:
+            if time_to_first_token is not None:
+                self.time_to_first_token.append(time_to_first_token)
+            if time_to_json is not None:
+                self.time_to_json.append(time_to_json)
+            self.streams_stopped_early += stopped_early
+    
+    def record_concurrency_limit(self, concurrency_limit: int):
+        """Record the current LLM concurrency limit"""
+        self.concurrency_limit = concurrency_limit
+    
+    def record_row(self, latency_seconds: float):
+        """Record one finished row"""
+        with self._lock:
+            self.rows += 1
+            self.row_latencies.append(latency_seconds)
+    
+    def get_usage(self) -> Dict[str, Any]:
+        """Get token and cost totals for the window, per model and per stage"""
+        with self._lock:
+            return {
+                "llm_calls": self.llm_calls,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "cost_usd": round(self.cost_usd, 6),
+                "by_model": _rounded_usage(self.usage_by_model),
+                "by_stage": _rounded_usage(self.usage_by_stage)
+            }
+    
+    def get_summary(self) -> Dict[str, Any]:
+        """Get per-row averages, throttling, latency and streaming percentiles for the window"""
+        with self._lock:
+            rows = max(1, self.rows)
+            attempts = max(1, self.llm_calls + self.throttles)
+            return {
+                "rows": self.rows,
+                "llm_calls": self.llm_calls,
+                "calls_by_model": dict(self.calls_by_model),
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "calls_per_row": round(self.llm_calls / rows, 3),
+                "tokens_per_row": round((self.input_tokens + self.output_tokens) / rows, 1),
+                "cost_usd": round(self.cost_usd, 6),
+                "cost_per_row_usd": round(self.cost_usd / rows, 6),
+                "usage_by_stage": _rounded_usage(self.usage_by_stage),
+                "llm_throttles": self.throttles,
+                "llm_retries": self.retries,
+                "retries_by_reason": dict(self.retries_by_reason),
+                "llm_failures": sum(self.failures_by_reason.values()),
+                "failures_by_reason": dict(self.failures_by_reason),
+                "throttle_rate": round(self.throttles / attempts, 4),
+                "concurrency_limit": self.concurrency_limit,
+                "rate_limit_wait_seconds": round(self.rate_limit_wait_seconds, 3),
+                "executor_peak_in_use": self.executor_peak_in_use,
+                "executor_peak_queue_depth": self.executor_peak_queue_depth,
+                "row_latency_p50_ms": round(_percentile(self.row_latencies, 50) * 1000, 1),
+                "row_latency_p95_ms": round(_percentile(self.row_latencies, 95) * 1000, 1),
+                "ttft_p50_ms": round(_percentile(self.time_to_first_token, 50) * 1000, 1),
+                "ttft_p95_ms": round(_percentile(self.time_to_first_token, 95) * 1000, 1),
+                "time_to_json_p50_ms": round(_percentile(self.time_to_json, 50) * 1000, 1),
+                "time_to_json_p95_ms": round(_percentile(self.time_to_json, 95) * 1000, 1),
+                "streams_stopped_early": self.streams_stopped_early
+            }
+
+
+@contextmanager
+def track_row() -> Iterator[RowUsage]:
+    """
+    Attribute LLM usage inside the block to a new row and time it
+    
+    Tasks started inside the block (asyncio.gather, graph nodes) inherit the
+    row through the context variable.
+    """
+    usage = RowUsage()
+    token = _current_row.set(usage)
+    start = time.perf_counter()
+    try:
+        yield usage
+    finally:
+        _current_row.reset(token)
+        get_pipeline_metrics().record_row(time.perf_counter() - start)
+
+
+# Global instance
+_pipeline_metrics: Optional[PipelineMetrics] = None
+
+
+def get_pipeline_metrics() -> PipelineMetrics:
+    """Get or create global pipeline metrics instance"""
+    global _pipeline_metrics
+    if _pipeline_metrics is None:
+        _pipeline_metrics = PipelineMetrics(prices=model_prices_from_env())
+    return _pipeline_metrics
@@ -4,21 +4,137 @@ All nodes in one file for clarity and maintainability
 """
 import json
 import logging
-from typing import Dict, Any
+import os
+from typing import Dict, Any, Callable, List, Optional, Tuple
 
 from .state import VendorProductState
 from .bedrock_client import get_llm_manager, extract_json_from_response
 from .cache_manager import get_cache_manager
-from config.prompts import PROMPTS
+from config.prompts import PROMPTS, PROMPT_MAX_TOKENS
+from config.retrieval import NameResolver
 from config.reference import (
     get_product_attributes_list,
+    get_popular_product_attributes,
     get_product_context,
     get_taxonomy_list,
-    get_taxonomy_with_definitions
+    get_taxonomy_with_definitions,
+    get_taxonomy_index,
+    get_attribute_index,
+    get_taxonomy_resolver,
+    get_attribute_resolver,
+    find_taxonomy,
+    find_product_attribute
 )
 
 logger = logging.getLogger(__name__)
 
+# Number of retrieved taxonomy candidates sent to the LLM (0 = full list)
+TAXONOMY_TOP_K = int(os.getenv("TAXONOMY_TOP_K", "30"))
+
+# Number of retrieved attribute candidates sent to the LLM (0 = fallback list)
+ATTRIBUTE_TOP_N = int(os.getenv("ATTRIBUTE_TOP_N", "60"))
+
+# Most popular attributes sent when retrieval is disabled or finds too few candidates
+ATTRIBUTE_FALLBACK_SIZE = 200
+
+# Ask for taxonomy and attributes in one LLM call instead of two per row
+COMBINED_MATCHING = os.getenv("COMBINED_MATCHING", "false").lower() == "true"
+
+
+def build_match_query(state: VendorProductState) -> str:
+    """
+    Build the retrieval query for shortlisting taxonomy/attribute candidates
+    
+    Uses the product name, software type and, when available, the features
+    and tasks extracted from the product details.
+    """
+    product_details = state.get("product_details") or {}
+    parts = [
+        state.get("product_name", ""),
+        state.get("software_type", ""),
+        product_details.get("Product_features", ""),
+        product_details.get("Tasks_a_user_can_perform", "")
+    ]
+    return " ".join(
+        ", ".join(map(str, part)) if isinstance(part, list) else str(part)
+        for part in parts
+        if part
+    )
+
+
+def resolve_reference_name(
+    value: Any,
+    find_exact: Callable[[str], Optional[str]],
+    resolver: Optional[NameResolver],
+    kind: str
+) -> Tuple[str, float]:
+    """
+    Map a name returned by the LLM onto a canonical reference name
+    
+    Tries the exact lookup first, then the fuzzy resolver for near misses.
+    
+    Args:
+        value: Name returned by the LLM
+        find_exact: Exact/normalized lookup returning the canonical name or None
+        resolver: Fuzzy resolver for near misses (optional)
+        kind: Label used in log messages
+        
+    Returns:
+        (canonical name or "N/A", confidence between 0 and 1)
+    """
+    if not isinstance(value, str) or not value or value == "N/A":
+        return "N/A", 0.0
+    
+    canonical = find_exact(value)
+    if canonical is not None:
+        return canonical, 1.0
+    
+    if resolver is not None:
+        name, score = resolver.resolve(value)
+        if name is not None:
+            logger.info(f"Fuzzy matched {kind} '{value}' to '{name}' (confidence {score:.2f})")
+            return name, score
+    
+    logger.warning(f"Invalid {kind} returned: '{value}'")
+    return "N/A", 0.0
+
+
+def select_taxonomy_candidates(state: VendorProductState, taxonomy_list: List[str]) -> List[str]:
+    """Shortlist the most relevant taxonomies instead of sending all of them"""
+    taxonomy_index = get_taxonomy_index()
+    if taxonomy_index is None:
+        return taxonomy_list
+    return taxonomy_index.shortlist(build_match_query(state), TAXONOMY_TOP_K)
+
+
+def select_attribute_candidates(state: VendorProductState) -> List[str]:
+    """Shortlist the attributes most relevant to this product"""
+    fallback = get_popular_product_attributes(ATTRIBUTE_FALLBACK_SIZE)
+    attribute_index = get_attribute_index()
+    if attribute_index is None:
+        return fallback
+    return attribute_index.shortlist(build_match_query(state), ATTRIBUTE_TOP_N, fallback=fallback)
+
+
+def validate_taxonomy_matches(names: List[Any]) -> List[Dict[str, Any]]:
+    """Validate LLM taxonomy picks, resolving near misses to the best match"""
+    resolver = get_taxonomy_resolver()
+    matches = []
+    for name in names:
+        name, confidence = resolve_reference_name(name, find_taxonomy, resolver, "taxonomy")
+        matches.append({"Taxonomy Name": name, "Confidence": round(confidence, 3)})
+    return matches
+
+
+def validate_attribute_matches(names: List[Any]) -> List[Dict[str, Any]]:
+    """Verify LLM attribute picks are in our attributes list, resolving near misses"""
+    resolver = get_attribute_resolver()
+    matches = []
+    for name in names:
+        name, confidence = resolve_reference_name(name, find_product_attribute, resolver, "attribute")
+        matches.append({"Attribute Name": name, "Confidence": round(confidence, 3)})
+    return matches
+
 
 # =============================================================================
 # NODE 1: Vendor Info Fetching
@@ -36,49 +152,48 @@ async def fetch_vendor_info_node(state: VendorProductState) -> Dict[str, Any]:
     product_name = state["product_name"]
     product_url = state["product_url"]
     
-    # Check cache first
     cache = get_cache_manager()
-    cached = cache.get(
-        type="vendor_info",
-        vendor_name=vendor_name,
-        vendor_url=vendor_url
-    )
-    
-    if cached:
-        return {"vendor_details": cached}
     
-    llm = get_llm_manager()
-    
-    # Use centralized prompt
-    prompt = PROMPTS["vendor_info"].format(
-        vendor_name=vendor_name,
-        vendor_url=vendor_url,
-        product_name=product_name,
-        product_url=product_url
-    )
-    
-    try:
-        response = await llm.call_async(prompt, model="sonnet")
+    async def fetch():
+        llm = get_llm_manager()
         
+        # Use centralized prompt
+        prompt = PROMPTS["vendor_info"].format(
+            vendor_name=vendor_name,
+            vendor_url=vendor_url,
+            product_name=product_name,
+            product_url=product_url
+        )
+        
+        response = await llm.call_async(
+            prompt,
+            model="sonnet",
+            max_tokens=PROMPT_MAX_TOKENS["vendor_info"],
+            stage="vendor_info"
+        )
         if not response:
-            return {
-                "vendor_details": None,
-                "errors": state.get("errors", []) + ["Vendor info fetch failed"]
-            }
+            return None
         
         # Parse JSON
         json_str = extract_json_from_response(response)
-        vendor_details = json.loads(json_str)
-        
-        # Cache result (7 days TTL)
-        cache.set(
-            vendor_details,
+        return json.loads(json_str)
+    
+    try:
+        # Cached for 7 days; concurrent rows for the same vendor share one call
+        vendor_details = await cache.get_or_compute(
+            fetch,
             ttl_seconds=7 * 24 * 3600,
             type="vendor_info",
             vendor_name=vendor_name,
             vendor_url=vendor_url
         )
         
+        if not vendor_details:
+            return {
+                "vendor_details": None,
+                "errors": state.get("errors", []) + ["Vendor info fetch failed"]
+            }
+        
         return {"vendor_details": vendor_details}
         
     except Exception as e:
@@ -103,43 +218,43 @@ async def fetch_product_details_node(state: VendorProductState) -> Dict[str, Any
     product_name = state["product_name"]
     product_url = state["product_url"]
     
-    # Check cache
     cache = get_cache_manager()
-    cached = cache.get(
-        type="product_details",
-        product_url=product_url
-    )
-    
-    if cached:
-        return {"product_details": cached}
-    
-    llm = get_llm_manager()
     
-    prompt = PROMPTS["product_info"].format(
-        product_name=product_name,
-        product_url=product_url
-    )
-    
-    try:
-        response = await llm.call_async(prompt, model="sonnet")
+    async def fetch():
+        llm = get_llm_manager()
         
+        prompt = PROMPTS["product_info"].format(
+            product_name=product_name,
+            product_url=product_url
+        )
+        
+        response = await llm.call_async(
+            prompt,
+            model="sonnet",
+            max_tokens=PROMPT_MAX_TOKENS["product_info"],
+            stage="product_info"
+        )
         if not response:
-            return {
-                "product_details": None,
-                "errors": state.get("errors", []) + ["Product fetch failed"]
-            }
+            return None
         
         json_str = extract_json_from_response(response)
-        product_details = json.loads(json_str)
-        
-        # Cache (7 days TTL)
-        cache.set(
-            product_details,
+        return json.loads(json_str)
+    
+    try:
+        # Cached for 7 days; concurrent rows for the same product share one call
+        product_details = await cache.get_or_compute(
+            fetch,
             ttl_seconds=7 * 24 * 3600,
             type="product_details",
             product_url=product_url
         )
         
+        if not product_details:
+            return {
+                "product_details": None,
+                "errors": state.get("errors", []) + ["Product fetch failed"]
+            }
+        
         return {"product_details": product_details}
         
     except Exception as e:
@@ -187,8 +302,6 @@ async def find_taxonomy_matches_node(state: VendorProductState) -> Dict[str, Any
     software_type = state.get("software_type", "N/A")
     product_name = state["product_name"]
     
-    from config.reference import get_taxonomy_list
-    
     taxonomy_list = get_taxonomy_list()
     
     if not taxonomy_list:
@@ -200,23 +313,17 @@ async def find_taxonomy_matches_node(state: VendorProductState) -> Dict[str, Any
             ]
         }
     
-    # Check cache
     cache = get_cache_manager()
-    cached = cache.get(
-        type="taxonomy_match",
-        software_type=software_type,
-        product_name=product_name
-    )
-    
-    if cached:
-        return {"taxonomy_matches": cached}
-    
-    llm = get_llm_manager()
-    
-    # Build numbered list of ALL taxonomies
-    taxonomy_text = "\n".join([f"{i}. {tax}" for i, tax in enumerate(taxonomy_list, 1)])
     
-    system_prompt = """You are a taxonomy classification expert. You match products to the most relevant taxonomy categories from a provided list.
+    async def match():
+        llm = get_llm_manager()
+        
+        candidates = select_taxonomy_candidates(state, taxonomy_list)
+        
+        # Build numbered list of candidate taxonomies
+        taxonomy_text = "\n".join([f"{i}. {tax}" for i, tax in enumerate(candidates, 1)])
+        
+        system_prompt = """You are a taxonomy classification expert. You match products to the most relevant taxonomy categories from a provided list.
 
 CRITICAL RULES:
 1. You MUST return the EXACT taxonomy text from the numbered list - copy it character-for-character
@@ -224,7 +331,7 @@ CRITICAL RULES:
 3. Do NOT make up new taxonomy names
 4. If unsure, pick the closest match from the list"""
     
-    prompt = f"""Product Name: {product_name}
+        prompt = f"""Product Name: {product_name}
 Product Type: {software_type}
 
 Available Taxonomy Categories (choose from this list):
@@ -242,17 +349,16 @@ Return ONLY this JSON (copy taxonomy names EXACTLY from the numbered list above)
     "match_2": "EXACT taxonomy from list"
 }}"""
     
-    try:
         response = await llm.call_async(
             prompt,
             system_prompt=system_prompt,
-            model="sonnet"  # Use smarter model for better accuracy
+            model="sonnet",  # Use smarter model for better accuracy
+            max_tokens=PROMPT_MAX_TOKENS["taxonomy_match"],
+            stage="taxonomy"
         )
         
         if not response:
-            return {
-                "taxonomy_matches": [{"Taxonomy Name": "N/A"}, {"Taxonomy Name": "N/A"}]
-            }
+            return None
         
         json_str = extract_json_from_response(response)
         matches = json.loads(json_str)
@@ -261,41 +367,23 @@ Return ONLY this JSON (copy taxonomy names EXACTLY from the numbered list above)
         match1 = matches.get("match_1") or matches.get("Top_Match_1", {}).get("Taxonomy Name", "N/A")
         match2 = matches.get("match_2") or matches.get("Top_Match_2", {}).get("Taxonomy Name", "N/A")
         
-        # Validate exact match
-        if match1 not in taxonomy_list:
-            logger.warning(f"Invalid taxonomy returned: '{match1}'")
-            # Try fuzzy match
-            for tax in taxonomy_list:
-                if match1.lower() in tax.lower() or tax.lower() in match1.lower():
-                    logger.info(f"Fuzzy matched '{match1}' to '{tax}'")
-                    match1 = tax
-                    break
-            else:
-                match1 = "N/A"
-        
-        if match2 not in taxonomy_list:
-            logger.warning(f"Invalid taxonomy returned: '{match2}'")
-            for tax in taxonomy_list:
-                if match2.lower() in tax.lower() or tax.lower() in match2.lower():
-                    logger.info(f"Fuzzy matched '{match2}' to '{tax}'")
-                    match2 = tax
-                    break
-            else:
-                match2 = "N/A"
-        
-        result = [
-            {"Taxonomy Name": match1},
-            {"Taxonomy Name": match2}
-        ]
-        
-        cache.set(
-            result,
+        return validate_taxonomy_matches([match1, match2])
+    
+    try:
+        # Concurrent rows with the same product and type share one call
+        result = await cache.get_or_compute(
+            match,
             ttl_seconds=24 * 3600,
             type="taxonomy_match",
             software_type=software_type,
             product_name=product_name
         )
         
+        if not result:
+            return {
+                "taxonomy_matches": [{"Taxonomy Name": "N/A"}, {"Taxonomy Name": "N/A"}]
+            }
+        
         return {"taxonomy_matches": result}
         
     except Exception as e:
@@ -320,8 +408,6 @@ async def find_attribute_matches_node(state: VendorProductState) -> Dict[str, An
     product_name = state["product_name"]
     
     # Get attributes list from reference data
-    from config.reference import get_product_attributes_list
-    
     available_attributes = get_product_attributes_list()
     
     if not available_attributes:
@@ -334,29 +420,22 @@ async def find_attribute_matches_node(state: VendorProductState) -> Dict[str, An
         }
     
     cache = get_cache_manager()
-    cached = cache.get(
-        type="attribute_match",
-        software_type=software_type,
-        product_name=product_name
-    )
     
-    if cached:
-        return {"attribute_matches": cached}
-    
-    llm = get_llm_manager()
-    
-    # Build attribute list (use top 200 most common)
-    attributes_sample = available_attributes[:200]
-    attributes_text = "\n".join([f"{i}. {attr}" for i, attr in enumerate(attributes_sample, 1)])
-    
-    system_prompt = f"""You are matching products to attributes.
+    async def match():
+        llm = get_llm_manager()
+        
+        attributes_sample = select_attribute_candidates(state)
+        
+        attributes_text = "\n".join([f"{i}. {attr}" for i, attr in enumerate(attributes_sample, 1)])
+        
+        system_prompt = f"""You are matching products to attributes.
 
 Available Product Attributes:
 {attributes_text}
 
 CRITICAL: You MUST return ONLY the EXACT attribute names from the list above. Do not paraphrase or modify them."""
     
-    prompt = f"""Product: {product_name}
+        prompt = f"""Product: {product_name}
 Type: {software_type}
 
 Based on the available attributes above, identify the top 3 most relevant attributes for this product.
@@ -370,17 +449,16 @@ Return ONLY JSON in this exact format (use the EXACT attribute names from the li
 
 IMPORTANT: Copy the attribute names EXACTLY as they appear in the list. Do not modify or paraphrase."""
     
-    try:
-        response = await llm.call_async(prompt, system_prompt=system_prompt, model="haiku")
+        response = await llm.call_async(
+            prompt,
+            system_prompt=system_prompt,
+            model="haiku",
+            max_tokens=PROMPT_MAX_TOKENS["attribute_match"],
+            stage="attributes"
+        )
         
         if not response:
-            return {
-                "attribute_matches": [
-                    {"Attribute Name": "N/A"},
-                    {"Attribute Name": "N/A"},
-                    {"Attribute Name": "N/A"}
-                ]
-            }
+            return None
         
         json_str = extract_json_from_response(response)
         matches = json.loads(json_str)
@@ -390,31 +468,27 @@ IMPORTANT: Copy the attribute names EXACTLY as they appear in the list. Do not m
         attr2 = matches.get("Top_Attribute_2", {}).get("Attribute Name", "N/A")
         attr3 = matches.get("Top_Attribute_3", {}).get("Attribute Name", "N/A")
         
-        # Verify matches are in our attributes list (exact match validation)
-        if attr1 not in available_attributes:
-            logger.warning(f"LLM returned invalid attribute: {attr1}")
-            attr1 = "N/A"
-        if attr2 not in available_attributes:
-            logger.warning(f"LLM returned invalid attribute: {attr2}")
-            attr2 = "N/A"
-        if attr3 not in available_attributes:
-            logger.warning(f"LLM returned invalid attribute: {attr3}")
-            attr3 = "N/A"
-        
-        result = [
-            {"Attribute Name": attr1},
-            {"Attribute Name": attr2},
-            {"Attribute Name": attr3}
-        ]
-        
-        cache.set(
-            result,
+        return validate_attribute_matches([attr1, attr2, attr3])
+    
+    try:
+        # Concurrent rows with the same product and type share one call
+        result = await cache.get_or_compute(
+            match,
             ttl_seconds=24 * 3600,
             type="attribute_match",
             software_type=software_type,
             product_name=product_name
         )
         
+        if not result:
+            return {
+                "attribute_matches": [
+                    {"Attribute Name": "N/A"},
+                    {"Attribute Name": "N/A"},
+                    {"Attribute Name": "N/A"}
+                ]
+            }
+        
         return {"attribute_matches": result}
         
     except Exception as e:
@@ -427,6 +501,100 @@ IMPORTANT: Copy the attribute names EXACTLY as they appear in the list. Do not m
             ]
         }
 
+# =============================================================================
+# NODE 4+5: Combined Taxonomy and Attribute Matching
+# =============================================================================
+
+async def find_combined_matches_node(state: VendorProductState) -> Dict[str, Any]:
+    """
+    Match taxonomy and attributes in one LLM call (COMBINED_MATCHING)
+    
+    Both candidate lists go into a single structured prompt and both outputs
+    are validated like the split nodes. Returns an empty dict when the call
+    or its parsing fails, so the caller can fall back to the split nodes.
+    Cache TTL: 1 day
+    """
+    software_type = state.get("software_type", "N/A")
+    product_name = state["product_name"]
+    
+    taxonomy_list = get_taxonomy_list()
+    if not taxonomy_list or not get_product_attributes_list():
+        return {}
+    
+    cache = get_cache_manager()
+    
+    async def match():
+        llm = get_llm_manager()
+        
+        taxonomy_text = "\n".join(
+            f"{i}. {tax}" for i, tax in enumerate(select_taxonomy_candidates(state, taxonomy_list), 1)
+        )
+        attributes_text = "\n".join(
+            f"{i}. {attr}" for i, attr in enumerate(select_attribute_candidates(state), 1)
+        )
+        
+        system_prompt = """You are a product classification expert. You match products to taxonomy categories and product attributes from provided lists.
+
+CRITICAL RULES:
+1. You MUST return the EXACT text from the numbered lists - copy it character-for-character
+2. Do NOT paraphrase, shorten, or modify the names
+3. Do NOT make up new names
+4. If unsure, pick the closest match from the list"""
+        
+        prompt = f"""Product Name: {product_name}
+Product Type: {software_type}
+
+Available Taxonomy Categories:
+{taxonomy_text}
+
+Available Product Attributes:
+{attributes_text}
+
+Task: Select the 2 most relevant taxonomy categories and the 3 most relevant product attributes for this product.
+
+Return ONLY this JSON (copy names EXACTLY from the numbered lists above):
+{{
+    "taxonomy_matches": ["EXACT taxonomy from list", "EXACT taxonomy from list"],
+    "attribute_matches": ["EXACT attribute from list", "EXACT attribute from list", "EXACT attribute from list"]
+}}"""
+        
+        response = await llm.call_async(
+            prompt,
+            system_prompt=system_prompt,
+            model="sonnet",
+            max_tokens=PROMPT_MAX_TOKENS["combined_match"],
+            stage="combined_matching"
+        )
+        
+        if not response:
+            return None
+        
+        matches = json.loads(extract_json_from_response(response))
+        taxonomy = matches["taxonomy_matches"]
+        attributes = matches["attribute_matches"]
+        if not isinstance(taxonomy, list) or not isinstance(attributes, list):
+            raise ValueError("taxonomy_matches and attribute_matches must be lists")
+        
+        return {
+            "taxonomy_matches": validate_taxonomy_matches((taxonomy + ["N/A"] * 2)[:2]),
+            "attribute_matches": validate_attribute_matches((attributes + ["N/A"] * 3)[:3])
+        }
+    
+    try:
+        result = await cache.get_or_compute(
+            match,
+            ttl_seconds=24 * 3600,
+            type="combined_match",
+            software_type=software_type,
+            product_name=product_name
+        )
+        return dict(result) if result else {}
+        
+    except Exception as e:
+        logger.warning(f"Combined matching failed for '{product_name}', using split calls: {e}")
+        return {}
+
+
 # =============================================================================
 # NODE 6: Platform Taxonomy (Simplified)
 # =============================================================================
@@ -450,6 +618,19 @@ async def find_platform_taxonomy_node(state: VendorProductState) -> Dict[str, An
 # NODE 7: Format Output
 # =============================================================================
 
+# Keys of the row built by format_output_node, in output order
+OUTPUT_COLUMNS = (
+    "vendor_name", "vendor_url", "product_name", "product_url",
+    "legal_vendor_name", "official_vendor_website", "acquiring_company",
+    "wikipedia_link", "linkedin_profile", "founded_year",
+    "product_type", "product_users", "product_tasks", "product_features",
+    "taxonomy_match_1", "taxonomy_match_2",
+    "attribute_1", "attribute_2", "attribute_3",
+    "platform_1", "platform_2",
+    "errors", "row_id"
+)
+
+
 def format_output_node(state: VendorProductState) -> Dict[str, Any]:
     """
     Format final output with all enriched data
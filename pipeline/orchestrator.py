@@ -4,24 +4,37 @@ Defines the end-to-end enrichment pipeline with parallel processing
 """
 import logging
 import asyncio
-from typing import Dict, Any
+import itertools
+import os
+import threading
+import time
+from typing import Dict, Any, Callable, AsyncIterator, Awaitable, Iterable, List
 import pandas as pd
 from langgraph.graph import StateGraph, END
 
 from .state import VendorProductState
-from .batch_processor import BatchProcessor
+from .batch_processor import BatchProcessor, iter_dataframe_rows, run_coroutine_sync
+from .cache_manager import get_cache_manager
+from .metrics import RowUsage, get_pipeline_metrics, track_row
+from config.reference import initialize_reference_data, get_taxonomy_list, get_product_attributes_list
 from .nodes import (
     fetch_vendor_info_node,
     fetch_product_details_node,
     extract_software_type_node,
     find_taxonomy_matches_node,
     find_attribute_matches_node,
+    find_combined_matches_node,
     find_platform_taxonomy_node,
     format_output_node
 )
+from . import nodes
+from . import packing
 
 logger = logging.getLogger(__name__)
 
+# Attach each row's LLM calls, tokens per stage and cost as extra output columns
+ROW_USAGE_COLUMNS = os.getenv("ROW_USAGE_COLUMNS", "false").lower() == "true"
+
 
 async def parallel_fetch_node(state: VendorProductState) -> Dict[str, Any]:
     """
@@ -51,7 +64,16 @@ async def parallel_matching_node(state: VendorProductState) -> Dict[str, Any]:
     """
     Node 3: Run all matching operations in parallel
     Implements column-level parallelism for taxonomy/attribute matching
+    
+    With COMBINED_MATCHING, taxonomy and attributes come from one LLM call;
+    if that call fails to parse, the separate calls run instead.
     """
+    if nodes.COMBINED_MATCHING:
+        combined = await find_combined_matches_node(state)
+        if combined:
+            combined.update(await find_platform_taxonomy_node(state))
+            return combined
+    
     taxonomy_task = find_taxonomy_matches_node(state)
     attribute_task = find_attribute_matches_node(state)
     platform_task = find_platform_taxonomy_node(state)
@@ -107,19 +129,105 @@ def build_pipeline_graph() -> StateGraph:
     return compiled
 
 
-async def run_pipeline_for_row(row: Dict[str, Any], row_id: str) -> Dict[str, Any]:
+# =============================================================================
+# Compiled Graph Registry
+# =============================================================================
+
+# Builders for every graph the process can serve, keyed by graph name
+_GRAPH_BUILDERS: Dict[str, Callable[[], Any]] = {
+    "enrichment": build_pipeline_graph
+}
+
+# Reference datasets read by the nodes (intents are not used)
+PIPELINE_DATASETS = ("products", "taxonomy")
+
+# Process-wide compiled graphs, shared by all rows and entry points
+_compiled_graphs: Dict[str, Any] = {}
+_graph_stats: Dict[str, Dict[str, Any]] = {}
+_graph_lock = threading.Lock()
+
+
+def get_pipeline_graph(name: str = "enrichment"):
     """
-    Execute pipeline for a single row
+    Get the process-wide compiled pipeline graph
+    
+    The graph is built and compiled once on first use (or at warmup) and then
+    reused for every row. Compiled LangGraph graphs are stateless between
+    invocations, so one instance is safe to share across concurrent rows.
     
     Args:
-        row: Dictionary with vendor_name, vendor_url, product_name, product_url
-        row_id: Unique identifier for this row
-        
+        name: Registered graph name
+    
     Returns:
-        Enriched result dictionary
+        Compiled graph
     """
-    # Initialize state
-    initial_state: VendorProductState = {
+    compiled = _compiled_graphs.get(name)
+    if compiled is not None:
+        # The lookup needs no lock, but the counter is shared with other threads
+        with _graph_lock:
+            _graph_stats[name]["reuses"] += 1
+        return compiled
+    
+    if name not in _GRAPH_BUILDERS:
+        raise ValueError(f"Graph '{name}' not registered")
+    
+    with _graph_lock:
+        # Another thread may have built it while we waited
+        compiled = _compiled_graphs.get(name)
+        if compiled is not None:
+            _graph_stats[name]["reuses"] += 1
+            return compiled
+        
+        start = time.perf_counter()
+        compiled = _GRAPH_BUILDERS[name]()
+        build_time_ms = (time.perf_counter() - start) * 1000
+        
+        _graph_stats[name] = {
+            "builds": _graph_stats.get(name, {}).get("builds", 0) + 1,
+            "build_time_ms": round(build_time_ms, 2),
+            "reuses": 0
+        }
+        _compiled_graphs[name] = compiled
+        
+        logger.info(f"Compiled graph '{name}' in {build_time_ms:.1f}ms")
+        return compiled
+
+
+def warmup_pipeline(load_reference: bool = True):
+    """
+    Build all registered graphs ahead of the first request
+    
+    Args:
+        load_reference: Also load the reference datasets the nodes use, so
+            the first request does not pay for parsing them
+    """
+    if load_reference:
+        initialize_reference_data(PIPELINE_DATASETS)
+    
+    for name in _GRAPH_BUILDERS:
+        get_pipeline_graph(name)
+
+
+def get_graph_stats() -> Dict[str, Dict[str, Any]]:
+    """Get build time and reuse counts for each compiled graph"""
+    with _graph_lock:
+        return {name: dict(stats) for name, stats in _graph_stats.items()}
+
+
+def get_output_columns() -> List[str]:
+    """
+    Columns of a result row: the formatted output, the error of a failed
+    row, then the usage columns when ROW_USAGE_COLUMNS is set
+    """
+    columns = list(nodes.OUTPUT_COLUMNS) + ["error"]
+    if ROW_USAGE_COLUMNS:
+        columns.extend(RowUsage().columns())
+    return columns
+
+
+def build_initial_state(row: Dict[str, Any], row_id: str) -> VendorProductState:
+    """Build the pipeline input state for a row"""
+    return {
         "row_id": row_id,
         "vendor_name": row.get("vendor_name", ""),
         "vendor_url": row.get("vendor_url", ""),
@@ -128,27 +236,226 @@ async def run_pipeline_for_row(row: Dict[str, Any], row_id: str) -> Dict[str, An
         "errors": [],
         "retry_count": 0
     }
+
+
+async def run_pipeline_for_row(row: Dict[str, Any], row_id: str) -> Dict[str, Any]:
+    """
+    Execute pipeline for a single row
     
-    # Build and run graph
-    graph = build_pipeline_graph()
+    Args:
+        row: Dictionary with vendor_name, vendor_url, product_name, product_url
+        row_id: Unique identifier for this row
+    
+    Returns:
+        Enriched result dictionary, with usage columns if ROW_USAGE_COLUMNS is set
+    """
+    # Initialize state
+    initial_state = build_initial_state(row, row_id)
     
-    try:
-        result_state = await graph.ainvoke(initial_state)
-        return result_state.get("result", {})
+    # Reuse the process-wide compiled graph
+    graph = get_pipeline_graph()
+    
+    with track_row() as usage:
+        try:
+            result_state = await graph.ainvoke(initial_state)
+            result = result_state.get("result", {})
         
-    except Exception as e:
-        logger.error(f"Pipeline failed for row {row_id}: {e}")
-        return {
-            "error": str(e),
-            "row_id": row_id,
-            "vendor_name": row.get("vendor_name", ""),
-            "product_name": row.get("product_name", "")
-        }
+        except Exception as e:
+            logger.error(f"Pipeline failed for row {row_id}: {e}")
+            result = {
+                "error": str(e),
+                "row_id": row_id,
+                "vendor_name": row.get("vendor_name", ""),
+                "product_name": row.get("product_name", "")
+            }
+    
+    if ROW_USAGE_COLUMNS:
+        result.update(usage.columns())
+    return result
+
+
+# =============================================================================
+# Batch Planning (cross-row deduplication)
+# =============================================================================
+
+_plan_stats: Dict[str, Any] = {}
+
+
+async def _run_bounded(
+    items: Iterable[Any],
+    fn: Callable[[Any], Awaitable[Any]],
+    limit: int
+):
+    """Run fn over items with at most limit calls in flight"""
+    iterator = iter(items)
+    
+    async def worker():
+        # Workers share one iterator, so each item is taken exactly once
+        for item in iterator:
+            await fn(item)
+    
+    await asyncio.gather(*(worker() for _ in range(max(1, limit))))
+
+
+async def _run_packed_matching(
+    states: List[VendorProductState],
+    max_concurrent: int
+) -> Dict[str, int]:
+    """
+    Run the taxonomy and attribute stages as packed multi-row requests
+    
+    Only rows without a cached result are packed. Rows a packed response
+    misses stay uncached and are matched singly by the dispatch that follows.
+    
+    Returns:
+        Packed request counts
+    """
+    stats = {"packed_requests": 0, "packed_rows": 0, "redispatched_rows": 0}
+    
+    async def run_pack(args: tuple):
+        stage, group = args
+        missed = await stage.run_pack(group)
+        if len(group) > 1:
+            stats["packed_requests"] += 1
+            stats["packed_rows"] += len(group)
+            stats["redispatched_rows"] += len(missed)
+    
+    packs = []
+    for stage in packing.PACKED_STAGES:
+        pending = await stage.pending(states)
+        packs.extend((stage, group) for group in stage.group(pending, packing.PACKED_MATCHING_SIZE))
+    await _run_bounded(packs, run_pack, max_concurrent)
+    return stats
+
+
+def _matching_calls_per_key() -> int:
+    """
+    LLM calls the matching stage makes for one key
+    
+    A stage without reference data returns N/A without calling the LLM, and
+    combined matching falls back to the split stages unless both lists exist.
+    """
+    taxonomy = bool(get_taxonomy_list())
+    attributes = bool(get_product_attributes_list())
+    if nodes.COMBINED_MATCHING and taxonomy and attributes:
+        return 1
+    return int(taxonomy) + int(attributes)
+
+
+async def prefetch_unique_work(
+    df: pd.DataFrame,
+    max_concurrent: int = 20
+) -> Dict[str, Any]:
+    """
+    Run each unique unit of LLM work in the batch exactly once
+    
+    Input CSVs repeat vendors and products heavily. This planning stage
+    computes the unique (vendor_name, vendor_url), product_url and
+    (software_type, product_name) keys and runs the corresponding nodes once
+    per key. Results land in the CacheManager, so when rows are dispatched
+    through the graph afterwards every fetch is a cache hit and the results
+    fan back out to all rows sharing a key.
+    
+    With PACKED_MATCHING_SIZE > 1 (and without COMBINED_MATCHING), matching
+    keys that share candidates are first classified together in packed
+    multi-row requests.
+    
+    Args:
+        df: Input DataFrame with columns: vendor_name, vendor_url, product_name, product_url
+        max_concurrent: Maximum number of units to run simultaneously
+    
+    Returns:
+        Plan statistics including the number of LLM calls saved
+    """
+    rows = len(df)
+    
+    vendor_units = df.drop_duplicates(subset=["vendor_name", "vendor_url"])
+    product_units = df.drop_duplicates(subset=["product_url"])
+    
+    # Stage 1: vendor and product info (independent, run together)
+    product_details: Dict[Any, Any] = {}
+    
+    async def fetch_vendor(row: Dict[str, Any]):
+        await fetch_vendor_info_node(build_initial_state(row, "plan"))
+    
+    async def fetch_product(row: Dict[str, Any]):
+        result = await fetch_product_details_node(build_initial_state(row, "plan"))
+        product_details[row.get("product_url", "")] = result.get("product_details")
+    
+    async def fetch(unit: tuple):
+        fetch_unit, row = unit
+        await fetch_unit(row)
+    
+    # One work stream, so both stages together stay within max_concurrent
+    units = itertools.chain(
+        ((fetch_vendor, row) for row in iter_dataframe_rows(vendor_units)),
+        ((fetch_product, row) for row in iter_dataframe_rows(product_units))
+    )
+    await _run_bounded(units, fetch, max_concurrent)
+    
+    # Stage 2: matching, keyed on the software type derived from product details
+    match_units: Dict[tuple, VendorProductState] = {}
+    for row in iter_dataframe_rows(df.drop_duplicates(subset=["product_url", "product_name"])):
+        state = build_initial_state(row, "plan")
+        state["product_details"] = product_details.get(row.get("product_url", ""))
+        state["software_type"] = extract_software_type_node(state)["software_type"]
+        match_units.setdefault((state["software_type"], state["product_name"]), state)
+    
+    packed: Dict[str, int] = {}
+    if packing.PACKED_MATCHING_SIZE > 1 and not nodes.COMBINED_MATCHING:
+        packed = await _run_packed_matching(list(match_units.values()), max_concurrent)
+    
+    await _run_bounded(match_units.values(), parallel_matching_node, max_concurrent)
+    
+    # One vendor and one product call per row, plus the matching calls that can run
+    match_calls = _matching_calls_per_key()
+    calls_without_plan = rows * (2 + match_calls)
+    calls_planned = len(vendor_units) + len(product_units) + match_calls * len(match_units)
+    if packed:
+        # Packed rows need no single call unless the packed response missed them
+        calls_planned += packed["packed_requests"] - packed["packed_rows"] + packed["redispatched_rows"]
+    
+    stats = {
+        "rows": rows,
+        "unique_vendors": len(vendor_units),
+        "unique_products": len(product_units),
+        "unique_match_keys": len(match_units),
+        "llm_calls_planned": calls_planned,
+        "llm_calls_saved": calls_without_plan - calls_planned,
+        **packed
+    }
+    
+    _plan_stats.clear()
+    _plan_stats.update(stats)
+    
+    logger.info(f"Batch plan: {stats}")
+    return stats
+
+
+def get_plan_stats() -> Dict[str, Any]:
+    """Get statistics from the most recent batch plan"""
+    return dict(_plan_stats)
+
+
+def _has_duplicate_work(df: pd.DataFrame) -> bool:
+    """Whether any vendor or product repeats across rows"""
+    return (
+        df.duplicated(subset=["vendor_name", "vendor_url"]).any()
+        or df.duplicated(subset=["product_url"]).any()
+        or df.duplicated(subset=["product_name"]).any()
+    )
+
+
+def _needs_planning(df: pd.DataFrame) -> bool:
+    """Whether the planning stage saves calls: repeated work or packed matching"""
+    packed = packing.PACKED_MATCHING_SIZE > 1 and not nodes.COMBINED_MATCHING
+    return (packed and len(df) > 1) or _has_duplicate_work(df)
 
 
 def process_dataframe_batch(
     df: pd.DataFrame,
-    max_concurrent_rows: int = 20
+    max_concurrent_rows: int = 20,
+    dedupe: bool = True
 ) -> pd.DataFrame:
     """
     Process entire DataFrame through pipeline with row-level parallelism
@@ -158,7 +465,8 @@ def process_dataframe_batch(
     Args:
         df: Input DataFrame with columns: vendor_name, vendor_url, product_name, product_url
         max_concurrent_rows: Maximum number of rows to process simultaneously
-        
+        dedupe: Run unique vendor/product/matching work once before dispatching rows
+    
     Returns:
         Enriched DataFrame with all results
     """
@@ -170,8 +478,82 @@ def process_dataframe_batch(
         progress_bar=False  # Disable for Lambda
     )
     
-    results_df = processor.process_batch_sync(df)
+    async def run() -> List[Dict[str, Any]]:
+        if dedupe and _needs_planning(df):
+            await prefetch_unique_work(df, max_concurrent=max_concurrent_rows)
+        return await processor.process_batch(df)
+    
+    metrics = get_pipeline_metrics()
+    metrics.reset()
+    
+    results_df = pd.DataFrame(run_coroutine_sync(run()))
+    
+    # Persist this batch's cache writes before returning
+    cache = get_cache_manager()
+    cache.flush()
     
     logger.info(f"Batch processing complete: {len(results_df)} rows processed")
+    logger.info(f"Graph stats: {get_graph_stats()}")
+    logger.info(f"Cache stats: {cache.get_stats()}")
+    logger.info(f"Pipeline metrics: {metrics.get_summary()}")
+    
+    return results_df
+
+
+async def stream_dataframe_batch(
+    df: pd.DataFrame,
+    max_concurrent_rows: int = 20,
+    ordered: bool = True,
+    dedupe: bool = False
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Process DataFrame through pipeline, yielding each enriched row as it finishes
+    
+    Args:
+        df: Input DataFrame with columns: vendor_name, vendor_url, product_name, product_url
+        max_concurrent_rows: Maximum number of rows to process simultaneously
+        ordered: Yield rows in input order (buffers rows that finish early)
+            instead of completion order
+        dedupe: Run unique work once before dispatching rows. Off by default
+            because the planning stage delays the first streamed row
+    
+    Yields:
+        Enriched result dictionaries
+    """
+    logger.info(
+        f"Starting streaming batch of {len(df)} rows with "
+        f"max_concurrent={max_concurrent_rows}, ordered={ordered}"
+    )
+    
+    processor = BatchProcessor(
+        max_concurrent=max_concurrent_rows,
+        progress_bar=False
+    )
+    
+    metrics = get_pipeline_metrics()
+    metrics.reset()
+    
+    if dedupe and _needs_planning(df):
+        await prefetch_unique_work(df, max_concurrent=max_concurrent_rows)
+    
+    # Rows that finished ahead of the next row due, keyed by input index
+    pending: Dict[int, Dict[str, Any]] = {}
+    next_index = 0
+    
+    async for index, result in processor.process_rows(iter_dataframe_rows(df)):
+        if not ordered:
+            yield result
+            continue
+        
+        pending[index] = result
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+    
+    # Write the persistent tier off the event loop
+    cache = get_cache_manager()
+    await asyncio.to_thread(cache.flush)
     
-    return results_df
\ No newline at end of file
+    logger.info(f"Streaming batch complete. Graph stats: {get_graph_stats()}")
+    logger.info(f"Cache stats: {cache.get_stats()}")
+    logger.info(f"Pipeline metrics: {metrics.get_summary()}")
\ No newline at end of file
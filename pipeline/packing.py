@@ -0,0 +1,276 @@
+"""
+Packed multi-row LLM requests for the classification stages
+Several products that share (most of) their candidate list are classified in
+one request, so the list is sent once instead of once per product
+"""
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List
+
+from .state import VendorProductState
+from .bedrock_client import get_llm_manager, extract_json_from_response
+from .cache_manager import get_cache_manager
+from .nodes import (
+    select_taxonomy_candidates,
+    select_attribute_candidates,
+    validate_taxonomy_matches,
+    validate_attribute_matches
+)
+from config.prompts import PROMPT_MAX_TOKENS
+from config.reference import get_taxonomy_list, get_product_attributes_list
+
+logger = logging.getLogger(__name__)
+
+# Products per packed request (0 or 1 = one product per request)
+PACKED_MATCHING_SIZE = int(os.getenv("PACKED_MATCHING_SIZE", "0"))
+
+# A product joins a pack only while the merged candidate list stays within
+# this multiple of the product's own list
+PACKED_CANDIDATE_GROWTH = 2.0
+
+
+def group_by_candidates(
+    candidate_lists: List[List[str]],
+    max_size: int,
+    max_growth: float = PACKED_CANDIDATE_GROWTH
+) -> List[List[int]]:
+    """
+    Greedily group items so each group can share one merged candidate list
+    
+    Items are sorted by candidate list, so identical lists end up together.
+    A group closes at max_size items, or when adding an item would grow the
+    merged list beyond max_growth times the longest list in the group.
+    
+    Args:
+        candidate_lists: Candidate list per item
+        max_size: Maximum items per group
+        max_growth: Allowed size of the merged list relative to one list
+    
+    Returns:
+        Groups of item indexes
+    """
+    groups: List[List[int]] = []
+    current: List[int] = []
+    merged: set = set()
+    longest = 0
+    
+    for i in sorted(range(len(candidate_lists)), key=lambda i: candidate_lists[i]):
+        candidates = candidate_lists[i]
+        grown = merged.union(candidates)
+        limit = max_growth * max(longest, len(candidates))
+        
+        if current and (len(current) >= max_size or len(grown) > limit):
+            groups.append(current)
+            current, grown, longest = [], set(candidates), 0
+        
+        current.append(i)
+        merged = grown
+        longest = max(longest, len(candidates))
+    
+    if current:
+        groups.append(current)
+    return groups
+
+
+class PackedStage:
+    """
+    One classification stage (taxonomy or attributes) in packed form
+    
+    A packed request lists the merged candidates once and the products as a
+    JSON array keyed by row_id; the response is a JSON array with one entry
+    per row_id. Each valid entry is cached under the same key the single-row
+    node uses, so the rows dispatched afterwards hit the cache. Rows missing
+    from the response, or with invalid entries, are left uncached and fall
+    back to the single-row node.
+    
+    A pack holds at most as many products as the model's output ceiling has
+    room for at the stage's per-product answer size.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        cache_type: str,
+        select_candidates: Callable[[VendorProductState], List[str]],
+        has_reference_data: Callable[[], bool],
+        list_title: str,
+        system_prompt: str,
+        task: str,
+        output_example: str,
+        parse_entry: Callable[[Dict[str, Any]], Any]
+    ):
+        self.name = name
+        self.model = model
+        self.cache_type = cache_type
+        self.select_candidates = select_candidates
+        self.has_reference_data = has_reference_data
+        self.list_title = list_title
+        self.system_prompt = system_prompt
+        self.task = task
+        self.output_example = output_example
+        self.parse_entry = parse_entry
+    
+    def _cache_key(self, state: VendorProductState) -> Dict[str, Any]:
+        return {
+            "type": self.cache_type,
+            "software_type": state.get("software_type", "N/A"),
+            "product_name": state["product_name"]
+        }
+    
+    def max_pack_size(self) -> int:
+        """Products whose answers fit in one response at the model's output ceiling"""
+        config = get_llm_manager().model_configs[self.model]
+        return max(1, config["max_tokens"] // PROMPT_MAX_TOKENS[self.cache_type])
+    
+    async def pending(self, states: List[VendorProductState]) -> List[VendorProductState]:
+        """
+        States whose result is not cached yet
+        
+        None when the stage has no reference data, since the single-row node
+        then answers N/A without calling the LLM.
+        """
+        if not self.has_reference_data():
+            return []
+        cache = get_cache_manager()
+        return [state for state in states if await cache.get_async(**self._cache_key(state)) is None]
+    
+    def group(self, states: List[VendorProductState], max_size: int) -> List[List[VendorProductState]]:
+        """Group states into packs that share a merged candidate list, at most max_pack_size() each"""
+        candidate_lists = [self.select_candidates(state) for state in states]
+        max_size = min(max_size, self.max_pack_size())
+        return [[states[i] for i in group] for group in group_by_candidates(candidate_lists, max_size)]
+    
+    def build_prompt(self, states: List[VendorProductState]) -> str:
+        """Prompt listing the merged candidates once and every product by row_id"""
+        candidates = list(dict.fromkeys(
+            candidate for state in states for candidate in self.select_candidates(state)
+        ))
+        candidates_text = "\n".join(f"{i}. {candidate}" for i, candidate in enumerate(candidates, 1))
+        products = [
+            {
+                "row_id": str(row_id),
+                "product_name": state["product_name"],
+                "product_type": state.get("software_type", "N/A")
+            }
+            for row_id, state in enumerate(states, 1)
+        ]
+        
+        return f"""{self.list_title} (choose from this list):
+{candidates_text}
+
+Products:
+{json.dumps(products, indent=2)}
+
+Task: {self.task}
+
+Return ONLY a JSON array with one object per product, keyed by its row_id (copy names EXACTLY from the numbered list above):
+{self.output_example}"""
+
+    async def run_pack(self, states: List[VendorProductState]) -> List[VendorProductState]:
+        """
+        Classify a pack of products in one request and cache each result
+        
+        A pack larger than max_pack_size() is split and its parts run
+        concurrently.
+        
+        Returns:
+            States that got no valid result and need single-row dispatch
+        """
+        if len(states) == 1:
+            return states
+        
+        pack_size = self.max_pack_size()
+        if len(states) > pack_size:
+            parts = [states[i:i + pack_size] for i in range(0, len(states), pack_size)]
+            missed = await asyncio.gather(*(self.run_pack(part) for part in parts))
+            return [state for part in missed for state in part]
+        
+        llm = get_llm_manager()
+        cache = get_cache_manager()
+        by_row_id = {str(row_id): state for row_id, state in enumerate(states, 1)}
+        
+        try:
+            response = await llm.call_async(
+                self.build_prompt(states),
+                system_prompt=self.system_prompt,
+                model=self.model,
+                max_tokens=PROMPT_MAX_TOKENS[self.cache_type] * len(states),
+                stage=self.name
+            )
+            entries = json.loads(extract_json_from_response(response)) if response else []
+            if not isinstance(entries, list):
+                raise ValueError("expected a JSON array")
+        except Exception as e:
+            logger.warning(f"Packed {self.name} request for {len(states)} rows failed: {e}")
+            return states
+        
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            state = by_row_id.pop(str(entry.get("row_id")), None)
+            if state is None:
+                continue
+            try:
+                cache.set(self.parse_entry(entry), ttl_seconds=24 * 3600, **self._cache_key(state))
+            except Exception as e:
+                logger.debug(f"Invalid packed {self.name} entry {entry}: {e}")
+                by_row_id[str(entry.get("row_id"))] = state
+        
+        if by_row_id:
+            logger.info(f"Packed {self.name} request missed {len(by_row_id)}/{len(states)} rows, re-dispatching singly")
+        return list(by_row_id.values())
+
+
+def _parse_taxonomy_entry(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return validate_taxonomy_matches([entry["match_1"], entry["match_2"]])
+
+
+def _parse_attribute_entry(entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    attributes = entry["attributes"]
+    if not isinstance(attributes, list):
+        raise ValueError("attributes must be a list")
+    return validate_attribute_matches((attributes + ["N/A"] * 3)[:3])
+
+
+TAXONOMY_STAGE = PackedStage(
+    name="taxonomy",
+    model="sonnet",
+    cache_type="taxonomy_match",
+    select_candidates=lambda state: select_taxonomy_candidates(state, get_taxonomy_list()),
+    has_reference_data=lambda: bool(get_taxonomy_list()),
+    list_title="Available Taxonomy Categories",
+    system_prompt="""You are a taxonomy classification expert. You match products to the most relevant taxonomy categories from a provided list.
+
+CRITICAL RULES:
+1. You MUST return the EXACT taxonomy text from the numbered list - copy it character-for-character
+2. Do NOT paraphrase, shorten, or modify the taxonomy names
+3. Do NOT make up new taxonomy names
+4. If unsure, pick the closest match from the list""",
+    task="For EACH product, select the 2 most relevant taxonomy categories.",
+    output_example="""[
+    {"row_id": "1", "match_1": "EXACT taxonomy from list", "match_2": "EXACT taxonomy from list"}
+]""",
+    parse_entry=_parse_taxonomy_entry
+)
+
+ATTRIBUTE_STAGE = PackedStage(
+    name="attributes",
+    model="haiku",
+    cache_type="attribute_match",
+    select_candidates=select_attribute_candidates,
+    has_reference_data=lambda: bool(get_product_attributes_list()),
+    list_title="Available Product Attributes",
+    system_prompt="""You are matching products to attributes.
+
+CRITICAL: You MUST return ONLY the EXACT attribute names from the list. Do not paraphrase or modify them.""",
+    task="For EACH product, identify the top 3 most relevant attributes.",
+    output_example="""[
+    {"row_id": "1", "attributes": ["exact attribute from list", "exact attribute from list", "exact attribute from list"]}
+]""",
+    parse_entry=_parse_attribute_entry
+)
+
+PACKED_STAGES = (TAXONOMY_STAGE, ATTRIBUTE_STAGE)
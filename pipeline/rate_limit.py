@@ -0,0 +1,197 @@
+"""
+Per-model request and token rate limiting for LLM calls
+Token buckets keep each model within its requests-per-minute (RPM) and
+tokens-per-minute (TPM) budget, so calls are paced instead of throttled
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token for English text)"""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations instead of blocking
+    
+    reserve() takes the amount immediately, letting the level go negative,
+    and returns how long the caller must wait before the level is back at
+    zero. Later callers queue behind earlier reservations, so waiting is
+    first come first served without a waiter list, and the bucket works
+    from any thread or event loop.
+    """
+    
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 10.0):
+        """
+        Args:
+            rate_per_minute: Sustained budget per minute
+            burst_seconds: Capacity expressed as seconds of budget
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def reserve(self, amount: float) -> float:
+        """
+        Take amount from the bucket
+        
+        Returns:
+            Seconds to wait before using the reservation
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level -= amount
+            return max(0.0, -self._level / self.rate)
+    
+    def adjust(self, amount: float):
+        """Correct an earlier reservation once the real amount is known (may be negative)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level -= amount
+    
+    @property
+    def level(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._level
+
+
+class ModelRateLimiter:
+    """
+    RPM and TPM budget for one model
+    
+    Each call reserves one request and its estimated input tokens before it
+    is sent. When the response arrives, the TPM bucket is corrected by the
+    actual input tokens and charged the output tokens from the usage block.
+    A failed attempt hands its tokens back; its request still counts.
+    """
+    
+    def __init__(
+        self,
+        model: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        burst_seconds: float = 10.0
+    ):
+        """
+        Args:
+            model: Model name, for logging
+            requests_per_minute: RPM budget (None = unlimited)
+            tokens_per_minute: TPM budget, input plus output (None = unlimited)
+            burst_seconds: Bucket capacity expressed as seconds of budget
+        """
+        self.model = model
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.requests = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        self.waits = 0
+        self.wait_seconds = 0.0
+    
+    async def acquire(self, estimated_input_tokens: int, timeout: Optional[float] = None) -> Tuple[float, float]:
+        """
+        Wait until the call fits the budget
+        
+        A call larger than the TPM bucket reserves a full bucket, not its
+        estimate; the returned amount is what record_usage() or refund()
+        must later correct.
+        
+        Args:
+            estimated_input_tokens: Input tokens to reserve
+            timeout: Longest acceptable wait (None = wait as long as needed)
+        
+        Returns:
+            (seconds waited, tokens reserved)
+        
+        Raises:
+            asyncio.TimeoutError: The wait would exceed timeout; nothing is reserved
+        """
+        # A single call larger than the bucket waits for a full bucket
+        reserved_tokens = min(estimated_input_tokens, self.tokens.capacity) if self.tokens is not None else 0
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(reserved_tokens))
+        
+        if timeout is not None and delay > timeout:
+            # Hand the reservation back so calls queued behind it are not delayed
+            if self.requests is not None:
+                self.requests.adjust(-1)
+            if self.tokens is not None:
+                self.tokens.adjust(-reserved_tokens)
+            raise asyncio.TimeoutError(f"Rate limit wait of {delay:.2f}s for {self.model} exceeds {timeout:.2f}s")
+        
+        if delay > 0:
+            self.waits += 1
+            self.wait_seconds += delay
+            logger.debug(f"Rate limit for {self.model}: waiting {delay:.2f}s")
+            await asyncio.sleep(delay)
+        return delay, reserved_tokens
+    
+    def record_usage(self, reserved_tokens: float, input_tokens: int, output_tokens: int):
+        """
+        Charge the actual usage of a completed call
+        
+        Args:
+            reserved_tokens: Tokens returned by acquire()
+            input_tokens: Input tokens from the usage block (0 = unknown, keep the reservation)
+            output_tokens: Output tokens from the usage block
+        """
+        if self.tokens is not None:
+            actual_input = input_tokens or reserved_tokens
+            self.tokens.adjust(actual_input - reserved_tokens + output_tokens)
+    
+    def refund(self, reserved_tokens: float):
+        """Hand back the tokens reserved by acquire() for an attempt that failed"""
+        if self.tokens is not None:
+            self.tokens.adjust(-reserved_tokens)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get budget and wait statistics"""
+        return {
+            "rpm": self.requests_per_minute,
+            "tpm": self.tokens_per_minute,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "tokens_available": round(self.tokens.level) if self.tokens is not None else None
+        }
+
+
+def rate_limits_from_env(models) -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    Read per-model budgets from LLM_RPM_<MODEL> and LLM_TPM_<MODEL>
+    
+    Budgets describe the whole account and are divided by LLM_WORKERS, the
+    number of processes sharing it. Unset or 0 means unlimited.
+    
+    Args:
+        models: Model names, e.g. ("sonnet", "haiku")
+    
+    Returns:
+        {"sonnet": {"requests_per_minute": ..., "tokens_per_minute": ...}, ...}
+    """
+    workers = max(1, int(os.getenv("LLM_WORKERS", "1")))
+    limits = {}
+    for model in models:
+        rpm = float(os.getenv(f"LLM_RPM_{model.upper()}", "0"))
+        tpm = float(os.getenv(f"LLM_TPM_{model.upper()}", "0"))
+        limits[model] = {
+            "requests_per_minute": rpm / workers if rpm > 0 else None,
+            "tokens_per_minute": tpm / workers if tpm > 0 else None
+        }
+    return limits
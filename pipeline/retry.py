@@ -0,0 +1,197 @@
+"""
+Retry policy for LLM calls
+Classifies errors, spaces retries with jittered backoff, bounds each call by a
+deadline and caps retries with a budget so a brownout is not amplified
+"""
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from botocore.exceptions import (
+    ClientError,
+    ConnectTimeoutError,
+    ReadTimeoutError,
+    EndpointConnectionError,
+    ConnectionClosedError
+)
+
+from .concurrency import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# Error classes
+THROTTLED = "throttled"
+RETRYABLE = "retryable"
+FATAL = "fatal"
+
+# Error codes Bedrock returns when the account's quota is exhausted
+THROTTLING_ERROR_CODES = frozenset({"ThrottlingException", "TooManyRequestsException"})
+
+# Transient service-side errors
+RETRYABLE_ERROR_CODES = frozenset({
+    "InternalServerException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "ModelStreamErrorException"
+})
+
+# Transport errors where the request may succeed on another attempt
+RETRYABLE_EXCEPTIONS = (
+    ConnectTimeoutError,
+    ReadTimeoutError,
+    EndpointConnectionError,
+    ConnectionClosedError,
+    asyncio.TimeoutError
+)
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    Classify an invoke_model error
+    
+    Returns:
+        THROTTLED, RETRYABLE (5xx, timeouts, dropped connections) or FATAL
+        (validation, access denied, unknown model, anything unrecognised)
+    """
+    if isinstance(error, ClientError):
+        code = error.response.get("Error", {}).get("Code") or ""
+        # Errors inside an event stream use camelCase ("throttlingException")
+        code = code[:1].upper() + code[1:]
+        status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        if code in THROTTLING_ERROR_CODES or status == 429:
+            return THROTTLED
+        if code in RETRYABLE_ERROR_CODES or status >= 500:
+            return RETRYABLE
+        return FATAL
+    if isinstance(error, RETRYABLE_EXCEPTIONS):
+        return RETRYABLE
+    return FATAL
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """Whether an invoke_model error is a throttling response"""
+    return classify_error(error) == THROTTLED
+
+
+class RetryBudget:
+    """
+    Caps retries to a fraction of calls
+    
+    Every call deposits ratio tokens and every retry withdraws one, up to
+    max_tokens banked. While Bedrock is healthy the budget stays full; during
+    a brownout retries stop once they exceed ~ratio of the traffic instead of
+    multiplying it by the attempt count.
+    """
+    
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 20.0):
+        """
+        Args:
+            ratio: Retries allowed per call in steady state
+            max_tokens: Retries that can be banked for bursts
+        """
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+        self.exhausted = 0
+    
+    def deposit(self):
+        """Credit one call"""
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+    
+    def try_withdraw(self) -> bool:
+        """Take one retry from the budget; False if none is left"""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.exhausted += 1
+            return False
+    
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+
+class RetryPolicy:
+    """
+    When and how long to wait before retrying a failed call
+    
+    A retry happens only if the error is retryable, attempts remain, the
+    retry budget allows it and the backoff still ends before the call's
+    deadline.
+    """
+    
+    def __init__(
+        self,
+        max_retries: int = 4,
+        backoff_base_seconds: float = 0.5,
+        backoff_cap_seconds: float = 20.0,
+        deadline_seconds: Optional[float] = 120.0,
+        budget: Optional[RetryBudget] = None
+    ):
+        """
+        Args:
+            max_retries: Retries after the first attempt
+            backoff_base_seconds: Delay ceiling of the first retry
+            backoff_cap_seconds: Maximum delay ceiling
+            deadline_seconds: Total time allowed per call, attempts and
+                backoff included (None = no deadline)
+            budget: Shared retry budget (None = unlimited)
+        """
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_cap_seconds = backoff_cap_seconds
+        self.deadline_seconds = deadline_seconds
+        self.budget = budget
+    
+    def deadline(self) -> Optional[float]:
+        """Monotonic deadline for a call starting now"""
+        if self.deadline_seconds is None:
+            return None
+        return time.monotonic() + self.deadline_seconds
+    
+    @staticmethod
+    def remaining(deadline: Optional[float]) -> Optional[float]:
+        """Seconds left before deadline (None = no deadline)"""
+        if deadline is None:
+            return None
+        return deadline - time.monotonic()
+    
+    def next_delay(self, attempt: int, error_class: str, deadline: Optional[float]) -> Optional[float]:
+        """
+        Decide whether to retry
+        
+        Args:
+            attempt: Attempt that just failed, starting at 0
+            error_class: Result of classify_error
+            deadline: Deadline of the call
+        
+        Returns:
+            Seconds to wait before the next attempt, or None to give up
+        """
+        if error_class == FATAL or attempt >= self.max_retries:
+            return None
+        
+        delay = backoff_delay(attempt, self.backoff_base_seconds, self.backoff_cap_seconds)
+        remaining = self.remaining(deadline)
+        if remaining is not None and delay >= remaining:
+            return None
+        
+        if self.budget is not None and not self.budget.try_withdraw():
+            logger.debug("Retry budget exhausted, not retrying")
+            return None
+        return delay
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get retry policy settings and budget state"""
+        return {
+            "max_retries": self.max_retries,
+            "deadline_seconds": self.deadline_seconds,
+            "budget_tokens": round(self.budget.tokens, 2) if self.budget is not None else None,
+            "budget_exhausted": self.budget.exhausted if self.budget is not None else 0
+        }
@@ -0,0 +1,89 @@
+"""
+Single-flight request coalescing
+Concurrent callers asking for the same key share one in-flight execution
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class _LeaderCancelled(Exception):
+    """Set on a shared future when its leader is cancelled, so waiters retry"""
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls
+    
+    The first caller for a key runs the work; callers arriving while it is in
+    flight await the same future instead of repeating the work. Once the call
+    finishes the key is released, so later callers start fresh (normally by
+    hitting whatever cache the first call populated).
+    
+    Cancelling the leader cancels only the leader: one waiting caller takes
+    over and runs its own fn, and the others wait on that run instead.
+    """
+    
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.leader_count = 0
+        self.coalesced_count = 0
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn once per key among concurrent callers
+        
+        Args:
+            key: Deduplication key
+            fn: Coroutine function doing the actual work
+            
+        Returns:
+            Result of fn (shared by all coalesced callers)
+        """
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            future = self._in_flight.get(key)
+            # Futures can only be awaited on their own loop
+            if future is None or future.get_loop() is not loop:
+                break
+            
+            self.coalesced_count += 1
+            logger.debug(f"Coalesced call: {key[:16]}...")
+            try:
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                logger.debug(f"Leader cancelled, retrying: {key[:16]}...")
+        
+        future = loop.create_future()
+        self._in_flight[key] = future
+        self.leader_count += 1
+        
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # Waiters did not cancel anything; wake them to retry
+            future.set_exception(_LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited future doesn't log a warning
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+    
+    def get_stats(self) -> Dict[str, int]:
+        """Get coalescing statistics"""
+        return {
+            "in_flight": len(self._in_flight),
+            "leaders": self.leader_count,
+            "coalesced": self.coalesced_count
+        }
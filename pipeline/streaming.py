@@ -0,0 +1,170 @@
+"""
+Streaming output for batch enrichment
+Encodes enriched rows into CSV or NDJSON chunks as soon as they finish
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import math
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from .orchestrator import stream_dataframe_batch, get_output_columns
+from .metrics import get_pipeline_metrics
+from .bedrock_client import close_loop_clients
+
+logger = logging.getLogger(__name__)
+
+STREAM_FORMATS = ("csv", "ndjson")
+
+
+def _clean_value(value: Any) -> Any:
+    """Replace pandas NaN with None so rows serialize as valid JSON"""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def parse_flag(value: Any, default: bool = False) -> bool:
+    """Read a boolean payload field that may arrive as a bool, number or string"""
+    if value is None:
+        return default
+    return str(value).strip().lower() in ("1", "true", "yes")
+
+
+class ChunkEncoder:
+    """
+    Encode result rows into CSV or NDJSON text chunks
+    
+    The CSV header is the fixed output schema, emitted once in the first
+    chunk, so it does not depend on which row finishes first (an error row
+    carries only a few keys).
+    """
+    
+    def __init__(self, output_format: str = "csv", fieldnames: Optional[List[str]] = None):
+        """
+        Args:
+            output_format: "csv" or "ndjson"
+            fieldnames: CSV columns (default: get_output_columns())
+        """
+        if output_format not in STREAM_FORMATS:
+            raise ValueError(f"Unsupported stream format '{output_format}', expected one of {STREAM_FORMATS}")
+        self.output_format = output_format
+        self._fieldnames = list(fieldnames) if fieldnames is not None else get_output_columns()
+        self._header_written = False
+    
+    def encode(self, rows: List[Dict[str, Any]]) -> str:
+        """Encode a chunk of rows"""
+        if self.output_format == "ndjson":
+            return "".join(
+                json.dumps({k: _clean_value(v) for k, v in row.items()}, default=str) + "\n"
+                for row in rows
+            )
+        
+        buffer = io.StringIO()
+        writer = csv.DictWriter(
+            buffer,
+            fieldnames=self._fieldnames,
+            extrasaction="ignore",
+            restval="",
+            lineterminator="\n"
+        )
+        if not self._header_written:
+            writer.writeheader()
+            self._header_written = True
+        writer.writerows(rows)
+        return buffer.getvalue()
+
+
+async def stream_output_chunks(
+    df: pd.DataFrame,
+    max_concurrent_rows: int = 20,
+    output_format: str = "csv",
+    chunk_size: int = 1,
+    ordered: bool = True
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream enriched rows as encoded chunk events
+    
+    Args:
+        df: Input DataFrame
+        max_concurrent_rows: Maximum number of rows to process simultaneously
+        output_format: "csv" or "ndjson"
+        chunk_size: Number of rows per chunk
+        ordered: Emit rows in input order instead of completion order
+        
+    Yields:
+        {"type": "chunk", ...} events followed by one {"type": "summary", ...}
+        event whose status is "success", "partial" (some rows failed) or
+        "error" (every row failed)
+    """
+    encoder = ChunkEncoder(output_format)
+    chunk_size = max(1, chunk_size)
+    
+    chunk: List[Dict[str, Any]] = []
+    chunk_index = 0
+    rows_processed = 0
+    error_rows = 0
+    
+    async for row in stream_dataframe_batch(df, max_concurrent_rows, ordered=ordered):
+        chunk.append(row)
+        rows_processed += 1
+        if row.get("error"):
+            error_rows += 1
+        if len(chunk) >= chunk_size:
+            yield {
+                "type": "chunk",
+                "format": output_format,
+                "chunk_index": chunk_index,
+                "rows": len(chunk),
+                "data": encoder.encode(chunk)
+            }
+            chunk_index += 1
+            chunk = []
+    
+    if chunk:
+        yield {
+            "type": "chunk",
+            "format": output_format,
+            "chunk_index": chunk_index,
+            "rows": len(chunk),
+            "data": encoder.encode(chunk)
+        }
+    
+    if error_rows == 0:
+        status = "success"
+    elif error_rows < rows_processed:
+        status = "partial"
+    else:
+        status = "error"
+    
+    yield {
+        "type": "summary",
+        "rows_processed": rows_processed,
+        "error_rows": error_rows,
+        "usage": get_pipeline_metrics().get_usage(),
+        "status": status
+    }
+
+
+def iterate_sync(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """
+    Drive an async generator from synchronous code on a private event loop
+    
+    Used by the sync entrypoints so the runtime can stream each item as soon
+    as it is produced.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.run_until_complete(close_loop_clients())
+        loop.close()
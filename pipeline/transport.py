@@ -0,0 +1,386 @@
+"""
+Transports that send InvokeModel requests to Bedrock
+ThreadPoolTransport runs the blocking boto3 client on worker threads;
+AsyncHTTPTransport signs requests with SigV4 and sends them over httpx on the
+event loop, so an in-flight call costs a socket instead of a thread.
+Both also stream (InvokeModelWithResponseStream), yielding the model's
+stream events as dicts and stopping when the consumer stops iterating
+"""
+import json
+import base64
+import socket
+import asyncio
+import logging
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import quote
+
+import boto3
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+from botocore.eventstream import EventStreamBuffer
+from botocore.exceptions import (
+    ClientError,
+    ConnectTimeoutError,
+    ReadTimeoutError,
+    EndpointConnectionError,
+    ConnectionClosedError
+)
+
+from .concurrency import InstrumentedExecutor
+from .metrics import get_pipeline_metrics
+
+logger = logging.getLogger(__name__)
+
+TRANSPORTS = ("threads", "async")
+
+
+class ThreadPoolTransport:
+    """
+    boto3 invoke_model on a dedicated thread pool
+    
+    The pool and the botocore connection pool are both sized to the
+    concurrency ceiling, so calls neither churn connections nor queue behind
+    unrelated executor work.
+    """
+    
+    def __init__(
+        self,
+        region_name: str,
+        pool_connections: int,
+        connect_timeout_seconds: float,
+        read_timeout_seconds: float,
+        endpoint_url: Optional[str] = None
+    ):
+        self.pool_connections = pool_connections
+        # Retries happen in BedrockLLMManager, where the limiter and retry budget can see them
+        self.client = boto3.client(
+            service_name="bedrock-runtime",
+            region_name=region_name,
+            endpoint_url=endpoint_url,
+            config=Config(
+                max_pool_connections=pool_connections,
+                tcp_keepalive=True,
+                connect_timeout=connect_timeout_seconds,
+                read_timeout=read_timeout_seconds,
+                retries={"mode": "standard", "max_attempts": 1}
+            )
+        )
+        self.executor = InstrumentedExecutor(max_workers=pool_connections, thread_name_prefix="bedrock")
+    
+    async def invoke(self, model_id: str, body: str) -> bytes:
+        """Send one InvokeModel request and return the raw response body"""
+        loop = asyncio.get_running_loop()
+        # The body is read on the worker thread too
+        request = loop.run_in_executor(
+            self.executor,
+            lambda: self.client.invoke_model(
+                modelId=model_id,
+                contentType="application/json",
+                accept="application/json",
+                body=body,
+            )["body"].read()
+        )
+        get_pipeline_metrics().record_executor_load(self.executor.running, self.executor.queued)
+        return await request
+    
+    async def invoke_stream(self, model_id: str, body: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Send one InvokeModelWithResponseStream request and yield its events
+        
+        A worker thread reads the event stream and hands events to the loop.
+        When the consumer stops early, the thread closes the stream at the
+        next event, which drops the connection instead of reading the rest.
+        """
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        
+        def post(kind: str, item: Any):
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, (kind, item))
+            except RuntimeError:
+                # The loop is gone; nobody is listening
+                stop.set()
+        
+        def pump():
+            try:
+                stream = self.client.invoke_model_with_response_stream(
+                    modelId=model_id,
+                    contentType="application/json",
+                    accept="application/json",
+                    body=body,
+                )["body"]
+                try:
+                    for event in stream:
+                        if stop.is_set():
+                            break
+                        chunk = event.get("chunk")
+                        if chunk:
+                            post("event", json.loads(chunk["bytes"]))
+                finally:
+                    stream.close()
+                post("end", None)
+            except Exception as e:
+                post("error", e)
+        
+        loop.run_in_executor(self.executor, pump)
+        get_pipeline_metrics().record_executor_load(self.executor.running, self.executor.queued)
+        try:
+            while True:
+                kind, item = await events.get()
+                if kind == "event":
+                    yield item
+                elif kind == "error":
+                    raise item
+                else:
+                    return
+        finally:
+            stop.set()
+    
+    async def aclose(self):
+        """Nothing is bound to the event loop; the pool outlives it"""
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get connection pool saturation and executor queue depth"""
+        stats = self.executor.get_stats()
+        stats["transport"] = "threads"
+        stats["pool_connections"] = self.pool_connections
+        stats["pool_saturation"] = round(stats["running"] / self.pool_connections, 3)
+        stats["peak_pool_saturation"] = round(stats["peak_running"] / self.pool_connections, 3)
+        return stats
+
+
+class AsyncHTTPTransport:
+    """
+    InvokeModel over httpx with SigV4 signing on the event loop
+    
+    Errors are translated to the botocore exceptions the boto3 client would
+    raise, so retry classification does not depend on the transport. httpx
+    connection pools belong to one event loop, so clients are kept per loop.
+    
+    httpcore scans every pooled connection for every queued request, which
+    serialises a large pool; connections are therefore spread over several
+    small clients used round-robin.
+    """
+    
+    CONNECTIONS_PER_CLIENT = 8
+    
+    def __init__(
+        self,
+        region_name: str,
+        pool_connections: int,
+        connect_timeout_seconds: float,
+        read_timeout_seconds: float,
+        endpoint_url: Optional[str] = None
+    ):
+        import httpx
+        
+        self._httpx = httpx
+        self.region_name = region_name
+        self.pool_connections = pool_connections
+        self.endpoint_url = (endpoint_url or f"https://bedrock-runtime.{region_name}.amazonaws.com").rstrip("/")
+        self._credentials = boto3.Session().get_credentials()
+        if self._credentials is None:
+            raise RuntimeError("No AWS credentials found for the async Bedrock transport")
+        
+        shards = -(-pool_connections // self.CONNECTIONS_PER_CLIENT)
+        per_client = -(-pool_connections // shards)
+        self._shards = shards
+        self._limits = httpx.Limits(
+            max_connections=per_client,
+            max_keepalive_connections=per_client
+        )
+        self._timeout = httpx.Timeout(
+            connect=connect_timeout_seconds,
+            read=read_timeout_seconds,
+            write=read_timeout_seconds,
+            pool=None
+        )
+        # Headers and body go out as separate writes; without TCP_NODELAY the
+        # body waits for the server's delayed ACK on reused connections
+        self._socket_options = [
+            (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        ]
+        # One TLS context (CA bundle load) shared by every client
+        self._ssl_context = httpx.create_ssl_context()
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, List[Any]]" = weakref.WeakKeyDictionary()
+        self._next_client = 0
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+    
+    def _client(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._clients.get(loop)
+            if clients is None:
+                clients = [
+                    self._httpx.AsyncClient(
+                        transport=self._httpx.AsyncHTTPTransport(
+                            verify=self._ssl_context,
+                            limits=self._limits,
+                            socket_options=self._socket_options
+                        ),
+                        timeout=self._timeout
+                    )
+                    for _ in range(self._shards)
+                ]
+                self._clients[loop] = clients
+            self._next_client = (self._next_client + 1) % self._shards
+            return clients[self._next_client]
+    
+    def _sign(self, url: str, body: str, headers: Dict[str, str]) -> Dict[str, str]:
+        request = AWSRequest(
+            method="POST",
+            url=url,
+            data=body.encode("utf-8"),
+            headers={"Content-Type": "application/json", **headers}
+        )
+        # Frozen per request; refreshable credentials rotate underneath
+        SigV4Auth(self._credentials.get_frozen_credentials(), "bedrock", self.region_name).add_auth(request)
+        return dict(request.headers.items())
+    
+    @asynccontextmanager
+    async def _post(self, url: str, body: str, headers: Dict[str, str]):
+        """Signed streaming POST; error statuses and httpx errors become botocore errors"""
+        httpx = self._httpx
+        signed = self._sign(url, body, headers)
+        
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            async with self._client().stream("POST", url, content=body.encode("utf-8"), headers=signed) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    raise _client_error(response)
+                yield response
+        except httpx.ConnectTimeout as e:
+            raise ConnectTimeoutError(endpoint_url=url, error=e)
+        except httpx.TimeoutException as e:
+            raise ReadTimeoutError(endpoint_url=url, error=e)
+        except httpx.ConnectError as e:
+            raise EndpointConnectionError(endpoint_url=url, error=e)
+        except httpx.TransportError as e:
+            raise ConnectionClosedError(endpoint_url=url, error=e)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+    
+    def _model_url(self, model_id: str, action: str) -> str:
+        return f"{self.endpoint_url}/model/{quote(model_id, safe='')}/{action}"
+    
+    async def invoke(self, model_id: str, body: str) -> bytes:
+        """Send one InvokeModel request and return the raw response body"""
+        async with self._post(self._model_url(model_id, "invoke"), body, {"Accept": "application/json"}) as response:
+            return await response.aread()
+    
+    async def invoke_stream(self, model_id: str, body: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Send one InvokeModelWithResponseStream request and yield its events
+        
+        Leaving the iteration early closes the response, dropping the
+        connection instead of reading the rest of the stream.
+        """
+        url = self._model_url(model_id, "invoke-with-response-stream")
+        async with self._post(url, body, {"X-Amzn-Bedrock-Accept": "application/json"}) as response:
+            buffer = EventStreamBuffer()
+            async for data in response.aiter_raw():
+                buffer.add_data(data)
+                for message in buffer:
+                    if message.headers.get(":message-type") != "event":
+                        raise _event_stream_error(message)
+                    payload = json.loads(message.payload)
+                    if "bytes" in payload:
+                        yield json.loads(base64.b64decode(payload["bytes"]))
+    
+    async def aclose(self):
+        """
+        Close the clients of the running event loop
+        
+        Call before the loop shuts down; their connections cannot be used
+        from another loop. A later call on this loop opens new clients.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._clients.pop(loop, [])
+        for client in clients:
+            await client.aclose()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get connection pool saturation"""
+        with self._lock:
+            return {
+                "transport": "async",
+                "running": self.in_flight,
+                "peak_running": self.peak_in_flight,
+                "completed": self.completed,
+                "pool_connections": self.pool_connections,
+                "pool_saturation": round(self.in_flight / self.pool_connections, 3),
+                "peak_pool_saturation": round(self.peak_in_flight / self.pool_connections, 3)
+            }
+
+
+def _client_error(response) -> ClientError:
+    """Build the ClientError botocore would raise for an error response"""
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {}
+    code = response.headers.get("x-amzn-ErrorType", payload.get("__type", "")).split(":")[0].split("#")[-1]
+    message = payload.get("message", payload.get("Message", response.text[:200]))
+    return ClientError(
+        {
+            "Error": {"Code": code or str(response.status_code), "Message": message},
+            "ResponseMetadata": {"HTTPStatusCode": response.status_code}
+        },
+        "InvokeModel"
+    )
+
+
+def _event_stream_error(message) -> ClientError:
+    """Build the ClientError for an exception message inside an event stream"""
+    code = message.headers.get(":exception-type") or message.headers.get(":error-code") or "EventStreamError"
+    try:
+        text = json.loads(message.payload).get("message", "")
+    except ValueError:
+        text = message.payload.decode("utf-8", "replace")
+    return ClientError({"Error": {"Code": code, "Message": text}}, "InvokeModelWithResponseStream")
+
+
+def create_transport(
+    kind: str,
+    region_name: str,
+    pool_connections: int,
+    connect_timeout_seconds: float,
+    read_timeout_seconds: float,
+    endpoint_url: Optional[str] = None
+):
+    """
+    Create a transport by name
+    
+    Args:
+        kind: "threads" (boto3 on a thread pool) or "async" (httpx + SigV4)
+        region_name: AWS region
+        pool_connections: HTTP connections (and threads) to keep
+        connect_timeout_seconds: Connection timeout
+        read_timeout_seconds: Read timeout
+        endpoint_url: Override the Bedrock runtime endpoint (e.g. a mock)
+    """
+    if kind not in TRANSPORTS:
+        raise ValueError(f"Unknown LLM transport {kind!r}, expected one of {TRANSPORTS}")
+    transport_class = AsyncHTTPTransport if kind == "async" else ThreadPoolTransport
+    return transport_class(
+        region_name,
+        pool_connections,
+        connect_timeout_seconds,
+        read_timeout_seconds,
+        endpoint_url
+    )
@@ -0,0 +1,942 @@
+"""
+Component checks for the pipeline building blocks (no Bedrock needed)
+Run directly with `python test_components.py`, or through pytest
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+
+os.environ.setdefault('DATA_DIR', os.path.join(os.path.dirname(__file__), 'data'))
+
+import contextlib
+import csv
+import io
+import json
+import re
+
+
+# =============================================================================
+# Fakes
+# =============================================================================
+
+def fake_response(prompt: str) -> str:
+    """A valid JSON answer to any pipeline prompt, picking the first listed candidates"""
+    if "Extract vendor information" in prompt:
+        return json.dumps({"Legal_Vendor_Name": "Acme Inc", "Founded_Year": "1999"})
+    if "Analyze this product" in prompt:
+        return json.dumps({"Type_of_Product": "CRM Software", "Product_features": "Contacts, Pipelines"})
+    
+    listed = prompt[prompt.find("Available"):]
+    candidates = re.findall(r"^\d+\. (.+)$", listed, flags=re.MULTILINE)
+    if "Products:" in prompt:
+        products = json.loads(prompt.split("Products:\n", 1)[1].split("\n\nTask:", 1)[0])
+        if "Available Product Attributes" in prompt:
+            return json.dumps([{"row_id": p["row_id"], "attributes": candidates[:3]} for p in products])
+        return json.dumps([{"row_id": p["row_id"], "match_1": candidates[0], "match_2": candidates[1]} for p in products])
+    if "Top_Attribute_1" in prompt:
+        return json.dumps({f"Top_Attribute_{i}": {"Attribute Name": name} for i, name in enumerate(candidates[:3], 1)})
+    return json.dumps({"match_1": candidates[0], "match_2": candidates[1]})
+
+
+class FakeTransport:
+    """Bedrock transport double that answers from respond(prompt) and records every request"""
+    
+    def __init__(self, respond=fake_response, usage=None):
+        self.respond = respond
+        self.usage = usage or {"input_tokens": 1000, "output_tokens": 100}
+        self.requests = []
+        self.closed_loops = []
+    
+    def prompts(self, marker: str = ""):
+        return [text for text in (r["messages"][0]["content"][0]["text"] for r in self.requests) if marker in text]
+    
+    async def invoke(self, model_id: str, body: str) -> bytes:
+        import asyncio
+        payload = json.loads(body)
+        self.requests.append(payload)
+        await asyncio.sleep(0)
+        text = self.respond(payload["messages"][0]["content"][0]["text"])
+        return json.dumps({"content": [{"text": text}], "usage": self.usage}).encode()
+    
+    async def aclose(self):
+        import asyncio
+        self.closed_loops.append(asyncio.get_running_loop())
+    
+    def get_stats(self):
+        return {"transport": "fake"}
+
+
+@contextlib.contextmanager
+def fake_bedrock(respond=fake_response, usage=None, **manager_args):
+    """Serve get_llm_manager() from a manager on a FakeTransport, with an empty CacheManager"""
+    import pipeline.bedrock_client as bedrock_client
+    import pipeline.cache_manager as cache_manager
+    
+    manager = bedrock_client.BedrockLLMManager(**manager_args)
+    manager.transport = FakeTransport(respond, usage)
+    saved = bedrock_client._llm_manager, cache_manager._cache_manager
+    bedrock_client._llm_manager, cache_manager._cache_manager = manager, cache_manager.CacheManager()
+    try:
+        yield manager.transport
+    finally:
+        bedrock_client._llm_manager, cache_manager._cache_manager = saved
+
+
+@contextlib.contextmanager
+def reference_attributes(attributes, counts=None):
+    """Serve the product attribute accessors from the given sorted list and counts"""
+    import config.reference as reference
+    
+    reference._ensure_loaded("products")
+    names = (
+        "_product_attributes", "_product_attribute_set", "_attribute_normalized_lookup",
+        "_product_attribute_counts", "_attributes_by_popularity", "_attribute_index", "_attribute_resolver"
+    )
+    saved = {name: getattr(reference, name) for name in names}
+    reference._set_product_attributes(attributes, counts)
+    reference._attribute_index = reference._attribute_resolver = None
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(reference, name, value)
+
+
+# =============================================================================
+# Pipeline
+# =============================================================================
+
+def test_pipeline_graph_is_compiled_once():
+    """Every caller gets the same compiled graph and every reuse is counted"""
+    from concurrent.futures import ThreadPoolExecutor
+    from pipeline.orchestrator import get_pipeline_graph, get_graph_stats
+    
+    graph = get_pipeline_graph()
+    assert get_pipeline_graph() is graph
+    before = get_graph_stats()["enrichment"]
+    
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        graphs = list(pool.map(lambda _: get_pipeline_graph(), range(2000)))
+    
+    after = get_graph_stats()["enrichment"]
+    assert all(other is graph for other in graphs)
+    assert after["builds"] == before["builds"] == 1
+    assert after["reuses"] == before["reuses"] + 2000
+    print("✅ Pipeline graph is compiled once and reuses are counted")
+
+
+def test_batch_processor_worker_pool():
+    """Results keep row order and a failing row does not stop the batch"""
+    import asyncio
+    import pandas as pd
+    import pipeline.orchestrator as orchestrator
+    from pipeline.batch_processor import BatchProcessor, run_coroutine_sync
+    
+    active = 0
+    peak = 0
+    
+    async def fake_run(row, row_id):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        try:
+            # Later rows finish first
+            await asyncio.sleep(0.002 * (10 - row["n"]))
+            if row["n"] == 4:
+                raise ValueError("bad row")
+            return {"row_id": row_id, "n": row["n"]}
+        finally:
+            active -= 1
+    
+    original = orchestrator.run_pipeline_for_row
+    orchestrator.run_pipeline_for_row = fake_run
+    try:
+        df = pd.DataFrame({"n": range(10), "vendor_name": "v", "product_name": "p"})
+        results = BatchProcessor(max_concurrent=3).process_batch_sync(df)
+    finally:
+        orchestrator.run_pipeline_for_row = original
+    
+    assert results["n"].tolist()[:4] == [0, 1, 2, 3] and results["n"].tolist()[5:] == [5, 6, 7, 8, 9]
+    assert results["row_id"][9] == "row_9"
+    assert results["error"][4] == "bad row" and results["product_name"][4] == "p"
+    assert peak == 3
+    
+    # Inside a running loop the original error surfaces, not one from cleanup
+    async def nested():
+        coro = asyncio.sleep(0)
+        try:
+            run_coroutine_sync(coro)
+        except RuntimeError as e:
+            return e
+        finally:
+            coro.close()
+    
+    error = asyncio.run(nested())
+    assert error is not None and "already running" in str(error) and error.__context__ is None
+    print("✅ BatchProcessor keeps row order and isolates failing rows")
+
+
+def test_batch_plan_dedupes_and_counts_real_calls():
+    """Each unique vendor, product and match key costs one call, and the plan counts exactly those"""
+    import asyncio
+    import pandas as pd
+    from config.reference import get_taxonomy_list, get_product_attributes_list
+    from pipeline.orchestrator import prefetch_unique_work, process_dataframe_batch
+    
+    df = pd.DataFrame([
+        ("Acme", "acme.com", "Acme CRM", "acme.com/crm"),
+        ("Acme", "acme.com", "Acme CRM", "acme.com/crm"),
+        ("Acme", "acme.com", "Acme Vault", "acme.com/vault"),
+        ("Beta", "beta.io", "Acme CRM", "beta.io/crm"),
+        ("Beta", "beta.io", "Beta Desk", "beta.io/desk"),
+        ("Beta", "beta.io", "Beta Desk", "beta.io/desk")
+    ], columns=["vendor_name", "vendor_url", "product_name", "product_url"])
+    match_stages = bool(get_taxonomy_list()) + bool(get_product_attributes_list())
+    
+    with fake_bedrock() as transport:
+        stats = asyncio.run(prefetch_unique_work(df, max_concurrent=3))
+        
+        assert len(transport.prompts("Extract vendor information")) == stats["unique_vendors"] == 2
+        assert len(transport.prompts("Analyze this product")) == stats["unique_products"] == 4
+        assert stats["unique_match_keys"] == 3
+        assert stats["llm_calls_planned"] == len(transport.requests) == 2 + 4 + 3 * match_stages
+        assert stats["llm_calls_saved"] == 6 * (2 + match_stages) - stats["llm_calls_planned"]
+        
+        # Rows dispatched after the plan only hit the cache
+        planned = len(transport.requests)
+        results = process_dataframe_batch(df, max_concurrent_rows=3)
+        assert len(transport.requests) == planned
+        assert results["legal_vendor_name"].tolist() == ["Acme Inc"] * 6
+    print("✅ Batch plan runs each unique key once and counts only the calls it makes")
+
+
+# =============================================================================
+# Streaming output
+# =============================================================================
+
+def test_chunk_encoder_header_stability():
+    """The CSV header is the fixed schema even when an error row finishes first"""
+    from pipeline.streaming import ChunkEncoder
+    from pipeline.orchestrator import get_output_columns
+    
+    encoder = ChunkEncoder("csv")
+    error_row = {"error": "boom", "row_id": "row_0", "vendor_name": "a", "product_name": "b"}
+    full_row = {column: f"value_{column}" for column in get_output_columns() if column != "error"}
+    
+    text = encoder.encode([error_row]) + encoder.encode([full_row])
+    rows = list(csv.reader(io.StringIO(text)))
+    
+    assert rows[0] == get_output_columns()
+    assert len(rows) == 3, "header must be written once"
+    assert dict(zip(rows[0], rows[2]))["legal_vendor_name"] == "value_legal_vendor_name"
+    assert dict(zip(rows[0], rows[1]))["error"] == "boom"
+    print("✅ ChunkEncoder header is stable across error and full rows")
+
+
+def test_output_columns_match_format_output_node():
+    """OUTPUT_COLUMNS lists exactly the keys format_output_node produces"""
+    from pipeline.nodes import OUTPUT_COLUMNS, format_output_node
+    from pipeline.orchestrator import build_initial_state
+    
+    result = format_output_node(build_initial_state({}, "row_0"))["result"]
+    assert tuple(result) == OUTPUT_COLUMNS
+    print("✅ OUTPUT_COLUMNS matches format_output_node")
+
+
+def test_incremental_json_parser():
+    """The first JSON value is cut out of streamed text however it is chunked"""
+    import json
+    from unittest import mock
+    from pipeline import json_stream
+    from pipeline.json_stream import IncrementalJSONParser
+    
+    response = '```json\n{"name": "a \\"quoted\\" {brace}", "path": "C:\\\\", "items": [1, {"x": "]"}]}\n```\nDone.'
+    expected = response[response.index("{"):response.rindex("}") + 1]
+    
+    # Every split point, so escapes, quotes and braces straddle chunk boundaries
+    for size in (1, 2, 3, 7):
+        parser = IncrementalJSONParser()
+        finished_at = None
+        for start in range(0, len(response), size):
+            if parser.feed(response[start:start + size]) and finished_at is None:
+                finished_at = start + size
+        assert parser.json_text == expected, size
+        assert finished_at < len(response), "completes before the stream ends"
+        assert parser.text == response
+    assert json.loads(expected)["name"] == 'a "quoted" {brace}'
+    
+    parser = IncrementalJSONParser()
+    assert not parser.feed('Here: [1, "a\\\\') and not parser.feed('", 2')
+    assert parser.feed('] trailing') and parser.json_text == '[1, "a\\\\", 2]'
+    
+    parser = IncrementalJSONParser()
+    assert not parser.feed("no json here") and parser.json_text is None
+    
+    # Each feed scans only its own chunk, so the text handed to the scanner
+    # adds up to the text fed, however many chunks it arrives in
+    class CountingPattern:
+        def __init__(self, pattern):
+            self.pattern = pattern
+            self.scanned = 0
+        
+        def finditer(self, text, *args):
+            self.scanned += len(text)
+            return self.pattern.finditer(text, *args)
+    
+    with mock.patch.object(json_stream, "_STRUCTURAL", CountingPattern(json_stream._STRUCTURAL)) as scanner:
+        parser = IncrementalJSONParser()
+        parser.feed("{")
+        for _ in range(4000):
+            parser.feed('"k": "v", ')
+        assert not parser.complete
+        assert scanner.scanned == len(parser.text) == 1 + 4000 * 10
+    print("✅ IncrementalJSONParser finds the value across any chunking, in linear time")
+
+
+def test_row_usage_columns():
+    """Each row gets its own calls, tokens and cost per stage; cached work costs a later row nothing"""
+    import asyncio
+    from unittest import mock
+    import pipeline.metrics as metrics
+    import pipeline.orchestrator as orchestrator
+    
+    prices = {
+        "LLM_PRICE_INPUT_SONNET": "2", "LLM_PRICE_OUTPUT_SONNET": "10",
+        "LLM_PRICE_INPUT_HAIKU": "1", "LLM_PRICE_OUTPUT_HAIKU": "5"
+    }
+    
+    def row(name):
+        return {
+            "vendor_name": f"{name} Inc",
+            "vendor_url": f"https://{name}.test",
+            "product_name": f"{name} CRM",
+            "product_url": f"https://{name}.test/crm"
+        }
+    
+    async def run_rows():
+        first = await asyncio.gather(
+            orchestrator.run_pipeline_for_row(row("acme"), "row_0"),
+            orchestrator.run_pipeline_for_row(row("bolt"), "row_1")
+        )
+        return [*first, await orchestrator.run_pipeline_for_row(row("acme"), "row_2")]
+    
+    saved = metrics._pipeline_metrics, orchestrator.ROW_USAGE_COLUMNS
+    orchestrator.ROW_USAGE_COLUMNS = True
+    try:
+        with mock.patch.dict(os.environ, prices):
+            metrics._pipeline_metrics = None
+            with reference_attributes(["CRM", "Pipeline Analytics", "Sales Forecasting"]), fake_bedrock() as transport:
+                results = asyncio.run(run_rows())
+    finally:
+        metrics._pipeline_metrics, orchestrator.ROW_USAGE_COLUMNS = saved
+    
+    # Three sonnet calls and one haiku call, each 1000 input and 100 output tokens
+    for result in results[:2]:
+        assert (result["llm_calls"], result["llm_input_tokens"], result["llm_output_tokens"]) == (4, 4000, 400)
+        assert result["llm_cost_usd"] == round(3 * (1000 * 2 + 100 * 10) / 1e6 + (1000 * 1 + 100 * 5) / 1e6, 6)
+        for stage in ("vendor_info", "product_info", "taxonomy", "attributes"):
+            assert (result[f"{stage}_input_tokens"], result[f"{stage}_output_tokens"]) == (1000, 100), stage
+        assert result["combined_matching_input_tokens"] == 0
+    assert len(transport.requests) == 8
+    
+    columns = metrics.RowUsage().columns()
+    assert {name: results[2][name] for name in columns} == columns, "a fully cached row costs nothing"
+    print("✅ Row usage columns attribute tokens and cost to the row that spent them")
+
+
+# =============================================================================
+# Reference data
+# =============================================================================
+
+def test_taxonomy_loader():
+    """taxonomy.csv loads into names, definitions, hierarchy levels and lookups"""
+    import pandas as pd
+    from config.reference import (
+        get_taxonomy_list,
+        get_taxonomy_with_definitions,
+        get_taxonomy_hierarchy,
+        find_taxonomy,
+        get_reference_stats
+    )
+    
+    source = pd.read_csv(os.path.join(os.environ["DATA_DIR"], "taxonomy.csv"), encoding="utf-8-sig", dtype=str)
+    source = source.dropna(subset=["Category"])
+    names = get_taxonomy_list()
+    assert len(names) == len(source) == get_reference_stats()["taxonomy_count"]
+    
+    first = source.iloc[0]
+    assert names[0] == f"{first['Category']} > {first['Subcategory']} > {first['Granular Category']}"
+    assert get_taxonomy_with_definitions()[0] == {"name": names[0], "definition": first["Definition"]}
+    assert get_taxonomy_hierarchy(names[0]) == {
+        "Category": first["Category"],
+        "Subcategory": first["Subcategory"],
+        "Granular Category": first["Granular Category"],
+        "Definition": first["Definition"]
+    }
+    
+    # Case, whitespace and separator spacing do not matter; unknown names do
+    assert find_taxonomy(names[5]) == names[5]
+    assert find_taxonomy("  " + names[5].upper().replace(" > ", ">") + " ") == names[5]
+    assert find_taxonomy("Software > Nothing Like This") is None
+    assert get_taxonomy_hierarchy("Software > Nothing Like This") is None
+    print("✅ Taxonomy loader builds names, definitions, hierarchy and lookups")
+
+
+def test_snapshot_round_trip():
+    """Tables, attributes and the name index survive a snapshot write and load"""
+    import tempfile
+    import numpy as np
+    import pandas as pd
+    from config.retrieval import ProductNameIndex
+    from config.snapshot import write_snapshot, load_snapshot
+    
+    products = pd.DataFrame({
+        "PRODUCT_NAME": ["Salesforce CRM", None, "Slack"],
+        "PRODUCT_ATTRIBUTES": ["CRM, Sales", "Storage", None],
+        "RANK": [1, 2, 3]
+    })
+    index = ProductNameIndex(products["PRODUCT_NAME"].tolist())
+    
+    with tempfile.TemporaryDirectory() as data_dir:
+        path = os.path.join(data_dir, "snapshot")
+        write_snapshot(path, data_dir, {"products": products}, ["CRM", "Sales", "Storage"], [1, 1, 1], index)
+        snapshot = load_snapshot(path, data_dir, tables=("products",))
+        
+        assert snapshot is not None
+        loaded = snapshot["products"]
+        assert loaded["PRODUCT_NAME"].tolist()[0::2] == ["Salesforce CRM", "Slack"]
+        assert pd.isna(loaded["PRODUCT_NAME"][1]) and pd.isna(loaded["PRODUCT_ATTRIBUTES"][2])
+        assert loaded["RANK"].tolist() == [1, 2, 3]
+        assert snapshot["product_attributes"] == ["CRM", "Sales", "Storage"]
+        assert np.array_equal(snapshot["product_attribute_counts"], [1, 1, 1])
+        assert snapshot["product_name_index"].search("slack") == index.search("slack") == [2]
+        
+        # A source CSV written after the snapshot makes it stale
+        with open(os.path.join(data_dir, "products.csv"), "w") as f:
+            f.write("PRODUCT_NAME\n")
+        assert load_snapshot(path, data_dir) is None
+    print("✅ Reference snapshot round-trips and detects stale sources")
+
+
+# =============================================================================
+# Caching
+# =============================================================================
+
+def test_sqlite_tier_round_trip():
+    """Writes flush in the background and a new manager reads them back asynchronously"""
+    import asyncio
+    import tempfile
+    import time
+    from pipeline.cache_manager import CacheManager, SQLiteCacheTier
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.db")
+        tier = SQLiteCacheTier(path, batch_size=2, flush_interval_seconds=60)
+        writer = CacheManager(disk_tier=tier)
+        writer.set({"name": "A"}, type="vendor", vendor_name="a")
+        writer.set({"name": "B"}, type="vendor", vendor_name="b")
+        
+        # A full batch wakes the flush thread; set() itself never writes
+        deadline = time.monotonic() + 5
+        while tier.write_count < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert tier.write_count == 2
+        
+        reader = CacheManager(disk_tier=SQLiteCacheTier(path))
+        value = asyncio.run(reader.get_async(type="vendor", vendor_name="b"))
+        assert value == {"name": "B"}
+        assert reader.disk_hit_count == 1
+        assert reader.get(type="vendor", vendor_name="b") == {"name": "B"}
+        assert reader.memory_hit_count == 1
+        assert asyncio.run(reader.get_async(type="vendor", vendor_name="missing")) is None
+        
+        reader.disk_tier.close()
+        tier.close()
+    print("✅ SQLite cache tier flushes in the background and reads back off the loop")
+
+
+def test_lru_response_cache_eviction():
+    """The LRU cache evicts least recently used entries by count and by bytes"""
+    from pipeline.bedrock_client import LRUResponseCache
+    
+    cache = LRUResponseCache(max_entries=2, max_bytes=1024)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    assert cache.get("a") == "1"
+    cache.set("c", "3")
+    assert cache.get("b") is None, "b was least recently used"
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+    assert cache.evictions == 1
+    
+    cache = LRUResponseCache(max_entries=10, max_bytes=30)
+    cache.set("k1", "x" * 10)
+    cache.set("k2", "x" * 10)
+    cache.set("k3", "x" * 10)
+    assert len(cache) == 2 and cache.get("k1") is None
+    assert cache.resident_bytes == 24
+    cache.set("huge", "x" * 100)
+    assert cache.get("huge") is None, "entries larger than the budget are not cached"
+    print("✅ LRUResponseCache evicts by recency within entry and byte limits")
+
+
+# =============================================================================
+# Concurrency
+# =============================================================================
+
+def test_single_flight():
+    """Concurrent calls share one run, failures reach every waiter, leader cancellation does not"""
+    import asyncio
+    from pipeline.singleflight import SingleFlight
+    
+    async def scenario():
+        flight = SingleFlight()
+        runs = []
+        
+        async def work():
+            runs.append(1)
+            await asyncio.sleep(0.05)
+            return len(runs)
+        
+        results = await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+        assert results == [1] * 5 and len(runs) == 1
+        assert flight.coalesced_count == 4
+        
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+        
+        outcomes = await asyncio.gather(*(flight.do("f", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(outcome, ValueError) for outcome in outcomes)
+        
+        runs.clear()
+        leader = asyncio.create_task(flight.do("c", work))
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(flight.do("c", work)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        outcomes = await asyncio.gather(leader, *followers, return_exceptions=True)
+        assert isinstance(outcomes[0], asyncio.CancelledError)
+        assert outcomes[1:] == [2, 2, 2], "one follower re-runs the work for the others"
+        assert flight.get_stats()["in_flight"] == 0
+    
+    asyncio.run(scenario())
+    print("✅ SingleFlight coalesces, propagates failures and survives leader cancellation")
+
+
+def test_adaptive_limiter():
+    """The limit grows on healthy calls, halves once per round of throttles and caps waiters"""
+    import asyncio
+    from pipeline.concurrency import AdaptiveLimiter
+    
+    async def scenario():
+        limiter = AdaptiveLimiter(initial_limit=4, min_limit=1, max_limit=6)
+        
+        # Each healthy call adds 1/limit, so about one round of calls adds a slot
+        for _ in range(5):
+            limiter.release(await limiter.acquire())
+        assert limiter.limit == 5 and limiter.increases == 1
+        
+        # Throttles from calls already in flight count as one decrease
+        starts = [await limiter.acquire() for _ in range(3)]
+        for started in starts:
+            limiter.release(started, throttled=True)
+        assert limiter.limit == 2 and limiter.decreases == 1
+        
+        # A call started after the decrease can trigger the next one
+        limiter.release(await limiter.acquire(), throttled=True)
+        limiter.release(await limiter.acquire(), throttled=True)
+        assert limiter.limit == 1, "never below min_limit"
+        
+        # Other failures leave the limit alone
+        limiter.release(await limiter.acquire(), failed=True)
+        assert limiter.limit == 1
+        
+        # Callers beyond the limit wait for a slot
+        active = 0
+        peak = 0
+        
+        async def call():
+            nonlocal active, peak
+            started = await limiter.acquire()
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            limiter.release(started, failed=True)
+        
+        await asyncio.gather(*(call() for _ in range(5)))
+        assert peak == 1 and limiter.in_flight == 0
+        assert limiter.get_stats()["waiting"] == 0
+    
+    asyncio.run(scenario())
+    print("✅ AdaptiveLimiter increases, backs off once per round and bounds concurrency")
+
+
+# =============================================================================
+# Transports
+# =============================================================================
+
+def test_transport_pool_sizing():
+    """Threads, botocore connections and httpx connections all match the concurrency cap"""
+    from unittest import mock
+    from pipeline.bedrock_client import BedrockLLMManager
+    from pipeline.transport import AsyncHTTPTransport
+    
+    transport = BedrockLLMManager(region_name="us-east-1", max_concurrent=12).transport
+    assert transport.pool_connections == 12
+    assert transport.client.meta.config.max_pool_connections == 12
+    assert transport.executor.max_workers == 12
+    
+    with mock.patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "test", "AWS_SECRET_ACCESS_KEY": "test"}):
+        transport = AsyncHTTPTransport("us-east-1", 20, 5.0, 5.0)
+    assert transport._shards == 3 and transport._limits.max_connections == 7, "20 connections over 3 clients of at most 8"
+    print("✅ Transport pools are sized to the concurrency cap")
+
+
+def test_async_transport_closes_loop_clients():
+    """Loops driven by iterate_sync and run_coroutine_sync close their httpx clients before shutting down"""
+    import asyncio
+    import threading
+    from unittest import mock
+    from pipeline.bedrock_client import get_llm_manager
+    from pipeline.batch_processor import run_coroutine_sync
+    from pipeline.streaming import iterate_sync
+    from pipeline.transport import AsyncHTTPTransport
+    
+    async def open_clients():
+        return [transport._client() for _ in range(transport._shards)]
+    
+    async def stream_clients():
+        yield await open_clients()
+        yield await open_clients()
+    
+    with mock.patch.dict(os.environ, {"AWS_ACCESS_KEY_ID": "test", "AWS_SECRET_ACCESS_KEY": "test"}):
+        transport = AsyncHTTPTransport("us-east-1", 16, 5.0, 5.0, endpoint_url="http://127.0.0.1:9")
+    
+    with fake_bedrock():
+        get_llm_manager().transport = transport
+        
+        # A stream stopped early still closes its loop's clients
+        stream = iterate_sync(stream_clients())
+        clients = next(stream)
+        assert not any(client.is_closed for client in clients)
+        stream.close()
+        assert all(client.is_closed for client in clients)
+        assert len(transport._clients) == 0
+        
+        # run_coroutine_sync on a loop it creates (no loop in a fresh thread)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(run_coroutine_sync(open_clients())))
+        thread.start()
+        thread.join()
+        assert len(results[0]) == 2 and all(client.is_closed for client in results[0])
+        assert len(transport._clients) == 0
+    print("✅ Per-loop httpx clients are closed before their loop shuts down")
+
+
+# =============================================================================
+# Retries and rate limits
+# =============================================================================
+
+def test_classify_error():
+    """Throttling and transient errors retry, including camelCase event-stream codes"""
+    import asyncio
+    from botocore.exceptions import ClientError
+    from pipeline.retry import classify_error, THROTTLED, RETRYABLE, FATAL
+    
+    def client_error(code, status=400):
+        return ClientError({"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, "InvokeModel")
+    
+    assert classify_error(client_error("ThrottlingException", 429)) == THROTTLED
+    assert classify_error(client_error("throttlingException")) == THROTTLED
+    assert classify_error(client_error("modelStreamErrorException")) == RETRYABLE
+    assert classify_error(client_error("internalServerException")) == RETRYABLE
+    assert classify_error(client_error("Unknown", 503)) == RETRYABLE
+    assert classify_error(client_error("validationException")) == FATAL
+    assert classify_error(client_error("")) == FATAL
+    assert classify_error(asyncio.TimeoutError()) == RETRYABLE
+    assert classify_error(ValueError("bad json")) == FATAL
+    print("✅ classify_error handles Bedrock and event-stream error codes")
+
+
+def test_rate_limiter_timeout():
+    """A wait longer than the timeout fails fast and hands its reservation back"""
+    import asyncio
+    from pipeline.rate_limit import ModelRateLimiter
+    
+    async def scenario():
+        limiter = ModelRateLimiter("sonnet", requests_per_minute=60, burst_seconds=1)
+        assert await limiter.acquire(10) == (0, 0)
+        
+        try:
+            await limiter.acquire(10, timeout=0.1)
+            raise AssertionError("expected a timeout")
+        except asyncio.TimeoutError:
+            pass
+        assert limiter.waits == 0
+        
+        # The refused call did not push the next one further back
+        waited, _ = await limiter.acquire(10, timeout=2)
+        assert 0 < waited <= 1
+    
+    asyncio.run(scenario())
+    print("✅ ModelRateLimiter refuses waits past the timeout without keeping the reservation")
+
+
+def test_rate_limiter_reservation_accounting():
+    """Usage is charged against the amount actually reserved; failed attempts hand their tokens back"""
+    import asyncio
+    from botocore.exceptions import ClientError
+    from pipeline.bedrock_client import get_llm_manager
+    from pipeline.rate_limit import ModelRateLimiter
+    
+    # 10 tokens per second, so refill is negligible while the checks run
+    limiter = ModelRateLimiter("sonnet", tokens_per_minute=600, burst_seconds=60)
+    waited, reserved = asyncio.run(limiter.acquire(5000))
+    assert (waited, reserved) == (0, 600), "an oversized call reserves one full bucket"
+    limiter.record_usage(reserved, 700, 50)
+    assert -150 <= limiter.tokens.level < -140
+    
+    throttles = 2
+    
+    def throttled_twice(prompt):
+        nonlocal throttles
+        if throttles:
+            throttles -= 1
+            raise ClientError({"Error": {"Code": "ThrottlingException"}, "ResponseMetadata": {"HTTPStatusCode": 429}}, "InvokeModel")
+        return '{"ok": true}'
+    
+    rate_limits = {"sonnet": {"tokens_per_minute": 600, "burst_seconds": 6000}}
+    with fake_bedrock(throttled_twice, rate_limits=rate_limits, backoff_base_seconds=0.01) as transport:
+        manager = get_llm_manager()
+        response = asyncio.run(manager.call_async("x" * 8000, model="sonnet"))
+        assert response and len(transport.requests) == 3
+        
+        # Only the successful attempt is charged: 1000 input + 100 output tokens
+        level = manager.rate_limiters["sonnet"].tokens.level
+        assert 60000 - 1100 <= level < 60000 - 1000
+    print("✅ ModelRateLimiter corrects usage against its reservation and refunds failed attempts")
+
+
+# =============================================================================
+# Retrieval
+# =============================================================================
+
+def test_bm25_index():
+    """BM25 ranks by shared terms, matches initialisms and falls back on weak queries"""
+    from config.retrieval import BM25Index
+    
+    index = BM25Index(
+        [
+            "Software > Customer Relationship Management",
+            "Software > Security > Identity and Access Management",
+            "Hardware > Storage"
+        ],
+        ["Manage sales pipelines and customer contacts", "Control user access and logins", None]
+    )
+    assert index.search("customer contacts", top_k=2)[0] == 0
+    assert index.search("CRM", top_k=1) == [0], "name initialisms are indexed"
+    assert index.search("identity access", top_k=3)[0] == 1
+    assert index.search("nothing matches", top_k=3) == []
+    assert index.shortlist("storage", top_k=1, min_hits=1) == ["Hardware > Storage"]
+    assert index.shortlist("nothing matches", top_k=1, fallback=["N/A"]) == ["N/A"]
+    print("✅ BM25Index ranks, expands initialisms and falls back")
+
+
+def test_name_resolver():
+    """NameResolver returns exact, near-miss and rejected matches with confidence"""
+    from config.retrieval import NameResolver
+    
+    names = ["Customer Relationship Management", "Identity and Access Management", "Data Storage"]
+    resolver = NameResolver(names)
+    assert resolver.resolve("  customer relationship MANAGEMENT ") == (names[0], 1.0)
+    
+    name, confidence = resolver.resolve("Identity & Access Managment")
+    assert name == names[1] and 0.6 <= confidence < 1.0
+    
+    name, confidence = resolver.resolve("Quantum Cooking")
+    assert name is None and confidence < 0.6
+    assert resolver.resolve("") == (None, 0.0)
+    assert resolver.resolve("qqq") == (None, 0.0), "no shared trigram, nothing scored"
+    print("✅ NameResolver resolves exact and near-miss names and rejects the rest")
+
+
+def test_product_name_index_prefix():
+    """Prefix matches come back shortest first, not alphabetically"""
+    from config.retrieval import ProductNameIndex
+    
+    index = ProductNameIndex(["Salesforce Analytics Cloud", "Salesforce", "Salesforce CRM", "Slack", None])
+    assert index.prefix("salesforce", limit=2) == [1, 2]
+    assert index.search("Salesforce", limit=3) == [1, 2, 0]
+    assert index.prefix("zz") == []
+    
+    # Only the first limit names of each length are visited, not the whole range
+    class CountingList(list):
+        reads = 0
+        
+        def __getitem__(self, key):
+            CountingList.reads += len(range(*key.indices(len(self)))) if isinstance(key, slice) else 1
+            return super().__getitem__(key)
+    
+    index = ProductNameIndex([f"Salesforce Edition {i:05d}" for i in range(20000)])
+    for names, rows in index._by_length.values():
+        names[:] = CountingList(names)
+    assert index.prefix("sales", limit=5) == [0, 1, 2, 3, 4]
+    assert CountingList.reads < 200
+    print("✅ ProductNameIndex prefix search returns the shortest names first")
+
+
+def test_product_name_index_token_overlap_ties():
+    """Rows tied at the top-k cut come back in row order"""
+    from config.retrieval import ProductNameIndex
+    
+    kinds = ["acme tool", "acme widget", "acme gizmo", "acme widget gizmo", "other"]
+    names = [f"{kinds[i * 7 % 5]} x{i}" for i in range(400)]
+    index = ProductNameIndex(names)
+    ranking = index.token_overlap("acme widget gizmo", limit=400)
+    for limit in (5, 54, 100, 170):
+        assert index.token_overlap("acme widget gizmo", limit) == ranking[:limit]
+    print("✅ ProductNameIndex token overlap keeps tied rows in row order at the cut")
+
+
+# =============================================================================
+# Matching
+# =============================================================================
+
+def test_attribute_shortlist_is_by_relevance():
+    """Relevant attributes reach the prompt wherever they sort; weak queries get the most popular"""
+    from pipeline import nodes
+    
+    filler = [f"Generic Capability {i:03d}" for i in range(300)]
+    relevant = [
+        "Zoned Sales Pipeline Forecasting", "Sales Pipeline Management", "Sales Forecasting",
+        "Pipeline Analytics", "Sales Territory Planning"
+    ]
+    attributes = sorted(filler + relevant)
+    counts = [attributes.index(name) % 7 for name in attributes]
+    with reference_attributes(attributes, counts):
+        state = {"product_name": "Acme Pipeline", "software_type": "Sales Forecasting Software"}
+        candidates = nodes.select_attribute_candidates(state)
+        assert set(candidates) == set(relevant), "only matching attributes, including ones late in the alphabet"
+        
+        fallback = nodes.select_attribute_candidates({"product_name": "Qwerty", "software_type": ""})
+        assert len(fallback) == nodes.ATTRIBUTE_FALLBACK_SIZE
+        assert [counts[attributes.index(name)] for name in fallback[:3]] == [6, 6, 6], "most used first"
+    print("✅ Attribute candidates are shortlisted by relevance, falling back to the most popular")
+
+
+def test_attribute_validation_uses_normalized_lookup():
+    """LLM attribute picks resolve by set membership, then by normalized name; others become N/A"""
+    from config.reference import get_product_attributes_set, find_product_attribute
+    from pipeline.nodes import validate_attribute_matches
+    
+    with reference_attributes(["CRM", "Data Loss Prevention", "Identity & Access"]):
+        assert isinstance(get_product_attributes_set(), frozenset)
+        assert find_product_attribute("CRM") == "CRM"
+        assert find_product_attribute(' "data  loss PREVENTION." ') == "Data Loss Prevention"
+        assert find_product_attribute("Quantum Cooking") is None
+        assert find_product_attribute("") is None
+        
+        matches = validate_attribute_matches(["crm", "Identity & Access", "Quantum Cooking"])
+        assert [m["Attribute Name"] for m in matches] == ["CRM", "Identity & Access", "N/A"]
+        assert [m["Confidence"] for m in matches][:2] == [1.0, 1.0]
+    print("✅ Attribute matches are validated against a set with normalized lookup")
+
+def test_combined_matching():
+    """One combined call per product serves both match lists; an unparseable answer falls back to split calls"""
+    import asyncio
+    from pipeline import nodes
+    from pipeline.orchestrator import parallel_matching_node
+    
+    def combined_response(prompt):
+        if "taxonomy_matches" not in prompt:
+            return fake_response(prompt)
+        taxonomy, attributes = (
+            re.findall(r"^\d+\. (.+)$", section, flags=re.MULTILINE)
+            for section in prompt[prompt.find("Available"):].split("Available Product Attributes:", 1)
+        )
+        return json.dumps({"taxonomy_matches": taxonomy[:2], "attribute_matches": attributes[:3]})
+    
+    async def match(products):
+        return [await parallel_matching_node({"product_name": name, "software_type": "CRM Software"}) for name in products]
+    
+    combined_marker = "taxonomy_matches"
+    split_markers = ("You are a taxonomy classification expert", "You are matching products to attributes")
+    saved = nodes.COMBINED_MATCHING
+    nodes.COMBINED_MATCHING = True
+    try:
+        with reference_attributes(["CRM", "Pipeline Analytics", "Sales Forecasting"]):
+            with fake_bedrock(combined_response) as transport:
+                results = asyncio.run(match(["Acme CRM", "Acme CRM", "Bolt CRM"]))
+                assert len(transport.prompts(combined_marker)) == 2, "one combined call per cache key"
+                assert len(transport.requests) == 2, "no split calls"
+                assert results[0] == results[1]
+                assert [m["Attribute Name"] for m in results[0]["attribute_matches"]] == ["CRM", "Pipeline Analytics", "Sales Forecasting"]
+                assert all(m["Taxonomy Name"] != "N/A" for m in results[0]["taxonomy_matches"])
+            
+            with fake_bedrock() as transport:
+                result, = asyncio.run(match(["Acme CRM"]))
+                assert len(transport.prompts(combined_marker)) == 1
+                assert [len(transport.prompts(marker)) for marker in split_markers] == [1, 1], "split calls after a bad parse"
+                assert [m["Attribute Name"] for m in result["attribute_matches"]] == ["CRM", "Pipeline Analytics", "Sales Forecasting"]
+    finally:
+        nodes.COMBINED_MATCHING = saved
+    print("✅ Combined matching makes one call per product and falls back to split calls")
+
+def test_group_by_candidates():
+    """Identical candidate lists share a group; groups close at max_size or when the merged list grows too much"""
+    from pipeline.packing import group_by_candidates
+    
+    lists = [["a", "b"], ["c", "d"], ["a", "b"], ["a", "b", "c"]]
+    assert group_by_candidates(lists, max_size=2) == [[0, 2], [3, 1]]
+    assert group_by_candidates(lists, max_size=10, max_growth=1.0) == [[0, 2, 3], [1]]
+    assert group_by_candidates([], max_size=4) == []
+    print("✅ Packing groups rows by shared candidates within size and growth limits")
+
+
+def test_packed_stage():
+    """Packs fit the output ceiling; missed or malformed rows are re-dispatched and invalid labels become N/A"""
+    import asyncio
+    from config.prompts import PROMPT_MAX_TOKENS
+    from pipeline.cache_manager import get_cache_manager
+    from pipeline.packing import ATTRIBUTE_STAGE as stage
+    
+    def packed_response(prompt):
+        entries = json.loads(fake_response(prompt))
+        if len(entries) == 5:
+            entries[0]["attributes"] = ["CRM", "Zzzz Qqqq"]
+            del entries[1]["attributes"]
+            del entries[2]
+            entries += ["junk", {"row_id": "99", "attributes": ["CRM"]}]
+        return json.dumps(entries)
+    
+    states = [{"product_name": f"Product {i:02d}", "software_type": "CRM Software"} for i in range(40)]
+    with reference_attributes(["CRM", "Pipeline Analytics", "Sales Forecasting"]):
+        with fake_bedrock(packed_response) as transport:
+            ceiling = 4096 // PROMPT_MAX_TOKENS["attribute_match"]
+            assert stage.max_pack_size() == ceiling
+            assert [len(group) for group in stage.group(states, 100)] == [ceiling, ceiling, 40 - 2 * ceiling]
+            
+            missed = asyncio.run(stage.run_pack(states[:5]))
+            names = sorted(state["product_name"] for state in missed)
+            assert names == ["Product 01", "Product 02"], "rows missing from the array or malformed go single-row"
+            assert asyncio.run(stage.pending(states[:5])) == [states[1], states[2]]
+            assert transport.requests[0]["max_tokens"] == 5 * PROMPT_MAX_TOKENS["attribute_match"]
+            
+            cached = asyncio.run(get_cache_manager().get_async(**stage._cache_key(states[0])))
+            assert [m["Attribute Name"] for m in cached] == ["CRM", "N/A", "N/A"]
+            
+            assert asyncio.run(stage.run_pack(states[5:])) == []
+            assert len(transport.requests) == 4, "an oversized pack is split to fit the ceiling"
+            assert all(request["max_tokens"] <= 4096 for request in transport.requests)
+    
+    with reference_attributes([]), fake_bedrock() as transport:
+        assert asyncio.run(stage.pending(states)) == []
+    print("✅ Packed requests stay under the output ceiling and re-dispatch the rows they miss")
+
+
+if __name__ == "__main__":
+    checks = [value for name, value in list(globals().items()) if name.startswith("test_") and callable(value)]
+    for check in checks:
+        check()
+    print(f"\n{len(checks)} checks passed")